@@ -1,8 +1,29 @@
 import pandas as pd
 import os
 import csv
+import events
+import wal
+import audit
+from tables import read_table, write_table, records_frame, table_name
+from metrics import instrument
+from student import grades_from_row
 
 
+# Results of the logged functions when their call cannot be logged (see wal.logged)
+def _failed(message):
+    return False, message
+
+
+def _failed_with_errors(message):
+    return False, message, []
+
+
+def _failed_printed(message):
+    print(message)
+    return False
+
+@wal.logged(tables=('users', 'passwords'), failure=_failed)
+@instrument
 def add_user(username, full_name, password, role, email=None, phone=None, address=None, department=None, level=None):
     """Add a new user to the system"""
     try:
@@ -16,11 +37,18 @@ def add_user(username, full_name, password, role, email=None, phone=None, addres
         
         # Check if username already exists
         if os.path.exists("data/passwords.csv"):
-            passwords_df = pd.read_csv("data/passwords.csv")
+            passwords_df = read_table("data/passwords.csv")
             if username in passwords_df['username'].values:
                 print("Username already exists")
                 return False
         
+        # Audit entries come first so a crash part way through cannot lose them
+        audit.record('users', username, [
+            (field, None, value) for field, value in zip(USER_COLUMNS[1:], [full_name, role, email, phone,
+                                                                             address, department, level])
+        ])
+        audit.record('passwords', username, [('password', None, password)])
+        
         # Add user to passwords.csv
         if not os.path.exists("data/passwords.csv"):
             with open("data/passwords.csv", 'w', newline='') as f:
@@ -41,11 +69,122 @@ def add_user(username, full_name, password, role, email=None, phone=None, addres
             writer = csv.writer(f)
             writer.writerow([username, full_name, role, email, phone, address, department, level])
         
+        events.publish(events.USER_CHANGED, username, fields={
+            'full_name': full_name, 'role': role, 'email': email, 'phone': phone,
+            'address': address, 'department': department, 'level': level
+        })
         print("User added successfully")
         return True
     except Exception as e:
         return False, f"Error adding user: {str(e)}"
 
+USER_COLUMNS = ['username', 'full_name', 'role', 'email', 'phone', 'address', 'department', 'level']
+PASSWORD_COLUMNS = ['username', 'password', 'role']
+IMPORT_COLUMNS = ['username', 'full_name', 'password', 'role', 'email', 'phone', 'address', 'department', 'level']
+
+
+def _existing_usernames():
+    """Get every username already present in passwords.csv or users.csv"""
+    existing = set()
+    for path in ("data/passwords.csv", "data/users.csv"):
+        if os.path.exists(path):
+            existing.update(read_table(path, usecols=['username'])['username'].dropna())
+    return existing
+
+
+def _validate_import(batch):
+    """
+    Validate every row of an import batch at once.
+    Returns:
+        Series of error messages aligned with the batch ('' for valid rows)
+    """
+    level = pd.to_numeric(batch['level'].replace('', None), errors='coerce')
+    required = batch[['username', 'full_name', 'password', 'role']]
+    checks = [
+        ((required == '').any(axis=1), "Username, full name, password, and role are required"),
+        (~batch['role'].isin(['admin', 'student']), "Role must be either 'admin' or 'student'"),
+        ((batch['level'] != '') & ~level.between(0, 4), "Level must be a number between 0 and 4"),
+        (batch['username'].duplicated(keep='first'), "Duplicate username in import"),
+        (batch['username'].isin(_existing_usernames()), "Username already exists"),
+    ]
+    
+    # Each row keeps the first error it hits
+    errors = pd.Series('', index=batch.index)
+    for mask, message in checks:
+        errors = errors.mask((errors == '') & mask, message)
+    return errors
+
+
+def _append_rows(path, columns, rows):
+    """Append rows to a CSV file, writing the header if the file is new"""
+    new_file = not os.path.exists(path)
+    write_table(rows[columns], path, mode='a', header=new_file)
+
+
+@wal.logged(files=('file_or_records',), tables=('users', 'passwords'), failure=_failed_with_errors)
+@instrument
+def import_users(file_or_records):
+    """
+    Add many users at once.
+    Args:
+        file_or_records: Path to a CSV file, a DataFrame, or an iterable of dictionaries
+            with the add_user fields
+    Returns:
+        Tuple of (success, message, errors) where errors lists
+        {'row', 'username', 'error'} for every rejected row
+    """
+    try:
+        batch = records_frame(file_or_records, IMPORT_COLUMNS)
+        errors = _validate_import(batch)
+        valid = batch[errors == '']
+        rejected = [
+            {'row': int(row), 'username': batch.at[row, 'username'], 'error': message}
+            for row, message in errors[errors != ''].items()
+        ]
+        
+        if valid.empty:
+            return False, "No valid users to import", rejected
+            
+        if not os.path.exists("data"):
+            os.makedirs("data")
+            
+        for table, columns in (('users', USER_COLUMNS), ('passwords', ['username', 'password'])):
+            created = valid[columns].melt(id_vars='username', var_name='field', value_name='new')
+            audit.record_frame(table, created.rename(columns={'username': 'key'}).assign(old=None))
+            
+        # Write both files as one unit: if either append fails, both are truncated back
+        paths = ["data/passwords.csv", "data/users.csv"]
+        sizes = {path: os.path.getsize(path) if os.path.exists(path) else None for path in paths}
+        try:
+            _append_rows("data/passwords.csv", PASSWORD_COLUMNS, valid)
+            _append_rows("data/users.csv", USER_COLUMNS, valid)
+        except Exception:
+            for path, size in sizes.items():
+                if size is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    with open(path, 'r+') as f:
+                        f.truncate(size)
+            raise
+            
+        events.publish_many(events.USER_CHANGED, (
+            (user['username'], {'fields': {key: user[key] for key in USER_COLUMNS if key != 'username'}})
+            for user in valid.to_dict('records')
+        ))
+        return True, f"Imported {len(valid)} users ({len(rejected)} rejected)", rejected
+    except Exception as e:
+        return False, f"Error importing users: {str(e)}", []
+
+def _removed_values(df, usernames, table):
+    """Audit changes for removing the rows of users from a table: every value becomes None"""
+    rows = df[df['username'].isin(usernames)].drop_duplicates('username')
+    values = rows.melt(id_vars='username', var_name='field', value_name='old').dropna(subset=['old'])
+    return table, values.rename(columns={'username': 'key'}).assign(new=None)
+
+
+@wal.logged(tables=('users', 'passwords', 'grades', 'eca'), failure=_failed)
+@instrument
 def remove_user(username):
     """Remove a user from the system"""
     try:
@@ -57,43 +196,81 @@ def remove_user(username):
         if not os.path.exists("data/users.csv"):
             return False, "User database not found"
         
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv")
         if username not in users_df['username'].values:
             return False, "User not found"
+        audit.record_frame(*_removed_values(users_df, [username], 'users'))
         
         # Remove from passwords.csv
         if os.path.exists("data/passwords.csv"):
-            passwords_df = pd.read_csv("data/passwords.csv")
+            passwords_df = read_table("data/passwords.csv")
             passwords_df = passwords_df[passwords_df['username'] != username]
-            passwords_df.to_csv("data/passwords.csv", index=False)
+            write_table(passwords_df, "data/passwords.csv")
         
         # Remove from users.csv
         users_df = users_df[users_df['username'] != username]
-        users_df.to_csv("data/users.csv", index=False)
+        write_table(users_df, "data/users.csv")
         
         # Remove from grades.csv
         if os.path.exists("data/grades.csv"):
-            grades_df = pd.read_csv("data/grades.csv")
+            grades_df = read_table("data/grades.csv")
+            audit.record_frame(*_removed_values(grades_df, [username], 'grades'))
             grades_df = grades_df[grades_df['username'] != username]
-            grades_df.to_csv("data/grades.csv", index=False)
+            write_table(grades_df, "data/grades.csv")
         
         # Remove from eca.csv
         if os.path.exists("data/eca.csv"):
-            eca_df = pd.read_csv("data/eca.csv")
+            eca_df = read_table("data/eca.csv")
             eca_df = eca_df[eca_df['username'] != username]
-            eca_df.to_csv("data/eca.csv", index=False)
+            write_table(eca_df, "data/eca.csv")
         
+        events.publish(events.USER_REMOVED, username)
         return True, "User removed successfully"
     except Exception as e:
         return False, f"Error removing user: {str(e)}"
 
+@wal.logged(tables=('users', 'passwords', 'grades', 'eca'), failure=_failed_with_errors)
+@instrument
+def remove_users(usernames):
+    """
+    Remove many users, reading and rewriting each file once.
+    Returns:
+        Tuple of (success, message, errors) where errors lists usernames that were not found
+    """
+    try:
+        usernames = {str(username).strip() for username in usernames if str(username).strip()}
+        if not usernames:
+            return False, "At least one username is required", []
+            
+        if not os.path.exists("data/users.csv"):
+            return False, "User database not found", []
+            
+        users_df = read_table("data/users.csv")
+        found = usernames & set(users_df['username'])
+        missing = [{'username': username, 'error': "User not found"} for username in sorted(usernames - found)]
+        if not found:
+            return False, "No matching users to remove", missing
+            
+        for path in ("data/passwords.csv", "data/users.csv", "data/grades.csv", "data/eca.csv"):
+            if os.path.exists(path):
+                df = users_df if path == "data/users.csv" else read_table(path)
+                if path in ("data/users.csv", "data/grades.csv"):
+                    audit.record_frame(*_removed_values(df, found, table_name(path)))
+                write_table(df[~df['username'].isin(found)], path)
+                
+        events.publish_many(events.USER_REMOVED, ((username, {}) for username in sorted(found)))
+        return True, f"Removed {len(found)} users ({len(missing)} not found)", missing
+    except Exception as e:
+        return False, f"Error removing users: {str(e)}", []
+
+@instrument
 def list_all_users():
     """List all users in the system"""
     try:
         if not os.path.exists("data/users.csv"):
             return []
         
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv", compact=True)
         if users_df.empty:
             return []
             
@@ -102,6 +279,7 @@ def list_all_users():
         print(f"Error listing users: {str(e)}")
         return []
 
+@instrument
 def get_user_details(username):
     """Get detailed information about a user"""
     try:
@@ -112,7 +290,7 @@ def get_user_details(username):
         if not os.path.exists("data/users.csv"):
             return None
         
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv", compact=True)
         if users_df.empty:
             return None
             
@@ -126,27 +304,34 @@ def get_user_details(username):
         print(f"Error getting user details: {str(e)}")
         return None
 
+@wal.logged(tables=('users',), failure=_failed_printed)
+@instrument
 def update_user(username, data):
     """Update user information."""
     try:
         if not os.path.exists("data/users.csv"):
             return False
             
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv")
         if username not in users_df['username'].values:
             return False
             
+        old = users_df.loc[users_df['username'] == username].iloc[0]
         for key, value in data.items():
             if key in users_df.columns:
                 users_df.loc[users_df['username'] == username, key] = value
                 
-        users_df.to_csv("data/users.csv", index=False)
+        audit.record('users', username, [(key, old[key], value) for key, value in data.items() if key in users_df.columns])
+        write_table(users_df, "data/users.csv")
+        events.publish(events.USER_CHANGED, username, fields=data)
         return True
         
     except Exception as e:
         print(f"Error updating user: {e}")
         return False
 
+@wal.logged(tables=('users', 'passwords'), failure=_failed)
+@instrument
 def modify_student_data(username, data):
     """Modify student data"""
     try:
@@ -156,7 +341,7 @@ def modify_student_data(username, data):
         if not os.path.exists('data/users.csv'):
             return False, "Users file not found"
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv')
         if users_df.empty:
             return False, "Users file is empty"
             
@@ -173,18 +358,20 @@ def modify_student_data(username, data):
                 return False, "Level must be a number"
                 
         # Update user information
+        old = users_df.loc[users_df['username'] == username].iloc[0]
         for key, value in data.items():
             if key in users_df.columns:
                 users_df.loc[users_df['username'] == username, key] = value
                 
-        users_df.to_csv('data/users.csv', index=False)
+        audit.record('users', username, [(key, old[key], value) for key, value in data.items() if key in users_df.columns])
+        write_table(users_df, 'data/users.csv')
         
         # Update password if provided
         if 'password' in data:
             if not os.path.exists('data/passwords.csv'):
                 return False, "Passwords file not found"
                 
-            passwords_df = pd.read_csv('data/passwords.csv')
+            passwords_df = read_table('data/passwords.csv')
             if passwords_df.empty:
                 return False, "Passwords file is empty"
                 
@@ -192,13 +379,19 @@ def modify_student_data(username, data):
                 return False, "User not found in passwords file"
                 
             passwords_df.loc[passwords_df['username'] == username, 'password'] = data['password']
-            passwords_df.to_csv('data/passwords.csv', index=False)
+            audit.record('passwords', username, [('password', None, data['password'])])
+            write_table(passwords_df, 'data/passwords.csv')
             
+        events.publish(events.USER_CHANGED, username, fields={
+            key: value for key, value in data.items() if key != 'password'
+        })
         return True, "Student data updated successfully"
         
     except Exception as e:
         return False, f"Error updating student data: {str(e)}"
     
+@wal.logged(tables=('users',), failure=_failed)
+@instrument
 def update_student_profile(username, data):
     """Update student profile information"""
     try:
@@ -208,19 +401,24 @@ def update_student_profile(username, data):
         if not os.path.exists('data/users.csv'):
             return False, "Users file not found"
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv')
         if username not in users_df['username'].values:
             return False, "User not found"
             
+        old = users_df.loc[users_df['username'] == username].iloc[0]
         for key, value in data.items():
             if key in users_df.columns:
                 users_df.loc[users_df['username'] == username, key] = value
                 
-        users_df.to_csv('data/users.csv', index=False)
+        audit.record('users', username, [(key, old[key], value) for key, value in data.items() if key in users_df.columns])
+        write_table(users_df, 'data/users.csv')
+        events.publish(events.USER_CHANGED, username, fields=data)
         return True, "Profile updated successfully"
     except Exception as e:
         return False, f"Error updating profile: {str(e)}"
 
+@wal.logged(tables=('grades',), failure=_failed)
+@instrument
 def update_student_grades(username, grades_data):
     """Update student grades using pandas for efficient data manipulation"""
     try:
@@ -236,14 +434,16 @@ def update_student_grades(username, grades_data):
         if not os.path.exists('data/users.csv'):
             return False, "Users file not found"
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv')
         if username not in users_df['username'].values:
             return False, "Student not found"
             
-        grades_df = pd.read_csv('data/grades.csv')
+        grades_df = read_table('data/grades.csv')
+        old_grades = {}
         
         # Check if student already exists in the grades file
         if username in grades_df['username'].values:
+            old_grades = grades_df.loc[grades_df['username'] == username].iloc[0].to_dict()
             # Update grades for the existing student
             for subject, data in grades_data.items():
                 try:
@@ -289,13 +489,20 @@ def update_student_grades(username, grades_data):
                 except (ValueError, TypeError) as e:
                     return False, f"Invalid data for {subject}: {str(e)}"
         
+        audit.record('grades', username, [
+            (subject, old_grades.get(subject), float(data.get('grade', 0))) for subject, data in grades_data.items()
+        ])
         # Save to CSV
-        grades_df.to_csv('data/grades.csv', index=False)
+        write_table(grades_df, 'data/grades.csv')
+        for subject, data in grades_data.items():
+            events.publish(events.GRADE_CHANGED, username, subject=subject, grade=float(data.get('grade', 0)))
         return True, "Grades updated successfully"
         
     except Exception as e:
         return False, f"Error updating grades: {str(e)}"
     
+@wal.logged(tables=('eca',), failure=_failed)
+@instrument
 def update_student_eca(username, eca_data):
     """Update student extracurricular activities using pandas"""
     try:
@@ -305,7 +512,7 @@ def update_student_eca(username, eca_data):
         if not os.path.exists('data/eca.csv'):
             pd.DataFrame(columns=['username', 'activity', 'role', 'hours_per_week', 'description']).to_csv('data/eca.csv', index=False)
             
-        eca_df = pd.read_csv('data/eca.csv')
+        eca_df = read_table('data/eca.csv')
         
         # Remove existing ECA for this student
         eca_df = eca_df[eca_df['username'] != username]
@@ -324,30 +531,33 @@ def update_student_eca(username, eca_data):
         
         # Concatenate and save
         eca_df = pd.concat([eca_df, new_eca], ignore_index=True)
-        eca_df.to_csv('data/eca.csv', index=False)
+        write_table(eca_df, 'data/eca.csv')
+        events.publish(events.ECA_CHANGED, username, records=new_eca.to_dict('records'))
         return True, "ECA updated successfully"
     except Exception as e:
         return False, f"Error updating ECA: {str(e)}"
 
+@instrument
 def get_all_students():
     """Get all users"""
     try:
         if not os.path.exists('data/users.csv'):
             return []
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv', compact=True)
         return users_df.to_dict('records')
     except Exception as e:
         print(f"Error fetching users: {str(e)}")
         return []
 
+@instrument
 def get_student_details(username):
     """Get detailed student information"""
     try:
         if not os.path.exists('data/users.csv'):
             return None
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv', compact=True)
         student = users_df[users_df['username'] == username]
         
         if student.empty:
@@ -357,29 +567,17 @@ def get_student_details(username):
         
         # Get grades if they exist
         if os.path.exists('data/grades.csv'):
-            grades_df = pd.read_csv('data/grades.csv')
+            grades_df = read_table('data/grades.csv', compact=True)
             
             # Check if the student exists in the grades file
             if username in grades_df['username'].values:
                 # Get the student's row
                 student_row = grades_df[grades_df['username'] == username].iloc[0]
-                
-                # Convert to the expected format (list of dictionaries with subject and grade)
-                grades = []
-                for column in grades_df.columns:
-                    if column != 'username':  # Skip the username column
-                        grade_value = student_row[column]
-                        if pd.notna(grade_value):  # Check if the grade is not NaN
-                            grades.append({
-                                'subject': column,
-                                'grade': float(grade_value)
-                            })
-                
-                student_data['grades'] = grades
+                student_data['grades'] = grades_from_row(student_row, grades_df.columns)
             
         # Get ECA if they exist
         if os.path.exists('data/eca.csv'):
-            eca_df = pd.read_csv('data/eca.csv')
+            eca_df = read_table('data/eca.csv', compact=True)
             student_eca = eca_df[eca_df['username'] == username]
             student_data['eca'] = student_eca.to_dict('records')
             
@@ -0,0 +1,425 @@
+"""
+Command-line interface for the admin operations, for scripts and cron jobs on
+machines without a display. Tk is never imported and matplotlib only for the
+charts command.
+
+Every command prints one JSON object to stdout. Exit codes: 0 on success,
+1 when the operation failed, 2 for invalid arguments.
+
+Changes are recorded in the audit log (see audit.py) as made by
+cli:<login name>, or by the user given with --actor. Commands that change
+the tables first finish changes interrupted by a crash (see wal.recover);
+read-only commands do not wait for the write-ahead log.
+
+Usage: python -m admin_cli [--actor NAME] <command> [options]
+    add-user USERNAME FULL_NAME ROLE [--password-stdin] [--email ...] [--phone ...] ...
+                             The password is asked for, or read from stdin
+    remove-user USERNAME
+    add-grade USERNAME SUBJECT GRADE
+    add-eca USERNAME ACTIVITY ROLE HOURS [--description ...]
+    list-users
+    stats
+    charts
+    risk [--top N]           Students ranked by risk score (see risk.py)
+    grading [--scale NAME] [--credits SUBJECT=WEIGHT ...]
+                             Show or change the grading scale and subject credits
+    check [--repair] [--limit N]
+                             Check the tables against each other (see integrity.py)
+    snapshot [--list] [--prune KEEP]
+                             Take a snapshot of the tables (see snapshots.py)
+    restore [SNAPSHOT_OR_TIME]
+                             Restore the latest snapshot taken at or before a time
+                             (ISO 8601 or epoch seconds, as snapshot --list shows)
+    shard [--key COLUMN] [--status] [--off]
+                             Partition grades and ECA by department or campus (see shards.py)
+    audit [--user NAME] [--actor NAME] [--since TIME] [--until TIME] [--page N]
+                             Changes to grades and profiles, newest first
+    import-users FILE        CSV with the add-user fields
+    import-grades FILE       CSV with username,subject,grade
+    import-eca FILE          CSV with username,activity,role,hours_per_week,description
+    remove-users FILE        Text file with one username per line
+"""
+import os
+import sys
+import json
+import getpass
+import argparse
+import contextlib
+import io
+from datetime import datetime, timezone
+
+
+class _Echo(io.TextIOBase):
+    """Writes to stderr and keeps the lines written, so failures can be explained"""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        sys.stderr.write(text)
+        self.lines.extend(line.strip() for line in text.splitlines() if line.strip())
+        return len(text)
+
+
+def _result(value, default_message, output=()):
+    """
+    Normalise the different return conventions of the data functions.
+    Args:
+        value: The return value: a (success, message[, errors]) tuple or a bool
+        default_message: Message on success when the function gives none
+        output: Lines printed by the function; a failure is explained by the last one
+    """
+    if isinstance(value, tuple):
+        result = {'success': bool(value[0]), 'message': value[1] if len(value) > 1 else default_message}
+        if len(value) > 2:
+            result['errors'] = value[2]
+        return result
+    if value:
+        return {'success': True, 'message': default_message}
+    return {'success': False, 'message': output[-1] if output else "Operation failed"}
+
+
+def _run(default_message, function, *args):
+    """Call a data function, echoing what it prints to stderr, and normalise its result"""
+    echo = _Echo()
+    with contextlib.redirect_stdout(echo):
+        value = function(*args)
+    return _result(value, default_message, echo.lines)
+
+
+def _read_password(args):
+    """The new user's password, from stdin with --password-stdin or else asked for"""
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip("\n")
+    return getpass.getpass(f"Password for {args.username}: ")
+
+
+def cmd_add_user(args):
+    from admin import add_user
+    password = _read_password(args)
+    if not password:
+        return {'success': False, 'message': "Password cannot be empty"}
+    return _run("User added successfully", add_user, args.username, args.full_name, password, args.role,
+                args.email, args.phone, args.address, args.department, args.level)
+
+
+def cmd_remove_user(args):
+    from admin import remove_user
+    return _run("User removed successfully", remove_user, args.username)
+
+
+def cmd_add_grade(args):
+    from student import add_student_grade
+    return _run(f"Grade added for {args.username} in {args.subject}",
+                add_student_grade, args.username, args.subject, args.grade)
+
+
+def cmd_add_eca(args):
+    from student import add_student_eca
+    return _run(f"ECA added for {args.username}: {args.activity}",
+                add_student_eca, args.username, args.activity, args.role, args.hours, args.description)
+
+
+def cmd_list_users(args):
+    from admin import list_all_users
+    users = list_all_users()
+    return {'success': True, 'message': f"{len(users)} users", 'users': users}
+
+
+def cmd_stats(args):
+    from mat import StudentAnalytics
+    stats = StudentAnalytics(chunksize=args.chunksize).get_overall_statistics()
+    if stats is None:
+        return {'success': False, 'message': "Could not compute statistics"}
+    return {'success': True, 'message': "Overall statistics", 'statistics': stats}
+
+
+def cmd_charts(args):
+    import matplotlib
+    matplotlib.use('Agg')
+    from mat import StudentAnalytics
+    analytics = StudentAnalytics()
+    charts = {
+        'grades_distribution': analytics.create_overall_grades_distribution(),
+        'subject_performance': analytics.create_subject_performance_comparison(),
+        'eca_distribution': analytics.create_eca_distribution(),
+        'hours_distribution': analytics.create_hours_distribution()
+    }
+    created = {name: path for name, path in charts.items() if path}
+    return {'success': bool(created), 'message': f"Created {len(created)} charts", 'charts': charts}
+
+
+def cmd_risk(args):
+    from risk import score_students
+    ranked = score_students()
+    if ranked is None:
+        return {'success': False, 'message': "Could not score students"}
+    return {'success': True, 'message': f"{len(ranked)} students at risk",
+            'students': ranked.head(args.top).to_dict('records')}
+
+
+def cmd_grading(args):
+    import grading
+    from mat import StudentAnalytics
+    if args.scale:
+        success, message = grading.set_scale(args.scale)
+        if not success:
+            return {'success': False, 'message': message}
+    if args.credits:
+        try:
+            credits = dict(item.split('=', 1) for item in args.credits)
+        except ValueError:
+            return {'success': False, 'message': "Credits must be given as SUBJECT=WEIGHT"}
+        success, message = grading.set_credits(credits)
+        if not success:
+            return {'success': False, 'message': message}
+    settings = grading.load_settings()
+    gpas = StudentAnalytics().get_all_gpas()
+    if gpas is None:
+        return {'success': False, 'message': "Could not compute GPAs"}
+    scale = grading.get_scale(settings=settings)
+    return {'success': True, 'message': f"Grading scale {scale.name}", 'scale': scale.name,
+            'scales': grading.scale_names(settings), 'bands': scale.bands, 'credits': settings['credits'],
+            'students': int(gpas.notna().sum()), 'mean_gpa': gpas.mean()}
+
+
+def cmd_check(args):
+    import integrity
+    if args.repair:
+        success, message, issues = integrity.repair()
+        if issues is None:
+            return {'success': False, 'message': message}
+    else:
+        issues = integrity.check()
+        if issues is None:
+            return {'success': False, 'message': "Could not check the tables"}
+        success = issues.empty
+        message = f"Found {len(issues)} issues" if len(issues) else "No issues found"
+    return {'success': success, 'message': message,
+            'counts': issues.groupby(['table', 'check']).size().rename('issues').reset_index().to_dict('records'),
+            'issues': issues.head(args.limit).to_dict('records')}
+
+
+def cmd_snapshot(args):
+    import snapshots
+    if args.list:
+        manifests = snapshots.list_snapshots()
+        return {'success': True, 'message': f"{len(manifests)} snapshots", 'snapshots': [
+            {'id': manifest['id'], 'time': manifest['time'],
+             'bytes': sum(entry['size'] for entry in manifest['tables'].values())}
+            for manifest in manifests
+        ]}
+    if args.prune is not None:
+        return _run("Snapshots deleted", snapshots.prune, args.prune)
+    success, message, manifest = snapshots.take_snapshot()
+    result = {'success': success, 'message': message}
+    if manifest:
+        result['id'] = manifest['id']
+    return result
+
+
+def cmd_restore(args):
+    import snapshots
+    point = args.point
+    try:
+        # Epoch seconds, as listed by snapshot --list
+        point = float(point) if point is not None else None
+    except ValueError:
+        pass
+    return _run("Snapshot restored", snapshots.restore, point)
+
+
+def cmd_shard(args):
+    import shards
+    store = shards.get_store()
+    if args.off:
+        store.disable()
+        return {'success': True, 'message': "Sharding turned off"}
+    if not args.status:
+        success, message = store.build(args.key)
+        if not success:
+            return {'success': False, 'message': message}
+    manifest = store.ensure_current()
+    if manifest is None:
+        return {'success': True, 'message': "The tables are not sharded"}
+    return {'success': True, 'message': f"{len(manifest['shards'])} shards by {manifest['key']}", 'shards': [
+        {'shard': shard, 'value': manifest['shards'][shard],
+         'bytes': sum(os.path.getsize(store.shard_path(shard, table)) for table in shards.SHARDED_TABLES
+                      if os.path.exists(store.shard_path(shard, table)))}
+        for shard in store.shards()
+    ]}
+
+
+def _epoch(value):
+    """Epoch seconds of an ISO 8601 time (UTC unless it has an offset)"""
+    if value is None:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def cmd_audit(args):
+    import audit
+    import pandas as pd
+    page_size = audit.PAGE_SIZE
+    entries, total = audit.query(key=args.user, actor=args.actor_filter, since=_epoch(args.since),
+                                 until=_epoch(args.until), offset=(args.page - 1) * page_size, limit=page_size)
+    entries['time'] = pd.to_datetime(entries['time'], unit='s', utc=True).astype(str)
+    return {'success': True, 'message': f"{total} changes, page {args.page} of {max(-(-total // page_size), 1)}",
+            'total': total, 'changes': entries.to_dict('records')}
+
+
+def cmd_import_users(args):
+    from admin import import_users
+    return _run("Users imported", import_users, args.file)
+
+
+def cmd_import_grades(args):
+    from student import import_grades
+    return _run("Grades imported", import_grades, args.file)
+
+
+def cmd_import_eca(args):
+    from student import import_eca
+    return _run("Activities imported", import_eca, args.file)
+
+
+def cmd_remove_users(args):
+    from admin import remove_users
+    with open(args.file) as f:
+        usernames = [line.strip() for line in f if line.strip()]
+    return _run("Users removed", remove_users, usernames)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m admin_cli",
+                                     description="Student Profile Management admin commands")
+    parser.add_argument('--actor', help="User recorded in the audit log (default: cli:<login name>)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('add-user', help="Add a user")
+    command.add_argument('username')
+    command.add_argument('full_name')
+    command.add_argument('role', choices=['admin', 'student'])
+    command.add_argument('--password-stdin', action='store_true', help="Read the password from stdin")
+    for option in ('email', 'phone', 'address', 'department', 'level'):
+        command.add_argument(f'--{option}')
+    command.set_defaults(handler=cmd_add_user)
+
+    command = commands.add_parser('remove-user', help="Remove a user and their grades and ECA")
+    command.add_argument('username')
+    command.set_defaults(handler=cmd_remove_user)
+
+    command = commands.add_parser('add-grade', help="Add or update a grade")
+    command.add_argument('username')
+    command.add_argument('subject')
+    command.add_argument('grade')
+    command.set_defaults(handler=cmd_add_grade)
+
+    command = commands.add_parser('add-eca', help="Add or update an extracurricular activity")
+    command.add_argument('username')
+    command.add_argument('activity')
+    command.add_argument('role')
+    command.add_argument('hours')
+    command.add_argument('--description', default="")
+    command.set_defaults(handler=cmd_add_eca)
+
+    command = commands.add_parser('list-users', help="List all users")
+    command.set_defaults(handler=cmd_list_users)
+
+    command = commands.add_parser('stats', help="Overall statistics")
+    command.add_argument('--chunksize', type=int, help="Rows read at a time")
+    command.set_defaults(handler=cmd_stats)
+
+    command = commands.add_parser('charts', help="Create the overall charts in data/charts")
+    command.set_defaults(handler=cmd_charts)
+
+    command = commands.add_parser('risk', help="Students ranked by risk score")
+    command.add_argument('--top', type=int, default=50, help="Number of students to list")
+    command.set_defaults(handler=cmd_risk)
+
+    command = commands.add_parser('grading', help="Show or change the grading scale and subject credits")
+    command.add_argument('--scale', help="Grading scale to use")
+    command.add_argument('--credits', nargs='+', metavar='SUBJECT=WEIGHT', help="Credit weights of subjects")
+    command.set_defaults(handler=cmd_grading)
+
+    command = commands.add_parser('check', help="Check the tables for integrity issues")
+    command.add_argument('--repair', action='store_true', help="Apply every repair that can be made")
+    command.add_argument('--limit', type=int, default=100, help="Number of issues to list")
+    command.set_defaults(handler=cmd_check)
+
+    command = commands.add_parser('snapshot', help="Take, list or delete snapshots of the tables")
+    command.add_argument('--list', action='store_true', help="List the snapshots")
+    command.add_argument('--prune', type=int, metavar='KEEP', help="Delete all but the newest KEEP snapshots")
+    command.set_defaults(handler=cmd_snapshot)
+
+    command = commands.add_parser('restore', help="Restore the tables from a snapshot")
+    command.add_argument('point', nargs='?',
+                         help="Snapshot id, ISO time or epoch seconds (default: the latest snapshot)")
+    command.set_defaults(handler=cmd_restore)
+
+    command = commands.add_parser('shard', help="Partition the grades and ECA tables by a users column")
+    command.add_argument('--key', default='department', help="Users column to partition by (default: department)")
+    command.add_argument('--status', action='store_true', help="Only list the shards")
+    command.add_argument('--off', action='store_true', help="Remove the shards and read the whole tables again")
+    command.set_defaults(handler=cmd_shard)
+
+    command = commands.add_parser('audit', help="List changes to grades and profiles")
+    command.add_argument('--user', help="Only changes to this user")
+    command.add_argument('--actor', dest='actor_filter', help="Only changes made by this user")
+    command.add_argument('--since', help="Only changes at or after this ISO time")
+    command.add_argument('--until', help="Only changes at or before this ISO time")
+    command.add_argument('--page', type=int, default=1, help="Page of results")
+    command.set_defaults(handler=cmd_audit)
+
+    for name, handler, help_text in (
+        ('import-users', cmd_import_users, "Add users from a CSV file"),
+        ('import-grades', cmd_import_grades, "Add grades from a CSV file"),
+        ('import-eca', cmd_import_eca, "Add activities from a CSV file"),
+        ('remove-users', cmd_remove_users, "Remove the users listed in a file"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('file')
+        command.set_defaults(handler=handler)
+
+    return parser
+
+
+# Commands that change the tables
+WRITE_COMMANDS = {'add-user', 'remove-user', 'add-grade', 'add-eca', 'import-users', 'import-grades',
+                  'import-eca', 'remove-users'}
+
+
+def _writes(args):
+    """Whether a command changes the tables (a snapshot should not keep a half-applied change either)"""
+    if args.command == 'check':
+        return args.repair
+    if args.command == 'snapshot':
+        return not args.list and args.prune is None
+    return args.command in WRITE_COMMANDS
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    import audit
+    try:
+        # The data functions report progress with print(); keep stdout for the JSON result
+        with contextlib.redirect_stdout(sys.stderr), audit.acting_as(args.actor or f"cli:{getpass.getuser()}"):
+            # Finish changes interrupted by a crash before making new ones
+            if _writes(args):
+                import wal
+                replayed = wal.recover()
+                if replayed:
+                    print(f"Recovered {replayed} interrupted changes from the write-ahead log")
+            result = args.handler(args)
+    except Exception as e:
+        result = {'success': False, 'message': str(e)}
+    from tables import json_safe
+    print(json.dumps(json_safe(result), indent=2, default=str))
+    return 0 if result['success'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,48 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from admin import add_user, remove_user, list_all_users, get_user_details
 from student import add_student_grade, add_student_eca, get_student_grades, get_student_eca
 from mat import StudentAnalytics
+from view_utils import TreeviewSync
+from ranking import format_ranks
+from sparse_grades import read_grades
+import events
+import risk
+import grading
+import audit
+import metrics
+import profiling
+from metrics import instrument
+from profiling import profiled
 from PIL import Image, ImageTk
+import pandas as pd
+import time
 import os
 
+# How often to check the event log for changes made by other processes
+POLL_INTERVAL_MS = 1000
+# Periods of the audit log filter, in days (None for no limit)
+AUDIT_PERIODS = {'All time': None, 'Last day': 1, 'Last week': 7, 'Last 30 days': 30}
+# Students listed in the Overall Statistics leaderboard
+TOP_STUDENTS = 5
+# Rows shown in the At-Risk Students tab; Treeview slows down with many more
+RISK_DISPLAY_LIMIT = 500
+
 class AdminView:
     """
     Admin View - Main interface for administrators to manage the system.
     This class creates a window with multiple tabs for different administrative tasks.
     """
     
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, username=None):
         """
         Initialize the Admin View window.
         Args:
             parent: The parent window (if any)
+            username: The logged-in admin, recorded in the audit log as making this window's changes
         """
+        self.username = username
+        
         # Create the main window
         self.root = tk.Toplevel(parent) if parent else tk.Tk()
         self.root.title("Admin Dashboard")
@@ -32,10 +57,61 @@ class AdminView:
         # Create all the UI elements
         self._create_interface()
         
+        # Keep the dashboard in step with changes made here or in other processes
+        self._pending_changes = set()
+        self._unsubscribers = [
+            events.subscribe(event_type, self._on_change)
+            for event_type in events.EVENT_TYPES
+        ]
+        self._event_watcher = events.EventLogWatcher()
+        self.root.bind('<Destroy>', self._on_destroy, add='+')
+        self._watch_events()
+        
         # Start the main loop if this is the main window
         if not parent:
             self.root.mainloop()
     
+    def _watch_events(self):
+        """Poll the event log for changes made by other processes"""
+        self._event_watcher.poll()
+        if metrics.is_enabled():
+            self._load_metrics()
+        if profiling.is_enabled():
+            self._load_profiles()
+        self._watch_job = self.root.after(POLL_INTERVAL_MS, self._watch_events)
+    
+    def _on_destroy(self, event):
+        """Stop listening for changes once the window is closed"""
+        if event.widget is not self.root:
+            return
+        for unsubscribe in self._unsubscribers:
+            unsubscribe()
+        self.root.after_cancel(self._watch_job)
+    
+    def _on_change(self, event):
+        """Queue a change event; a burst of events is applied in one refresh"""
+        if not self._pending_changes:
+            self.root.after_idle(self._apply_pending_changes)
+        self._pending_changes.add((event.type, event.username))
+    
+    def _apply_pending_changes(self):
+        """Refresh only the parts of the dashboard affected by queued changes"""
+        changes, self._pending_changes = self._pending_changes, set()
+        types = {event_type for event_type, _ in changes}
+        usernames = {username for _, username in changes}
+        
+        if types & {events.USER_CHANGED, events.USER_REMOVED}:
+            self._load_users()
+            self._load_student_list()
+        elif self.student_selector.get() in usernames:
+            self._refresh_student_stats()
+        
+        if types & {events.GRADE_CHANGED, events.ECA_CHANGED, events.USER_REMOVED}:
+            self._refresh_overall_stats()
+        elif events.USER_CHANGED in types:
+            # A department or level change moves students between groups
+            self._load_groups()
+    
     def _center_window(self):
         """Center the window on the screen"""
         screen_width = self.root.winfo_screenwidth()
@@ -57,6 +133,11 @@ class AdminView:
         self._create_add_eca_tab(tab_container)
         self._create_student_stats_tab(tab_container)
         self._create_overall_stats_tab(tab_container)
+        self._create_risk_tab(tab_container)
+        self._create_grading_tab(tab_container)
+        self._create_audit_tab(tab_container)
+        self._create_metrics_tab(tab_container)
+        self._create_profiles_tab(tab_container)
         
         # Add logout button
         logout_btn = ttk.Button(self.root, text="Logout", command=self._handle_logout)
@@ -81,6 +162,7 @@ class AdminView:
         
         # Create the treeview (list)
         self.users_list = ttk.Treeview(parent, columns=columns, show='headings')
+        self.users_sync = TreeviewSync(self.users_list)
         
         # Set up each column
         for col in columns:
@@ -336,6 +418,9 @@ class AdminView:
         self._create_chart_tab(chart_tabs, "Subject Performance", 'subjects')
         self._create_chart_tab(chart_tabs, "ECA Distribution", 'eca')
         self._create_chart_tab(chart_tabs, "Hours Distribution", 'hours')
+        self._create_chart_tab(chart_tabs, "Subject Correlation", 'correlation')
+        self._create_chart_tab(chart_tabs, "ECA vs Grades", 'activity_correlation')
+        self._create_group_stats_tab(chart_tabs)
         
         # Load initial data
         self._refresh_overall_stats()
@@ -359,27 +444,292 @@ class AdminView:
             self.eca_chart = canvas
         elif chart_type == 'hours':
             self.hours_chart = canvas
+        elif chart_type == 'correlation':
+            self.correlation_chart = canvas
+        elif chart_type == 'activity_correlation':
+            self.activity_correlation_chart = canvas
+    
+    def _create_group_stats_tab(self, parent):
+        """Create a tab of statistics by department, drilling down to level and subject"""
+        # Create tab frame
+        tab = ttk.Frame(parent)
+        parent.add(tab, text="By Department")
+        
+        # Create the drill-down tree; departments expand into levels, levels into subjects
+        columns = ('Students', 'Grades', 'Average', 'Std Dev', 'ECA Hours')
+        self.group_stats = ttk.Treeview(tab, columns=columns, show='tree headings')
+        self.group_stats.heading('#0', text='Department / Level / Subject')
+        self.group_stats.column('#0', width=220)
+        for col in columns:
+            self.group_stats.heading(col, text=col)
+            self.group_stats.column(col, width=80, anchor='e')
+        self.group_stats.bind('<<TreeviewOpen>>', self._open_group)
+        self.group_stats.bind('<<TreeviewClose>>', self._close_group)
+        # Item id -> (department, level) path of the group, and the paths expanded
+        self.group_paths = {}
+        self.open_groups = set()
+        
+        scrollbar = ttk.Scrollbar(tab, orient='vertical', command=self.group_stats.yview)
+        self.group_stats.configure(yscrollcommand=scrollbar.set)
+        self.group_stats.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+    
+    def _open_group(self, event):
+        """Load the groups below an expanded department or level"""
+        item = self.group_stats.focus()
+        if item in self.group_paths:
+            self.open_groups.add(self.group_paths[item])
+            self._load_groups(item)
+    
+    def _close_group(self, event):
+        item = self.group_stats.focus()
+        self.open_groups.discard(self.group_paths.get(item))
+    
+    def _load_groups(self, parent=''):
+        """Fill a node of the drill-down tree from the rollup cube, reloading expanded nodes"""
+        path = self.group_paths.get(parent, ())
+        stats = self.analytics.get_group_statistics(*path)
+        for child in self.group_stats.get_children(parent):
+            self._forget_groups(child)
+            self.group_stats.delete(child)
+        if stats is None:
+            return
+        
+        dimension = ('department', 'level', 'subject')[len(path)]
+        for row in stats.to_dict('records'):
+            value = row[dimension]
+            if pd.isna(value):
+                label, value = f"(No {dimension})", None
+            else:
+                label = f"Level {value:g}" if dimension == 'level' else value
+            values = (
+                row.get('students', ''),
+                int(row['grade_count']) if pd.notna(row['grade_count']) else 0,
+                f"{row['mean_grade']:.2f}" if pd.notna(row['mean_grade']) else 'N/A',
+                f"{row['std_dev']:.2f}" if pd.notna(row['std_dev']) else 'N/A',
+                f"{row['total_hours']:g}" if 'total_hours' in row else ''
+            )
+            child_path = path + (value,)
+            expanded = child_path in self.open_groups
+            item = self.group_stats.insert(parent, 'end', text=label, values=values, open=expanded)
+            # Subjects and groups without a value (which cannot be selected) are leaves
+            if dimension != 'subject' and value is not None:
+                self.group_paths[item] = child_path
+                if expanded:
+                    self._load_groups(item)
+                else:
+                    # Placeholder so that the node can be expanded
+                    self.group_stats.insert(item, 'end', text='...')
+    
+    def _forget_groups(self, item):
+        """Drop the paths of a node and its descendants before it is deleted"""
+        self.group_paths.pop(item, None)
+        for child in self.group_stats.get_children(item):
+            self._forget_groups(child)
+    
+    def _create_risk_tab(self, parent):
+        """Create the At-Risk Students tab"""
+        # Create the tab frame
+        tab = ttk.Frame(parent, padding="10")
+        parent.add(tab, text="At-Risk Students")
+        
+        # Create controls
+        controls = ttk.Frame(tab)
+        controls.pack(fill='x', pady=5)
+        ttk.Button(controls, text="Score Students", command=self._refresh_risk).pack(side='left', padx=5)
+        ttk.Button(controls, text="Save Grade Baseline", command=self._save_risk_baseline).pack(side='left', padx=5)
+        self.risk_summary = ttk.Label(controls, text="Press 'Score Students' to find at-risk students")
+        self.risk_summary.pack(side='left', padx=10)
+        
+        # Create the ranked list
+        columns = ('Rank', 'Username', 'Full Name', 'Department', 'Score', 'GPA', 'ECA Hours', 'Reasons')
+        self.risk_list = ttk.Treeview(tab, columns=columns, show='headings')
+        self.risk_sync = TreeviewSync(self.risk_list)
+        widths = {'Rank': 50, 'Score': 60, 'GPA': 60, 'ECA Hours': 80, 'Reasons': 400}
+        for col in columns:
+            self.risk_list.heading(col, text=col)
+            self.risk_list.column(col, width=widths.get(col, 110))
+        
+        scrollbar = ttk.Scrollbar(tab, orient='vertical', command=self.risk_list.yview)
+        self.risk_list.configure(yscrollcommand=scrollbar.set)
+        self.risk_list.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+    
+    def _create_grading_tab(self, parent):
+        """Create the Grading tab for choosing the grading scale and subject credits"""
+        # Create the tab frame
+        tab = ttk.Frame(parent, padding="10")
+        parent.add(tab, text="Grading")
+        
+        # Create the scale selector
+        controls = ttk.Frame(tab)
+        controls.pack(fill='x', pady=5)
+        ttk.Label(controls, text="Grading scale:").pack(side='left', padx=5)
+        self.scale_var = tk.StringVar(value=grading.load_settings()['scale'])
+        self.scale_selector = ttk.Combobox(controls, textvariable=self.scale_var, state='readonly',
+                                           values=grading.scale_names())
+        self.scale_selector.pack(side='left', padx=5)
+        self.scale_selector.bind('<<ComboboxSelected>>', lambda event: self._show_scale())
+        ttk.Button(controls, text="Apply Scale", command=self._apply_scale).pack(side='left', padx=5)
+        self.gpa_summary = ttk.Label(controls, text="")
+        self.gpa_summary.pack(side='left', padx=10)
+        
+        # Create the bands of the selected scale (left) and the subject credits (right)
+        columns = ('Letter', 'From %', 'Points')
+        self.bands_list = ttk.Treeview(tab, columns=columns, show='headings', height=15)
+        for col in columns:
+            self.bands_list.heading(col, text=col)
+            self.bands_list.column(col, width=90)
+        self.bands_list.pack(side='left', fill='y', pady=5)
+        
+        credits_panel = ttk.LabelFrame(tab, text="Subject Credits", padding="10")
+        credits_panel.pack(side='left', fill='both', expand=True, padx=10, pady=5)
+        self.credits_list = ttk.Treeview(credits_panel, columns=('Subject', 'Credits'), show='headings', height=12)
+        self.credits_sync = TreeviewSync(self.credits_list)
+        for col in ('Subject', 'Credits'):
+            self.credits_list.heading(col, text=col)
+            self.credits_list.column(col, width=150)
+        self.credits_list.pack(fill='both', expand=True)
+        self.credits_list.bind('<<TreeviewSelect>>', self._select_credit)
+        
+        form = ttk.Frame(credits_panel)
+        form.pack(fill='x', pady=5)
+        self.credit_subject = tk.StringVar()
+        self.credit_weight = tk.StringVar(value='1')
+        ttk.Label(form, text="Subject:").pack(side='left')
+        ttk.Entry(form, textvariable=self.credit_subject, width=20).pack(side='left', padx=5)
+        ttk.Label(form, text="Credits:").pack(side='left')
+        ttk.Entry(form, textvariable=self.credit_weight, width=6).pack(side='left', padx=5)
+        ttk.Button(form, text="Set Credits", command=self._set_credits).pack(side='left', padx=5)
+        
+        self._show_scale()
+        self._load_credits()
+    
+    def _create_audit_tab(self, parent):
+        """Create the Audit Log tab for browsing changes to grades and profiles"""
+        # Create the tab frame
+        tab = ttk.Frame(parent, padding="10")
+        parent.add(tab, text="Audit Log")
+        
+        # Create the filters
+        filters = ttk.Frame(tab)
+        filters.pack(fill='x', pady=5)
+        self.audit_user = tk.StringVar()
+        self.audit_actor = tk.StringVar()
+        self.audit_period = tk.StringVar(value='All time')
+        ttk.Label(filters, text="Student/user:").pack(side='left', padx=5)
+        ttk.Entry(filters, textvariable=self.audit_user, width=15).pack(side='left')
+        ttk.Label(filters, text="Changed by:").pack(side='left', padx=5)
+        ttk.Entry(filters, textvariable=self.audit_actor, width=15).pack(side='left')
+        ttk.Combobox(filters, textvariable=self.audit_period, state='readonly', width=12,
+                     values=list(AUDIT_PERIODS)).pack(side='left', padx=5)
+        ttk.Button(filters, text="Search", command=lambda: self._load_audit(0)).pack(side='left', padx=5)
+        
+        # Create the list of changes
+        columns = ('Time', 'Changed By', 'Table', 'User', 'Field', 'Old Value', 'New Value')
+        self.audit_list = ttk.Treeview(tab, columns=columns, show='headings', height=20)
+        self.audit_sync = TreeviewSync(self.audit_list)
+        widths = {'Time': 140, 'Table': 70, 'Field': 100}
+        for col in columns:
+            self.audit_list.heading(col, text=col)
+            self.audit_list.column(col, width=widths.get(col, 120))
+        self.audit_list.pack(fill='both', expand=True, pady=5)
+        
+        # Create the pager
+        pager = ttk.Frame(tab)
+        pager.pack(fill='x')
+        ttk.Button(pager, text="< Newer", command=lambda: self._load_audit(self.audit_page - 1)).pack(side='left', padx=5)
+        self.audit_page_label = ttk.Label(pager, text="")
+        self.audit_page_label.pack(side='left', padx=10)
+        ttk.Button(pager, text="Older >", command=lambda: self._load_audit(self.audit_page + 1)).pack(side='left', padx=5)
+        
+        self.audit_page = 0
+        self.audit_pages = 1
+        self._load_audit(0)
+    
+    def _create_metrics_tab(self, parent):
+        """Create the Metrics tab showing per-function timings and CSV I/O"""
+        # Create the tab frame
+        tab = ttk.Frame(parent, padding="10")
+        parent.add(tab, text="Metrics")
+        
+        # Create controls
+        controls = ttk.Frame(tab)
+        controls.pack(fill='x', pady=5)
+        self.metrics_enabled = tk.BooleanVar(value=metrics.is_enabled())
+        ttk.Checkbutton(controls, text="Collect metrics", variable=self.metrics_enabled,
+                        command=self._toggle_metrics).pack(side='left', padx=5)
+        ttk.Button(controls, text="Reset", command=self._reset_metrics).pack(side='left', padx=5)
+        ttk.Button(controls, text="Export JSON", command=lambda: self._export_metrics('json')).pack(side='left', padx=5)
+        ttk.Button(controls, text="Export Prometheus", command=lambda: self._export_metrics('prometheus')).pack(side='left', padx=5)
+        
+        # Create the metrics list
+        columns = ('Function', 'Calls', 'Mean (ms)', 'p99 (ms)', 'Total (s)',
+                   'Bytes Read', 'Rows Read', 'Bytes Written', 'Table Reads')
+        self.metrics_list = ttk.Treeview(tab, columns=columns, show='headings')
+        self.metrics_sync = TreeviewSync(self.metrics_list)
+        for col in columns:
+            self.metrics_list.heading(col, text=col)
+            self.metrics_list.column(col, width=260 if col == 'Function' else 80)
+        
+        scrollbar = ttk.Scrollbar(tab, orient='vertical', command=self.metrics_list.yview)
+        self.metrics_list.configure(yscrollcommand=scrollbar.set)
+        self.metrics_list.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        self._load_metrics()
+    
+    def _create_profiles_tab(self, parent):
+        """Create the Profiles tab listing the profiles of recent dashboard actions"""
+        # Create the tab frame
+        tab = ttk.Frame(parent, padding="10")
+        parent.add(tab, text="Profiles")
+        
+        # Create controls
+        controls = ttk.Frame(tab)
+        controls.pack(fill='x', pady=5)
+        self.profiling_enabled = tk.BooleanVar(value=profiling.is_enabled())
+        ttk.Checkbutton(controls, text="Profile actions", variable=self.profiling_enabled,
+                        command=self._toggle_profiling).pack(side='left', padx=5)
+        ttk.Button(controls, text="Refresh", command=self._load_profiles).pack(side='left', padx=5)
+        
+        # Create the list of profiles (left) and the selected summary (right)
+        columns = ('Time', 'Action')
+        self.profiles_list = ttk.Treeview(tab, columns=columns, show='headings', height=20)
+        self.profiles_sync = TreeviewSync(self.profiles_list)
+        for col in columns:
+            self.profiles_list.heading(col, text=col)
+            self.profiles_list.column(col, width=150)
+        self.profiles_list.pack(side='left', fill='y')
+        self.profiles_list.bind('<<TreeviewSelect>>', self._show_profile)
+        
+        self.profile_display = tk.Text(tab, wrap='none', font=('Courier', 9))
+        self.profile_display.pack(side='right', fill='both', expand=True, padx=5)
+        
+        self._profiles = {}
+        self._load_profiles()
     
     # Data handling methods
+    @instrument
     def _load_users(self):
         """Load the list of users"""
-        # Clear existing items
-        for item in self.users_list.get_children():
-            self.users_list.delete(item)
-        
         # Load users from database
         users = list_all_users()
-        if users:
-            for user in users:
-                self.users_list.insert('', 'end', values=(
-                    user['username'],
-                    user['full_name'],
-                    user['role'],
-                    user.get('email', ''),
-                    user.get('department', ''),
-                    user.get('level', '')
-                ))
+        
+        # Apply only the inserted, changed and removed rows, keyed by username
+        self.users_sync.sync(
+            (user['username'], (
+                user['username'],
+                user['full_name'],
+                user['role'],
+                user.get('email', ''),
+                user.get('department', ''),
+                user.get('level', '')
+            ))
+            for user in users
+        )
     
+    @instrument
     def _load_student_list(self):
         """Load the list of students for the selector"""
         users = list_all_users()
@@ -387,9 +737,13 @@ class AdminView:
             students = [user['username'] for user in users if user['role'] == 'student']
             self.student_selector['values'] = students
             if students:
-                self.student_selector.set(students[0])
+                # Keep the current selection if the student still exists
+                if self.student_selector.get() not in students:
+                    self.student_selector.set(students[0])
                 self._refresh_student_stats()
     
+    @profiled
+    @instrument
     def _refresh_student_stats(self):
         """Refresh the statistics for the selected student"""
         username = self.student_selector.get()
@@ -411,6 +765,7 @@ class AdminView:
         gpa = self.analytics.calculate_gpa(username)
         grade_stats = self.analytics.get_grade_statistics(username)
         eca_summary = self.analytics.get_eca_summary(username)
+        ranks = self.analytics.get_class_rank(username)
         
         # Display statistics
         stats_text = f"""Student: {username}
@@ -426,6 +781,12 @@ Min: {grade_stats['min']}
 Max: {grade_stats['max']}
 Standard Deviation: {grade_stats['std_dev']}
 
+"""
+        
+        if ranks:
+            stats_text += f"""Class Rank:
+{format_ranks(ranks)}
+
 """
         
         if eca_summary:
@@ -448,6 +809,8 @@ Total Hours per Week: {eca_summary['total_hours']}
         
         self._display_chart(self.chart_canvas, chart_path)
     
+    @profiled
+    @instrument
     def _refresh_overall_stats(self):
         """Refresh the overall statistics and charts"""
         # Get statistics
@@ -475,6 +838,11 @@ Total Hours: {stats['total_hours']:.2f}
 Unique Activities: {stats['unique_activities']}
 Unique Subjects: {stats['unique_subjects']}
 """
+        top_students = self.analytics.get_top_students(TOP_STUDENTS)
+        if top_students:
+            stats_text += "\nTop Students (average grade):\n" + "\n".join(
+                f"{rank}. {username}: {grade:.2f}" for rank, (username, grade) in enumerate(top_students, start=1)
+            ) + "\n"
         self.overall_stats_display.delete('1.0', tk.END)
         self.overall_stats_display.insert(tk.END, stats_text)
         
@@ -483,6 +851,171 @@ Unique Subjects: {stats['unique_subjects']}
         self._display_chart(self.subjects_chart, self.analytics.create_subject_performance_comparison())
         self._display_chart(self.eca_chart, self.analytics.create_eca_distribution())
         self._display_chart(self.hours_chart, self.analytics.create_hours_distribution())
+        # Both heatmaps come from one computation of the matrices
+        matrices = self.analytics.get_correlation_matrices()
+        self._display_chart(self.correlation_chart, self.analytics.create_subject_correlation_heatmap(matrices))
+        self._display_chart(self.activity_correlation_chart,
+                            self.analytics.create_activity_correlation_heatmap(matrices))
+        self._load_groups()
+    
+    @instrument
+    def _refresh_risk(self):
+        """Score all students and show the highest-risk ones"""
+        ranked = risk.score_students()
+        if ranked is None:
+            messagebox.showerror("Error", "Failed to score students")
+            return
+        
+        shown = ranked.head(RISK_DISPLAY_LIMIT)
+        # Keyed by rank so that rows stay in ranked order when scores change
+        self.risk_sync.sync(
+            (rank, (
+                rank,
+                row.username,
+                row.full_name,
+                row.department,
+                f"{row.score:g}",
+                f"{row.gpa:.2f}" if pd.notna(row.gpa) else 'N/A',
+                f"{row.eca_hours:g}",
+                row.reasons
+            ))
+            for rank, row in enumerate(shown.itertuples(index=False), start=1)
+        )
+        self.risk_summary.config(text=f"{len(ranked)} students at risk"
+                                      + (f" (top {len(shown)} shown)" if len(shown) < len(ranked) else ""))
+    
+    def _save_risk_baseline(self):
+        """Save the current average grades as the baseline for detecting falling grades"""
+        if not messagebox.askyesno("Confirm", "Save every student's current average grade as the baseline?"):
+            return
+        success, message = risk.save_baseline()
+        if success:
+            messagebox.showinfo("Success", message)
+        else:
+            messagebox.showerror("Error", message)
+    
+    def _show_scale(self):
+        """Show the bands of the scale chosen in the selector"""
+        scale = grading.get_scale(self.scale_var.get())
+        self.bands_list.delete(*self.bands_list.get_children())
+        if scale.divisor:
+            self.bands_list.insert('', 'end', values=('-', '0-100', f"grade / {scale.divisor:g}"))
+        for edge, letter, points in scale.bands:
+            self.bands_list.insert('', 'end', values=(letter, f"{edge:g}", f"{points:.1f}"))
+    
+    def _load_credits(self):
+        """List every subject with its credit weight"""
+        credits = grading.load_settings()['credits']
+        subjects = sorted(set(read_grades().column_names) | set(credits))
+        self.credits_sync.sync((subject, (subject, f"{credits.get(subject, 1):g}")) for subject in subjects)
+    
+    def _select_credit(self, event):
+        selection = self.credits_list.selection()
+        if selection:
+            subject, weight = self.credits_list.item(selection[0])['values']
+            self.credit_subject.set(subject)
+            self.credit_weight.set(weight)
+    
+    def _set_credits(self):
+        """Save the credit weight of a subject and recompute the GPAs"""
+        subject = self.credit_subject.get().strip()
+        if not subject:
+            messagebox.showerror("Error", "Please enter a subject")
+            return
+        success, message = grading.set_credits({subject: self.credit_weight.get()})
+        if not success:
+            messagebox.showerror("Error", message)
+            return
+        self._load_credits()
+        self._recompute_gpas()
+    
+    def _apply_scale(self):
+        """Switch to the chosen grading scale and recompute the GPAs"""
+        success, message = grading.set_scale(self.scale_var.get())
+        if not success:
+            messagebox.showerror("Error", message)
+            return
+        self._recompute_gpas()
+    
+    @instrument
+    def _recompute_gpas(self):
+        """Recompute every GPA in one pass and refresh the views showing GPAs"""
+        start = time.perf_counter()
+        gpas = self.analytics.get_all_gpas()
+        elapsed = time.perf_counter() - start
+        if gpas is None:
+            self.gpa_summary.config(text="Could not compute GPAs")
+            return
+        graded = gpas.dropna()
+        self.gpa_summary.config(
+            text=f"{grading.load_settings()['scale']}: {len(graded)} GPAs in {elapsed * 1000:.0f} ms"
+                 + (f", mean {graded.mean():.2f}" if len(graded) else ""))
+        self._refresh_student_stats()
+    
+    def _load_metrics(self):
+        """Show the collected metrics, slowest functions (by total time) first"""
+        stats = metrics.snapshot()
+        ordered = sorted(stats.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        self.metrics_sync.sync(
+            (name, (
+                name,
+                entry['calls'],
+                f"{entry['mean_seconds'] * 1000:.2f}",
+                f"{entry['p99_seconds'] * 1000:.0f}" if entry['p99_seconds'] != float('inf') else '>10000',
+                f"{entry['seconds']:.3f}",
+                entry['bytes_read'],
+                entry['rows_read'],
+                entry['bytes_written'],
+                ', '.join(f"{table}: {count}" for table, count in sorted(entry['reads'].items()))
+            ))
+            for name, entry in ordered
+        )
+    
+    def _load_profiles(self):
+        """Show the saved profiles, newest last (new rows are appended)"""
+        profiles = profiling.list_profiles(profiling.MAX_PROFILES)
+        self._profiles = {profile['path']: profile for profile in profiles}
+        self.profiles_sync.sync(
+            (profile['path'], (profile['time'].strftime('%Y-%m-%d %H:%M:%S'), profile['action']))
+            for profile in reversed(profiles)
+        )
+    
+    @instrument
+    def _load_audit(self, page):
+        """Show a page of the audit log for the current filters, newest changes first"""
+        page = min(max(page, 0), self.audit_pages - 1) if page else 0
+        days = AUDIT_PERIODS[self.audit_period.get()]
+        entries, total = audit.query(
+            key=self.audit_user.get().strip() or None,
+            actor=self.audit_actor.get().strip() or None,
+            since=time.time() - days * 86400 if days else None,
+            offset=page * audit.PAGE_SIZE, limit=audit.PAGE_SIZE
+        )
+        self.audit_page = page
+        self.audit_pages = max(-(-total // audit.PAGE_SIZE), 1)
+        self.audit_page_label.config(text=f"Page {page + 1} of {self.audit_pages} ({total} changes)")
+        self.audit_sync.sync(
+            (str(position), (
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])),
+                entry['actor'],
+                entry['table'],
+                entry['key'],
+                entry['field'],
+                '' if entry['old'] is None else entry['old'],
+                '' if entry['new'] is None else entry['new']
+            ))
+            for position, entry in enumerate(entries.to_dict('records'))
+        )
+    
+    def _show_profile(self, event=None):
+        """Show the summary of the selected profile"""
+        selected = self.profiles_list.selection()
+        if not selected:
+            return
+        path = next((key for key, item in self.profiles_sync.item_ids.items() if item == selected[0]), None)
+        self.profile_display.delete('1.0', tk.END)
+        if path in self._profiles:
+            self.profile_display.insert(tk.END, profiling.read_summary(self._profiles[path]))
     
     def _display_chart(self, canvas, chart_path):
         """Display a chart in the given canvas"""
@@ -507,6 +1040,39 @@ Unique Subjects: {stats['unique_subjects']}
             canvas.delete("all")  # Clear canvas on error
     
     # Action handlers
+    def _toggle_metrics(self):
+        """Turn metrics collection on or off"""
+        if self.metrics_enabled.get():
+            metrics.enable()
+        else:
+            metrics.disable()
+        self._load_metrics()
+    
+    def _toggle_profiling(self):
+        """Turn profiling of dashboard actions on or off"""
+        if self.profiling_enabled.get():
+            profiling.enable()
+        else:
+            profiling.disable()
+    
+    def _reset_metrics(self):
+        """Discard the collected metrics"""
+        metrics.reset()
+        self._load_metrics()
+    
+    def _export_metrics(self, format):
+        """Save the collected metrics as JSON or Prometheus text"""
+        extension = '.json' if format == 'json' else '.prom'
+        path = filedialog.asksaveasfilename(defaultextension=extension, initialfile=f"metrics{extension}")
+        if not path:
+            return
+        try:
+            with open(path, 'w') as f:
+                f.write(metrics.to_json() if format == 'json' else metrics.to_prometheus())
+            messagebox.showinfo("Success", f"Metrics saved to {path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save metrics: {e}")
+    
     def _handle_logout(self):
         """Handle the logout action"""
         if messagebox.askyesno("Logout", "Are you sure you want to logout?"):
@@ -549,7 +1115,9 @@ Unique Subjects: {stats['unique_subjects']}
         
         username = self.users_list.item(selected[0])['values'][0]
         if messagebox.askyesno("Confirm", f"Are you sure you want to remove user '{username}'?"):
-            if remove_user(username):
+            with audit.acting_as(self.username):
+                removed = remove_user(username)
+            if removed:
                 messagebox.showinfo("Success", "User removed successfully")
                 self._load_users()
             else:
@@ -566,17 +1134,19 @@ Unique Subjects: {stats['unique_subjects']}
             return
         
         # Add user
-        if add_user(
-            data['username'],
-            data['full_name'],
-            data['password'],
-            data['role'],
-            data['email'],
-            data['phone'],
-            data['address'],
-            data['department'],
-            data['level']
-        ):
+        with audit.acting_as(self.username):
+            added = add_user(
+                data['username'],
+                data['full_name'],
+                data['password'],
+                data['role'],
+                data['email'],
+                data['phone'],
+                data['address'],
+                data['department'],
+                data['level']
+            )
+        if added:
             messagebox.showinfo("Success", "User added successfully")
             # Clear form
             for var in self.user_form_vars.values():
@@ -607,7 +1177,9 @@ Unique Subjects: {stats['unique_subjects']}
             return
         
         # Add grade
-        if add_student_grade(data['username'], data['subject'], grade):
+        with audit.acting_as(self.username):
+            added = add_student_grade(data['username'], data['subject'], grade)
+        if added:
             messagebox.showinfo("Success", f"Grade {grade} added successfully for {data['username']} in {data['subject']}")
             # Clear form
             for var in self.grade_form_vars.values():
@@ -636,13 +1208,15 @@ Unique Subjects: {stats['unique_subjects']}
             return
         
         # Add ECA
-        if add_student_eca(
-            data['username'],
-            data['activity'],
-            data['role'],
-            data['hours_per_week'],
-            data.get('description', '')
-        ):
+        with audit.acting_as(self.username):
+            added = add_student_eca(
+                data['username'],
+                data['activity'],
+                data['role'],
+                data['hours_per_week'],
+                data.get('description', '')
+            )
+        if added:
             messagebox.showinfo("Success", f"ECA '{data['activity']}' added successfully for {data['username']}")
             # Clear form
             for var in self.eca_form_vars.values():
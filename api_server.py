@@ -0,0 +1,415 @@
+"""
+Headless HTTP/JSON API over the student data, built on asyncio streams.
+
+Endpoints:
+    POST /login                         {"username": ..., "password": ...} -> {"token": ..., ...}
+    POST /logout
+    GET  /students/<username>/grades
+    GET  /students/<username>/eca
+    GET  /students/<username>/stats
+    GET  /students/<username>/chart     PNG performance summary
+    GET  /stats/overall
+    GET  /charts/<name>                 PNG, name is one of CHART_METHODS
+    GET  /metrics                       Prometheus text (see metrics.py)
+
+The /students/<username> endpoints need the token returned by /login, sent as
+"Authorization: Bearer <token>". Students can only read their own record,
+admins can read any.
+
+Handlers that read tables or compute statistics run in the default thread
+pool executor, so a slow request does not hold up the other connections.
+
+Run with: python api_server.py [--host 127.0.0.1] [--port 8000] [--metrics]
+"""
+import os
+import json
+import time
+import asyncio
+import secrets
+import argparse
+import threading
+import functools
+from urllib.parse import urlsplit, unquote
+import pandas as pd
+from auth import Session, user_details_from_row
+from student import grades_from_row
+from tables import read_table, json_safe, eca_records
+import metrics
+import wal
+
+TABLES = {
+    'users': "data/users.csv",
+    'passwords': "data/passwords.csv",
+    'grades': "data/grades.csv",
+    'eca': "data/eca.csv"
+}
+
+CHART_METHODS = {
+    'grades_distribution': 'create_overall_grades_distribution',
+    'subject_performance': 'create_subject_performance_comparison',
+    'eca_distribution': 'create_eca_distribution',
+    'hours_distribution': 'create_hours_distribution'
+}
+
+# Lifetime of a login token
+SESSION_SECONDS = 8 * 3600
+# Largest request body accepted
+MAX_BODY_BYTES = 64 * 1024
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error'
+}
+
+
+class DataStore:
+    """
+    In-memory copy of the CSV tables shared by all connections.
+    A table is re-read only when its file's modification time changes, so
+    writes from the desktop app or other processes are picked up on the next
+    request without reading every file per request.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.versions = {}
+        self.indexes = {}
+        self.overall_stats = None
+        self.overall_stats_version = None
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+    def _version(self, name):
+        path = TABLES[name]
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _entry(self, name):
+        """A table and its index, reloaded if the file changed; both come from the same read"""
+        version = self._version(name)
+        with self.lock:
+            if version != self.versions.get(name) or name not in self.tables:
+                if version is None:
+                    df = pd.DataFrame(columns=['username'])
+                else:
+                    df = read_table(TABLES[name], compact=True)
+                self.tables[name] = df
+                self.versions[name] = version
+                # Row positions per username for O(1) lookups
+                self.indexes[name] = df.groupby('username', sort=False).indices if not df.empty else {}
+            return self.tables[name], self.indexes[name]
+
+    @metrics.instrument
+    def table(self, name):
+        """Get a table, reloading it if the file changed"""
+        return self._entry(name)[0]
+
+    def rows(self, name, username):
+        """Get the rows of a table belonging to a user"""
+        df, index = self._entry(name)
+        positions = index.get(username)
+        if positions is None:
+            return df.iloc[0:0]
+        return df.iloc[positions]
+
+    def authenticate(self, username, password):
+        """Check credentials against the cached tables, mirroring auth.authenticate"""
+        credentials = self.rows('passwords', username)
+        credentials = credentials[credentials['password'].astype(str) == str(password)]
+        if credentials.empty:
+            return None
+        role = credentials.iloc[0]['role']
+        if role not in ['admin', 'student']:
+            return None
+        if self.rows('users', username).empty:
+            return None
+        return self.session(username, role)
+
+    def session(self, username, role=None):
+        """Build a Session for a user from the cached tables"""
+        user_rows = self.rows('users', username)
+        if user_rows.empty:
+            return None
+        user_details = user_details_from_row(user_rows.iloc[0])
+        session = Session(username, role or user_details['role'], user_details)
+
+        grade_rows = self.rows('grades', username)
+        if not grade_rows.empty:
+            session.grades = grades_from_row(grade_rows.iloc[0], grade_rows.columns)
+        session.eca = eca_records(self.rows('eca', username))
+        return session
+
+    def get_overall_statistics(self, analytics):
+        """Overall statistics, recomputed only when grades or ECA change"""
+        version = (self._version('grades'), self._version('eca'))
+        with self.stats_lock:
+            if version != self.overall_stats_version:
+                self.overall_stats = analytics.get_overall_statistics()
+                self.overall_stats_version = version
+            return self.overall_stats
+
+
+class APIServer:
+    """HTTP/1.1 server with keep-alive connections and concurrent request handling"""
+
+    def __init__(self, store=None):
+        self.store = store or DataStore()
+        self._analytics = None
+        # matplotlib's pyplot state is not thread-safe, so charts are rendered one at a time
+        self.chart_lock = threading.Lock()
+        # Login tokens: token -> (username, role, expiry time)
+        self.tokens = {}
+        self.tokens_lock = threading.Lock()
+
+    @property
+    def analytics(self):
+        # matplotlib is only imported once analytics are first needed
+        if self._analytics is None:
+            from mat import StudentAnalytics
+            self._analytics = StudentAnalytics()
+        return self._analytics
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send(writer, 400, {'error': 'Malformed request line'}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                body = b''
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send(writer, 400, {'error': 'Invalid Content-Length'}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._send(writer, 413, {'error': f'Request body is over {MAX_BODY_BYTES} bytes'},
+                                     keep_alive=False)
+                    break
+                if length:
+                    body = await reader.readexactly(length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+
+                status, payload = await self.dispatch(method, target, body, headers)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        except Exception as e:
+            print(f"Error handling connection: {e}")
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, keep_alive):
+        if isinstance(payload, bytes):
+            content_type, body = 'image/png', payload
+        elif isinstance(payload, str):
+            content_type, body = 'text/plain; version=0.0.4', payload.encode()
+        else:
+            content_type, body = 'application/json', json.dumps(json_safe(payload)).encode()
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _blocking(function, *args):
+        """Run a function that reads files or computes in the executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args))
+
+    async def dispatch(self, method, target, body, headers=None):
+        """Route a request and return (status, payload)"""
+        parts = [unquote(part) for part in urlsplit(target).path.strip('/').split('/') if part]
+        headers = headers or {}
+        try:
+            if parts in (['login'], ['logout']):
+                if method != 'POST':
+                    return 405, {'error': 'Use POST'}
+                return await self._blocking(self.login, body) if parts == ['login'] else self.logout(headers)
+
+            if method != 'GET':
+                return 405, {'error': 'Use GET'}
+
+            if len(parts) == 3 and parts[0] == 'students':
+                username, resource = parts[1], parts[2]
+                caller = self.caller(headers)
+                if caller is None:
+                    return 401, {'error': 'Log in and send the token as "Authorization: Bearer <token>"'}
+                if caller[1] != 'admin' and caller[0] != username:
+                    return 403, {'error': 'Students can only read their own record'}
+                if resource == 'chart':
+                    return await self.student_chart(username)
+                return await self._blocking(self.student_resource, username, resource)
+
+            if parts == ['stats', 'overall']:
+                return 200, await self._blocking(lambda: self.store.get_overall_statistics(self.analytics))
+
+            if len(parts) == 2 and parts[0] == 'charts' and parts[1] in CHART_METHODS:
+                return await self.overall_chart(parts[1])
+
+            if parts == ['metrics']:
+                return 200, metrics.to_prometheus()
+
+            return 404, {'error': 'Not found'}
+        except Exception as e:
+            print(f"Error handling {method} {target}: {e}")
+            return 500, {'error': str(e)}
+
+    def login(self, body):
+        try:
+            credentials = json.loads(body or b'{}')
+        except ValueError:
+            return 400, {'error': 'Body must be JSON'}
+        session = self.store.authenticate(credentials.get('username'), credentials.get('password'))
+        if session is None:
+            return 401, {'error': 'Invalid username or password'}
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with self.tokens_lock:
+            # Drop expired tokens so the table does not grow without bound
+            self.tokens = {key: value for key, value in self.tokens.items() if value[2] > now}
+            self.tokens[token] = (session.username, session.role, now + SESSION_SECONDS)
+        return 200, {
+            'token': token,
+            'expires_in': SESSION_SECONDS,
+            'username': session.username,
+            'role': session.role,
+            'user_details': session.user_details
+        }
+
+    @staticmethod
+    def _bearer_token(headers):
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        return token.strip() if scheme.lower() == 'bearer' else None
+
+    def caller(self, headers):
+        """
+        The logged-in user making a request.
+        Returns:
+            Tuple of (username, role), or None without a valid token
+        """
+        token = self._bearer_token(headers)
+        with self.tokens_lock:
+            entry = self.tokens.get(token) if token else None
+            if entry is None:
+                return None
+            if entry[2] <= time.time():
+                del self.tokens[token]
+                return None
+        return entry[0], entry[1]
+
+    def logout(self, headers):
+        token = self._bearer_token(headers)
+        with self.tokens_lock:
+            if not token or self.tokens.pop(token, None) is None:
+                return 401, {'error': 'Not logged in'}
+        return 200, {'message': 'Logged out'}
+
+    def student_resource(self, username, resource):
+        session = self.store.session(username)
+        if session is None:
+            return 404, {'error': 'User not found'}
+        if resource == 'grades':
+            return 200, session.grades
+        if resource == 'eca':
+            return 200, session.eca
+        if resource == 'stats':
+            from mat import StudentAnalytics
+            analytics = StudentAnalytics(session)
+            return 200, {
+                'gpa': analytics.calculate_gpa(username),
+                'grade_statistics': analytics.get_grade_statistics(username),
+                'eca_summary': analytics.get_eca_summary(username)
+            }
+        return 404, {'error': 'Not found'}
+
+    def _render(self, create_chart):
+        """Render a chart under the chart lock and return the PNG bytes"""
+        with self.chart_lock:
+            path = create_chart()
+            if not path or not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+
+    async def _render_async(self, create_chart):
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(None, self._render, create_chart)
+        if png is None:
+            return 404, {'error': 'No data to chart'}
+        return 200, png
+
+    async def student_chart(self, username):
+        session = await self._blocking(self.store.session, username)
+        if session is None:
+            return 404, {'error': 'User not found'}
+        analytics = self.analytics
+
+        def create_chart():
+            if session.grades and session.eca:
+                return analytics.create_performance_summary(session.grades, session.eca, username)
+            if session.grades:
+                return analytics.create_grades_chart(session.grades, username)
+            if session.eca:
+                return analytics.create_eca_chart(session.eca, username)
+            return None
+        return await self._render_async(create_chart)
+
+    async def overall_chart(self, name):
+        return await self._render_async(getattr(self.analytics, CHART_METHODS[name]))
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Student data HTTP/JSON API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--metrics', action='store_true', help="Collect metrics (served at /metrics)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    # Finish changes interrupted by a crash (of any process using data/) before serving
+    replayed = wal.recover()
+    if replayed:
+        print(f"Recovered {replayed} interrupted changes from the write-ahead log")
+    try:
+        asyncio.run(APIServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
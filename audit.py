@@ -0,0 +1,497 @@
+"""
+Append-only audit log of changes to grades and user profiles.
+
+Every changed value is one entry: time, actor, table, key (username), field
+(column or subject), old value and new value. Values are kept as JSON, None
+where there was or is no value; password values are never stored.
+
+New entries are appended to data/audit/current.jsonl. Once it holds
+SEGMENT_ROWS entries it is sealed into a compressed, column-oriented
+segment (data/audit/segments/NNNNNN.npz) sorted by time, with actors, keys,
+tables and fields dictionary-encoded and an index of the entries of each key
+and of each actor. data/audit/catalog.json lists the segments with their time
+range and actors, so a query only opens the segments that can match, finds
+the matching entries through the indexes and decodes only the requested page.
+The index arrays of recently used segments stay in memory, so paging through
+results does not read them again.
+
+The actor is set per thread with acting_as, around each action of a
+logged-in user's window or of an admin_cli command. Inside a call logged by
+wal.py, entries are staged in the write-ahead log before the table is
+written and appended here when the call finishes, so a crash in between
+cannot lose them.
+
+    import audit
+    with audit.acting_as('admin'):
+        audit.record('grades', 'student1', [('Math', 70.0, 75.0)])
+    page, total = audit.query(key='student1', limit=50)
+    page, total = audit.query(actor='admin', since=time.time() - 7 * 86400)
+"""
+import io
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from tables import json_safe
+from metrics import instrument
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): only one process may write the audit log at a time
+    fcntl = None
+
+AUDIT_DIR = "data/audit"
+# Locked while entries are appended or sealed
+LOCK_NAME = "audit.lock"
+# Entries per sealed segment
+SEGMENT_ROWS = 50000
+# Segments whose index arrays are kept in memory
+SEGMENT_CACHE = 32
+PAGE_SIZE = 50
+DEFAULT_ACTOR = 'system'
+# Fields whose values are not written to the log
+SECRET_FIELDS = {'password'}
+ENTRY_COLUMNS = ['time', 'actor', 'table', 'key', 'field', 'old', 'new']
+# Arrays of a segment needed to find entries; the rest are read to decode a page
+INDEX_ARRAYS = ('time', 'actors', 'actor_order', 'actor_offsets', 'keys', 'key_order', 'key_offsets',
+                'tables', 'table_codes')
+
+_actor = DEFAULT_ACTOR
+# Actor set for the current thread by acting_as (each view's actions, replays of the write-ahead log)
+_thread_actor = threading.local()
+# Where the current thread's entries go while staged (see staging)
+_thread_stage = threading.local()
+# Serialises appending and sealing within the process; _locked() does so across processes
+_lock = threading.Lock()
+# Parsed current file per path: (inode, bytes parsed, entries)
+_current_cache = {}
+# Lines counted in the current file per path: (inode, bytes counted, lines), so appends do not parse it
+_current_counts = {}
+# Index arrays per segment path, least recently used first
+_segment_cache = OrderedDict()
+
+
+def set_actor(actor):
+    """
+    Set the default actor of the changes made by this process. Changes made
+    for a logged-in user go inside acting_as(username) instead, so several
+    sessions in one process are told apart.
+    """
+    global _actor
+    _actor = actor or DEFAULT_ACTOR
+
+
+def get_actor():
+    return getattr(_thread_actor, 'actor', None) or _actor
+
+
+@contextlib.contextmanager
+def acting_as(actor):
+    """Record the changes made by this thread inside the block as made by actor"""
+    previous = getattr(_thread_actor, 'actor', None)
+    _thread_actor.actor = actor
+    try:
+        yield
+    finally:
+        _thread_actor.actor = previous
+
+
+@contextlib.contextmanager
+def staging(stage):
+    """
+    Hand the entries recorded by this thread inside the block to stage(table,
+    text) instead of writing them, where text is JSON lines for
+    append_entries. The write-ahead log uses this to keep a call's entries
+    with the call (see wal.py).
+    """
+    previous = getattr(_thread_stage, 'stage', None)
+    _thread_stage.stage = stage
+    try:
+        yield
+    finally:
+        _thread_stage.stage = previous
+
+
+def _unchanged(old, new):
+    """
+    Mask of the values that did not change: both empty, equal numbers or equal text.
+    Args:
+        old, new: Series of values
+    """
+    old = pd.Series(old, dtype=object).reset_index(drop=True)
+    new = pd.Series(new, dtype=object).reset_index(drop=True)
+    old_empty = (old.isna() | (old.astype(str) == '')).to_numpy()
+    new_empty = (new.isna() | (new.astype(str) == '')).to_numpy()
+    same_number = (pd.to_numeric(old, errors='coerce') == pd.to_numeric(new, errors='coerce')).to_numpy()
+    same_text = (old.astype(str) == new.astype(str)).to_numpy()
+    return (old_empty & new_empty) | (~old_empty & ~new_empty & (same_number | same_text))
+
+
+def _paths(audit_dir):
+    return {
+        'current': os.path.join(audit_dir, "current.jsonl"),
+        'segments': os.path.join(audit_dir, "segments"),
+        'catalog': os.path.join(audit_dir, "catalog.json")
+    }
+
+
+def record(table, key, changes, audit_dir=AUDIT_DIR):
+    """
+    Record the changes of one row. Values that did not change are skipped.
+    Args:
+        table: Table name ('users', 'grades', ...)
+        key: Username of the row
+        changes: Iterable of (field, old value, new value)
+    """
+    changes = list(changes)
+    if changes:
+        fields, old, new = zip(*changes)
+        record_frame(table, pd.DataFrame({'key': key, 'field': fields, 'old': old, 'new': new}), audit_dir)
+
+
+def record_frame(table, changes, audit_dir=AUDIT_DIR):
+    """
+    Record many changes at once. Values that did not change are skipped.
+    Args:
+        table: Table name
+        changes: DataFrame with key, field, old and new columns
+    """
+    if changes.empty:
+        return
+    try:
+        secret = changes['field'].isin(SECRET_FIELDS).to_numpy()
+        keep = ~_unchanged(changes['old'], changes['new']) | secret
+        if not keep.any():
+            return
+        kept = changes[keep]
+        entries = pd.DataFrame({
+            'time': time.time(),
+            'actor': get_actor(),
+            'table': table,
+            'key': kept['key'].astype(str).to_numpy(dtype=object),
+            'field': kept['field'].astype(str).to_numpy(dtype=object),
+            'old': [None if hidden else json_safe(value) for hidden, value in zip(secret[keep], kept['old'])],
+            'new': [None if hidden else json_safe(value) for hidden, value in zip(secret[keep], kept['new'])]
+        }, columns=ENTRY_COLUMNS)
+        text = entries.to_json(orient='records', lines=True, double_precision=15)
+        stage = getattr(_thread_stage, 'stage', None)
+        if stage is not None:
+            stage(table, text)
+        else:
+            append_entries(text, audit_dir)
+    except Exception as e:
+        print(f"Error writing audit log: {e}")
+
+
+@contextlib.contextmanager
+def _locked(audit_dir):
+    """
+    Hold the audit log's lock: the thread lock of this process and a file
+    lock on data/audit/audit.lock, so that processes sharing the directory do
+    not seal the same file or pick the same segment number.
+    """
+    with _lock:
+        if fcntl is None or not os.path.isdir(audit_dir):
+            yield
+            return
+        fd = os.open(os.path.join(audit_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def append_entries(text, audit_dir=AUDIT_DIR):
+    """Append entries (JSON lines) to the current file and seal it once it is full"""
+    if not text:
+        return
+    if not text.endswith("\n"):
+        text += "\n"
+    paths = _paths(audit_dir)
+    os.makedirs(audit_dir, exist_ok=True)
+    with _locked(audit_dir):
+        with open(paths['current'], 'a') as f:
+            f.write(text)
+        if _count_lines(paths['current']) >= SEGMENT_ROWS:
+            _seal(audit_dir)
+
+
+def _count_lines(path):
+    """Entries in the current file, counting only the bytes added since the last count (by any process)"""
+    if not os.path.exists(path):
+        _current_counts.pop(path, None)
+        return 0
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        inode, counted, rows = _current_counts.get(path, (None, 0, 0))
+        if inode != stat.st_ino or stat.st_size < counted:
+            counted, rows = 0, 0
+        f.seek(counted)
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            rows += chunk.count(b"\n")
+            counted += len(chunk)
+    _current_counts[path] = (stat.st_ino, counted, rows)
+    return rows
+
+
+def _parse_lines(data):
+    if not data.strip():
+        return pd.DataFrame(columns=ENTRY_COLUMNS)
+    entries = pd.read_json(io.BytesIO(data), lines=True, convert_dates=False, dtype=False)
+    return entries.reindex(columns=ENTRY_COLUMNS)
+
+
+def _read_current(path):
+    """Entries of the current file, parsing only the lines added since the last read"""
+    if not os.path.exists(path):
+        _current_cache.pop(path, None)
+        return pd.DataFrame(columns=ENTRY_COLUMNS)
+    with open(path, 'rb') as f:
+        inode = os.fstat(f.fileno()).st_ino
+        cached_inode, parsed, entries = _current_cache.get(path, (None, 0, None))
+        if cached_inode != inode or os.fstat(f.fileno()).st_size < parsed:
+            parsed, entries = 0, pd.DataFrame(columns=ENTRY_COLUMNS)
+        f.seek(parsed)
+        data = f.read()
+    # A partly written last line is read next time
+    data = data[:data.rfind(b"\n") + 1]
+    if data:
+        new_entries = _parse_lines(data)
+        entries = new_entries if entries.empty else pd.concat([entries, new_entries], ignore_index=True)
+    _current_cache[path] = (inode, parsed + len(data), entries)
+    return entries
+
+
+def _encode(values):
+    """Dictionary-encode a column: (sorted UTF-8 vocabulary, codes)"""
+    codes, vocabulary = pd.factorize(pd.Series(values, dtype=object).astype(str), sort=True)
+    return np.array([value.encode() for value in vocabulary], dtype=bytes), codes.astype(np.int32)
+
+
+def _index(codes, size):
+    """Entries of each code as CSR: positions sorted by code, and offsets per code"""
+    order = np.argsort(codes, kind='stable').astype(np.int32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=size))]).astype(np.int64)
+    return order, offsets
+
+
+def _pack_values(values):
+    """Pack values as JSON into one byte string with offsets; null marks None"""
+    # The values were parsed from JSON, so they encode as they are
+    encode = json.JSONEncoder(default=str).encode
+    texts = [None if value is None or value != value else encode(value).encode() for value in values]
+    lengths = np.array([0 if text is None else len(text) for text in texts], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    blob = np.frombuffer(b"".join(text for text in texts if text is not None), dtype=np.uint8)
+    return blob, offsets, np.array([text is None for text in texts], dtype=bool)
+
+
+def _load_catalog(paths):
+    if not os.path.exists(paths['catalog']):
+        return []
+    with open(paths['catalog']) as f:
+        return json.load(f)
+
+
+def seal(audit_dir=AUDIT_DIR):
+    """Turn the current file into a sealed segment and start a new one"""
+    with _locked(audit_dir):
+        _seal(audit_dir)
+
+
+def _seal(audit_dir):
+    """Seal the current file (caller holds _locked())"""
+    paths = _paths(audit_dir)
+    if not os.path.exists(paths['current']):
+        return
+    catalog = _load_catalog(paths)
+    number = max([segment['number'] for segment in catalog], default=0) + 1
+    pending = os.path.join(audit_dir, f"pending-{number:06d}.jsonl")
+    # New entries go to a fresh current file while this one is sealed
+    os.replace(paths['current'], pending)
+    _current_cache.pop(paths['current'], None)
+    _current_counts.pop(paths['current'], None)
+    _seal_pending(paths, catalog, number, pending)
+
+
+def _seal_pending(paths, catalog, number, pending):
+    with open(pending, 'rb') as f:
+        data = f.read()
+    entries = _parse_lines(data[:data.rfind(b"\n") + 1])
+    entries = entries.sort_values('time', kind='stable').reset_index(drop=True)
+    if not entries.empty:
+        arrays = {'time': entries['time'].to_numpy(dtype=float)}
+        for name in ('actor', 'key', 'table', 'field'):
+            arrays[f'{name}s'], arrays[f'{name}_codes'] = _encode(entries[name])
+        for name in ('actor', 'key'):
+            arrays[f'{name}_order'], arrays[f'{name}_offsets'] = _index(arrays[f'{name}_codes'],
+                                                                        len(arrays[f'{name}s']))
+        for name in ('old', 'new'):
+            arrays[f'{name}_blob'], arrays[f'{name}_offsets'], arrays[f'{name}_null'] = \
+                _pack_values(entries[name].astype(object).tolist())
+
+        os.makedirs(paths['segments'], exist_ok=True)
+        path = os.path.join(paths['segments'], f"{number:06d}.npz")
+        temporary = path + ".tmp.npz"
+        np.savez_compressed(temporary, **arrays)
+        os.replace(temporary, path)
+        catalog.append({'number': number, 'rows': len(entries), 'start': float(arrays['time'][0]),
+                        'end': float(arrays['time'][-1]),
+                        'actors': [actor.decode() for actor in arrays['actors']]})
+        temporary = paths['catalog'] + ".tmp"
+        with open(temporary, 'w') as f:
+            json.dump(catalog, f)
+        os.replace(temporary, paths['catalog'])
+    os.remove(pending)
+
+
+def _finish_sealing(paths, audit_dir):
+    """Complete sealings interrupted by a crash"""
+    if not os.path.isdir(audit_dir):
+        return
+    for name in sorted(os.listdir(audit_dir)):
+        if name.startswith("pending-") and name.endswith(".jsonl"):
+            number = int(name[len("pending-"):-len(".jsonl")])
+            catalog = _load_catalog(paths)
+            pending = os.path.join(audit_dir, name)
+            if any(segment['number'] == number for segment in catalog):
+                os.remove(pending)
+            else:
+                _seal_pending(paths, catalog, number, pending)
+
+
+def _segment_index(path):
+    """Index arrays of a segment, from memory when recently used"""
+    if path in _segment_cache:
+        _segment_cache.move_to_end(path)
+        return _segment_cache[path]
+    with np.load(path) as arrays:
+        index = {name: arrays[name] for name in INDEX_ARRAYS}
+    _segment_cache[path] = index
+    while len(_segment_cache) > SEGMENT_CACHE:
+        _segment_cache.popitem(last=False)
+    return index
+
+
+def _lookup(vocabulary, value):
+    """Code of a value in a sorted vocabulary, or -1"""
+    value = str(value).encode()
+    i = int(np.searchsorted(vocabulary, value))
+    return i if i < len(vocabulary) and vocabulary[i] == value else -1
+
+
+def _segment_matches(index, key, actor, table, since, until):
+    """Positions of the matching entries of a segment, in time order"""
+    times = index['time']
+    low = 0 if since is None else int(np.searchsorted(times, since, side='left'))
+    high = len(times) if until is None else int(np.searchsorted(times, until, side='right'))
+    positions = None
+    for name, value in (('key', key), ('actor', actor)):
+        if value is None:
+            continue
+        code = _lookup(index[f'{name}s'], value)
+        if code < 0:
+            return np.empty(0, dtype=np.int64)
+        offsets = index[f'{name}_offsets']
+        # Positions of one code are in increasing order (the index sort is stable)
+        found = index[f'{name}_order'][offsets[code]:offsets[code + 1]]
+        positions = found if positions is None else np.intersect1d(positions, found, assume_unique=True)
+    if positions is None:
+        positions = np.arange(low, high)
+    else:
+        positions = positions[(positions >= low) & (positions < high)]
+    if table is not None:
+        positions = positions[index['table_codes'][positions] == _lookup(index['tables'], table)]
+    return positions
+
+
+def _segment_rows(path, index, positions):
+    """Decode the entries at positions of a segment"""
+    with np.load(path) as arrays:
+        values = {name: arrays[name] for name in arrays.files if name not in index}
+
+    def decode(name):
+        blob, offsets, null = values[f'{name}_blob'], values[f'{name}_offsets'], values[f'{name}_null']
+        return [None if null[i] else json.loads(blob[offsets[i]:offsets[i + 1]].tobytes()) for i in positions]
+
+    def names(name):
+        vocabulary = index[f'{name}s'] if f'{name}s' in index else values[f'{name}s']
+        codes = index[f'{name}_codes'] if f'{name}_codes' in index else values[f'{name}_codes']
+        return [value.decode() for value in vocabulary[codes[positions]]]
+
+    return pd.DataFrame({
+        'time': index['time'][positions],
+        'actor': names('actor'),
+        'table': names('table'),
+        'key': names('key'),
+        'field': names('field'),
+        'old': decode('old'),
+        'new': decode('new')
+    }, columns=ENTRY_COLUMNS)
+
+
+def _page_range(offset, limit, total, count):
+    """Part (start, end) of count matches that falls on the page, when total matches come before them"""
+    start = min(max(offset - total, 0), count)
+    end = min(max(offset + limit - total, 0), count)
+    return start, end
+
+
+@instrument
+def query(key=None, actor=None, table=None, since=None, until=None, offset=0, limit=PAGE_SIZE,
+          audit_dir=AUDIT_DIR):
+    """
+    Find audit entries, newest first.
+    Args:
+        key: Only changes to this username
+        actor: Only changes made by this user
+        table: Only changes to this table
+        since, until: Only changes in this time range (epoch seconds, inclusive)
+        offset, limit: The page of matching entries to return
+    Returns:
+        Tuple of (DataFrame of entries with ENTRY_COLUMNS, total number of matching entries)
+    """
+    try:
+        paths = _paths(audit_dir)
+        with _locked(audit_dir):
+            _finish_sealing(paths, audit_dir)
+            current = _read_current(paths['current'])
+        # The current file is small; filter it as a table
+        mask = pd.Series(True, index=current.index)
+        for column, value in (('key', key), ('actor', actor), ('table', table)):
+            if value is not None:
+                mask &= current[column] == value
+        if since is not None:
+            mask &= current['time'] >= since
+        if until is not None:
+            mask &= current['time'] <= until
+        matches = current[mask].sort_values('time', ascending=False, kind='stable')
+        start, end = _page_range(offset, limit, 0, len(matches))
+        pages = [matches.iloc[start:end]]
+        total = len(matches)
+
+        for segment in sorted(_load_catalog(paths), key=lambda segment: segment['number'], reverse=True):
+            if since is not None and segment['end'] < since or until is not None and segment['start'] > until:
+                continue
+            if actor is not None and actor not in segment['actors']:
+                continue
+            path = os.path.join(paths['segments'], f"{segment['number']:06d}.npz")
+            index = _segment_index(path)
+            positions = _segment_matches(index, key, actor, table, since, until)[::-1]
+            start, end = _page_range(offset, limit, total, len(positions))
+            if end > start:
+                pages.append(_segment_rows(path, index, positions[start:end]))
+            total += len(positions)
+
+        pages = [page for page in pages if not page.empty]
+        entries = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=ENTRY_COLUMNS)
+        return entries.astype({'old': object, 'new': object}), total
+    except Exception as e:
+        print(f"Error querying audit log: {e}")
+        return pd.DataFrame(columns=ENTRY_COLUMNS), 0
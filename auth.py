@@ -1,9 +1,123 @@
 import os
 import pandas as pd
+import events
+import wal
+from student import grades_from_row
+from tables import read_table, write_table, exact_hours, eca_records
+from metrics import instrument
 
 
+class Session:
+    """Logged-in user with the dashboard data preloaded from each table once.
+
+    Indexing (``session['role']``) is kept for code that treated the
+    authenticate result as a dictionary.
+    """
+
+    def __init__(self, username, role, user_details=None, grades=None, eca=None):
+        self.username = username
+        self.role = role
+        self.user_details = user_details or {}
+        self.grades = grades if grades is not None else []
+        self.eca = eca if eca is not None else []
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def apply_event(self, event):
+        """
+        Apply a change event for this user to the preloaded data.
+        Returns:
+            True if the session data changed
+        """
+        if event.username != self.username:
+            return False
+            
+        if event.type == events.GRADE_CHANGED:
+            subject, grade = event.data['subject'], event.data.get('grade')
+            self.grades = [g for g in self.grades if g['subject'] != subject or grade is not None]
+            for existing in self.grades:
+                if existing['subject'] == subject:
+                    existing['grade'] = float(grade)
+                    return True
+            if grade is not None:
+                self.grades.append({'subject': subject, 'grade': float(grade)})
+            return True
+            
+        if event.type == events.ECA_CHANGED:
+            if 'records' in event.data:
+                self.eca = list(event.data['records'])
+                return True
+            activity, record = event.data['activity'], event.data.get('record')
+            self.eca = [a for a in self.eca if a['activity'] != activity or record is not None]
+            for existing in self.eca:
+                if existing['activity'] == activity:
+                    existing.update(record)
+                    return True
+            if record is not None:
+                self.eca.append(dict(record))
+            return True
+            
+        if event.type == events.USER_CHANGED:
+            for key, value in event.data.get('fields', {}).items():
+                if key in self.user_details:
+                    self.user_details[key] = value
+            return True
+            
+        return False
+
+    def eca_summary(self):
+        """Summary of the preloaded ECA records, same shape as StudentAnalytics.get_eca_summary"""
+        if not self.eca:
+            return None
+        return {
+            'total_activities': len(self.eca),
+            'total_hours': exact_hours(sum(exact_hours(activity['hours_per_week']) for activity in self.eca)),
+            'activities': self.eca
+        }
+
+
+def user_details_from_row(user_row):
+    """Convert a users.csv row to the user details dictionary."""
+    return {
+        'username': user_row['username'],
+        'full_name': user_row['full_name'],
+        'role': user_row['role'],
+        'email': user_row.get('email', ''),
+        'phone': user_row.get('phone', ''),
+        'address': user_row.get('address', ''),
+        'department': user_row.get('department', ''),
+        'level': user_row.get('level', '')
+    }
+
+
+@instrument
+def load_session(username, role, users_df):
+    """Build a Session, reading grades.csv and eca.csv once each for students."""
+    user_details = user_details_from_row(users_df[users_df['username'] == username].iloc[0])
+    session = Session(username, role, user_details)
+    if role != 'student':
+        return session
+        
+    if os.path.exists("data/grades.csv"):
+        grades_df = read_table("data/grades.csv", compact=True)
+        student_rows = grades_df[grades_df['username'] == username]
+        if not student_rows.empty:
+            session.grades = grades_from_row(student_rows.iloc[0], grades_df.columns)
+            
+    if os.path.exists("data/eca.csv"):
+        eca_df = read_table("data/eca.csv", compact=True)
+        session.eca = eca_records(eca_df[eca_df['username'] == username])
+        
+    return session
+
+
+@instrument
 def authenticate(username, password):
-    """Authenticate user credentials"""
+    """Authenticate user credentials and return a preloaded Session"""
     try:
             
         if not os.path.exists("data/passwords.csv"):
@@ -15,13 +129,13 @@ def authenticate(username, password):
             return None
             
         # Read passwords file
-        passwords_df = pd.read_csv("data/passwords.csv")
+        passwords_df = read_table("data/passwords.csv", compact=True)
         if passwords_df.empty:
             print("Error: passwords.csv is empty")
             return None
             
         # Read users file
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv", compact=True)
         if users_df.empty:
             print("Error: users.csv is empty")
             return None
@@ -47,16 +161,14 @@ def authenticate(username, password):
             print("User not found in users.csv")
             return None
             
-        return {
-            'username': username,
-            'role': role
-        }
+        return load_session(username, role, users_df)
         
     except Exception as e:
         print(f"Authentication error: {str(e)}")
         return None
 
 
+@instrument
 def get_user_details(username):
     """Fetch user details from users.csv based on the username."""
     if not username:
@@ -67,32 +179,29 @@ def get_user_details(username):
             print("Error: users.csv file not found.")
             return None
             
-        df = pd.read_csv("data/users.csv")
+        df = read_table("data/users.csv", compact=True)
         user_row = df[df['username'] == username]
         
         if not user_row.empty:
-            return {
-                'username': user_row.iloc[0]['username'],
-                'full_name': user_row.iloc[0]['full_name'],
-                'role': user_row.iloc[0]['role'],
-                'email': user_row.iloc[0].get('email', ''),
-                'phone': user_row.iloc[0].get('phone', ''),
-                'address': user_row.iloc[0].get('address', ''),
-                'department': user_row.iloc[0].get('department', ''),
-                'level': user_row.iloc[0].get('level', '')
-            }
+            return user_details_from_row(user_row.iloc[0])
             
     except Exception as e:
         print(f"Error getting user details: {e}")
     return None
 
 
+@instrument
 def initialize_data_files():
     """Initialize data directory and required CSV files"""
     try:
         if not os.path.exists("data"):
             os.makedirs("data")
             
+        # Finish the changes interrupted by a crash
+        replayed = wal.recover()
+        if replayed:
+            print(f"Recovered {replayed} interrupted changes from the write-ahead log")
+            
         # Initialize users.csv
         #With indext = False there is no index column in the csv file
         if not os.path.exists("data/users.csv"):
@@ -112,8 +221,8 @@ def initialize_data_files():
             pd.DataFrame(columns=['username', 'activity', 'role', 'hours_per_week', 'description']).to_csv("data/eca.csv", index=False)
             
         # Add default admin user if not exists
-        passwords_df = pd.read_csv("data/passwords.csv")
-        users_df = pd.read_csv("data/users.csv")
+        passwords_df = read_table("data/passwords.csv")
+        users_df = read_table("data/users.csv")
         
         if 'admin' not in passwords_df['username'].values:
             # Add admin to passwords.csv
@@ -123,7 +232,7 @@ def initialize_data_files():
                 'role': ['admin']
             })
             passwords_df = pd.concat([passwords_df, new_password], ignore_index=True)
-            passwords_df.to_csv("data/passwords.csv", index=False)
+            write_table(passwords_df, "data/passwords.csv")
             
             # Add admin to users.csv
             new_user = pd.DataFrame({
@@ -137,7 +246,7 @@ def initialize_data_files():
                 'level': ['']
             })
             users_df = pd.concat([users_df, new_user], ignore_index=True)
-            users_df.to_csv("data/users.csv", index=False)
+            write_table(users_df, "data/users.csv")
             
     except Exception as e:
         print(f"Error initializing data files: {str(e)}")
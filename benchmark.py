@@ -0,0 +1,234 @@
+"""
+Benchmarks for the data and analytics functions.
+
+For each dataset size a synthetic dataset is generated in a temporary
+directory, then every public function in auth.py, student.py, admin.py and
+mat.py is timed (median and min over several runs) and its peak Python memory
+is measured with tracemalloc in a separate run. Results are written as JSON so
+two runs can be compared.
+
+Usage:
+    python benchmark.py [--sizes 1000 100000 1000000] [--repeat 5] [--charts]
+                        [--only get_student] [--output results.json]
+    python benchmark.py --compare old.json new.json [--threshold 1.25]
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+import tracemalloc
+from datetime import datetime, timezone
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def _user(i, size):
+    """A student that exists in the generated dataset"""
+    return f"student{i % size}"
+
+
+def benchmark_cases(size, charts=False):
+    """
+    Build the list of (name, function) cases for a dataset size.
+    Each function takes the run number, so mutating cases can use a different
+    student on every run. Cases that remove users run last and work backwards
+    from the last student so they do not affect the others.
+    """
+    import auth
+    import student
+    import admin
+    from mat import StudentAnalytics
+
+    analytics = StudentAnalytics(cleanup_charts=False)
+    user = lambda i: _user(i, size)
+    last = lambda i: _user(size - 1 - i, size)
+
+    cases = [
+        ('auth.authenticate', lambda i: auth.authenticate(user(i), 'studentpass')),
+        ('auth.get_user_details', lambda i: auth.get_user_details(user(i))),
+        ('student.get_student_profile', lambda i: student.get_student_profile(user(i))),
+        ('student.get_student_grades', lambda i: student.get_student_grades(user(i))),
+        ('student.get_student_eca', lambda i: student.get_student_eca(user(i))),
+        ('admin.list_all_users', lambda i: admin.list_all_users()),
+        ('admin.get_user_details', lambda i: admin.get_user_details(user(i))),
+        ('admin.get_all_students', lambda i: admin.get_all_students()),
+        ('admin.get_student_details', lambda i: admin.get_student_details(user(i))),
+        ('mat.calculate_gpa', lambda i: analytics.calculate_gpa(user(i))),
+        ('mat.get_grade_statistics', lambda i: analytics.get_grade_statistics(user(i))),
+        ('mat.get_eca_summary', lambda i: analytics.get_eca_summary(user(i))),
+        ('mat.get_overall_statistics', lambda i: analytics.get_overall_statistics()),
+        ('student.update_student_profile', lambda i: student.update_student_profile(user(i), {'address': f'Street {i}'})),
+        ('student.add_student_grade', lambda i: student.add_student_grade(user(i), 'Math', 50 + i % 50)),
+        ('student.add_student_eca', lambda i: student.add_student_eca(user(i), 'Benchmarking', 'Member', 2)),
+        ('student.import_grades', lambda i: student.import_grades([{'username': user(i), 'subject': 'Physics', 'grade': 70}])),
+        ('student.import_eca', lambda i: student.import_eca([{'username': user(i), 'activity': 'Chess', 'role': 'Member', 'hours_per_week': 1}])),
+        ('admin.add_user', lambda i: admin.add_user(f'bench{i}', 'Bench User', 'pw', 'student')),
+        ('admin.import_users', lambda i: admin.import_users([{'username': f'bulk{i}', 'full_name': 'Bulk', 'password': 'pw', 'role': 'student'}])),
+        ('admin.update_user', lambda i: admin.update_user(user(i), {'email': f'{i}@example.com'})),
+        ('admin.modify_student_data', lambda i: admin.modify_student_data(user(i), {'level': i % 5})),
+        ('admin.update_student_profile', lambda i: admin.update_student_profile(user(i), {'address': f'Road {i}'})),
+        ('admin.update_student_grades', lambda i: admin.update_student_grades(user(i), {'English': {'grade': 60}})),
+        ('admin.update_student_eca', lambda i: admin.update_student_eca(user(i), {'Music': {'role': 'Member', 'hours_per_week': 3}})),
+        ('admin.remove_user', lambda i: admin.remove_user(last(i))),
+        ('admin.remove_users', lambda i: admin.remove_users([last(100 + i)])),
+    ]
+
+    if charts:
+        import matplotlib
+        matplotlib.use('Agg')
+        grades = lambda i: student.get_student_grades(user(i))
+        eca = lambda i: student.get_student_eca(user(i)) or [{'activity': 'None', 'hours_per_week': 1}]
+        # Charts are read-only, so they run before the cases that modify data
+        position = [name for name, _ in cases].index('mat.get_overall_statistics') + 1
+        cases[position:position] = [
+            ('mat.create_grades_chart', lambda i: analytics.create_grades_chart(grades(i), user(i))),
+            ('mat.create_eca_chart', lambda i: analytics.create_eca_chart(eca(i), user(i))),
+            ('mat.create_performance_summary', lambda i: analytics.create_performance_summary(grades(i), eca(i), user(i))),
+            ('mat.create_overall_grades_distribution', lambda i: analytics.create_overall_grades_distribution()),
+            ('mat.create_subject_performance_comparison', lambda i: analytics.create_subject_performance_comparison()),
+            ('mat.create_eca_distribution', lambda i: analytics.create_eca_distribution()),
+            ('mat.create_hours_distribution', lambda i: analytics.create_hours_distribution()),
+        ]
+    return cases
+
+
+def run_case(function, repeat):
+    """
+    Time a case and measure its peak memory.
+    Returns:
+        Dictionary with the timings in seconds and the peak memory in MiB
+    """
+    timings = []
+    # The data functions print progress messages; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            start = time.perf_counter()
+            function(i)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        function(repeat)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'max_s': max(timings),
+        'peak_mib': peak / 2 ** 20
+    }
+
+
+def run_benchmarks(sizes, repeat, charts=False, only=None):
+    """Run every case at every size in a scratch data directory"""
+    from datagen import generate_dataset
+
+    results = []
+    original_dir = os.getcwd()
+    for size in sizes:
+        work_dir = tempfile.mkdtemp(prefix=f"benchmark_{size}_")
+        try:
+            start = time.perf_counter()
+            rows = generate_dataset(os.path.join(work_dir, "data"), size)
+            print(f"\n{size} students ({rows['grade_values']} grades, {rows['eca']} ECA rows), "
+                  f"generated in {time.perf_counter() - start:.1f}s")
+
+            # The data functions use paths relative to the working directory
+            os.chdir(work_dir)
+            for name, function in benchmark_cases(size, charts):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                result = {'function': name, 'size': size, **run_case(function, repeat)}
+                results.append(result)
+                print(f"  {name:42s} median {result['median_s'] * 1000:10.2f} ms   "
+                      f"peak {result['peak_mib']:9.1f} MiB")
+        finally:
+            os.chdir(original_dir)
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _metadata():
+    """Describe the environment the benchmarks ran in"""
+    import numpy
+    import pandas
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pandas.__version__,
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count()
+    }
+
+
+def compare(baseline_path, current_path, threshold):
+    """
+    Print the change in median time and peak memory between two result files.
+    Returns:
+        Number of cases whose median time grew by more than the threshold
+    """
+    with open(baseline_path) as f:
+        baseline = {(r['function'], r['size']): r for r in json.load(f)['results']}
+    with open(current_path) as f:
+        current = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'function':42s} {'size':>8s} {'time':>8s} {'memory':>8s}")
+    for result in current:
+        old = baseline.get((result['function'], result['size']))
+        if old is None:
+            continue
+        time_ratio = result['median_s'] / old['median_s'] if old['median_s'] else 1.0
+        memory_ratio = result['peak_mib'] / old['peak_mib'] if old['peak_mib'] else 1.0
+        flag = ''
+        if time_ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{result['function']:42s} {result['size']:8d} {time_ratio:7.2f}x {memory_ratio:7.2f}x{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the data and analytics functions")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of students")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case")
+    parser.add_argument('--charts', action='store_true', help="Also benchmark the chart functions")
+    parser.add_argument('--only', nargs='+', help="Only run cases whose name contains one of these")
+    parser.add_argument('--output', help="Result file (default: benchmark_results/<timestamp>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help="Compare two result files")
+    parser.add_argument('--threshold', type=float, default=1.25, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    sys.path.insert(0, PACKAGE_DIR)
+    metadata = _metadata()
+    results = run_benchmarks(args.sizes, args.repeat, args.charts, args.only)
+
+    output = args.output
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        output = os.path.join(PACKAGE_DIR, "benchmark_results", f"{stamp}.json")
+    if os.path.dirname(output) and not os.path.exists(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
@@ -0,0 +1,146 @@
+"""
+Correlation matrices across students, computed in bulk.
+
+- Subject x subject: Pearson correlation of every pair of subjects over the
+  students graded in both, from sums over the pairs of grades each student
+  has (the products G.T @ G of the sparse grades matrix) instead of one pass
+  per pair of subjects.
+- Activity x subject: correlation between taking part in an activity and the
+  grade in a subject (point-biserial), from a sparse student x activity
+  incidence matrix built from eca.csv. Only the products of the incidence
+  matrix with the grades matrix are needed, so the cost grows with the
+  number of ECA records rather than students x activities.
+- Activity x activity: number of students taking part in both activities.
+
+The products are computed with np.bincount over the pairs of non-zero
+entries that share a row (sparse_grades.row_pairs), so no dense students x
+subjects or students x activities array is made.
+"""
+import os
+import numpy as np
+import pandas as pd
+from tables import read_table
+from sparse_grades import SparseMatrix, read_grades, row_pairs
+from metrics import instrument
+
+# Correlations over fewer students than this are left out (NaN)
+MIN_STUDENTS = 10
+
+
+def incidence_matrix(eca, usernames):
+    """
+    Build the sparse 0/1 student x activity matrix of ECA records.
+    Args:
+        eca: ECA table with username and activity columns
+        usernames: Students in row order; records of other users are skipped
+    Returns:
+        SparseMatrix with usernames as rows and activities as columns
+    """
+    rows = pd.Index(usernames).get_indexer(eca['username'].to_numpy(dtype=object))
+    columns, activities = pd.factorize(eca['activity'].astype(object))
+    known = (rows >= 0) & (columns >= 0)
+    # A student listed twice for an activity still counts once
+    width = max(len(activities), 1)
+    codes = np.unique(rows[known].astype(np.int64) * width + columns[known])
+    return SparseMatrix.from_coordinates(codes // width, codes % width, np.ones(len(codes), dtype=np.float32),
+                                         usernames, activities)
+
+
+def _pair_sums(left, right, weights):
+    """
+    Sums over students of products of left and right entries in the same row,
+    e.g. left.T @ right, as left columns x right columns arrays.
+    Args:
+        weights: Functions of (left values, right values) giving the terms of each sum
+    """
+    width = len(right.column_names)
+    size = len(left.column_names) * width
+    sums = [np.zeros(size) for _ in weights]
+    for left_index, right_index in row_pairs(left, right):
+        codes = left.indices[left_index].astype(np.int64) * width + right.indices[right_index]
+        left_values = left.data[left_index].astype(float)
+        right_values = right.data[right_index].astype(float)
+        for total, weight in zip(sums, weights):
+            total += np.bincount(codes, weights=weight(left_values, right_values), minlength=size)
+    return [total.reshape(len(left.column_names), width) for total in sums]
+
+
+def _correlation(count, sum_x, sum_y, sum_xx, sum_yy, sum_xy, min_students):
+    """Pearson correlation from pairwise sums, NaN where undefined or too few students"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = count * sum_xy - sum_x * sum_y
+        spread = (count * sum_xx - sum_x ** 2) * (count * sum_yy - sum_y ** 2)
+        result = covariance / np.sqrt(spread)
+    result[(count < min_students) | ~(spread > 0)] = np.nan
+    return np.clip(result, -1.0, 1.0)
+
+
+def subject_correlation(grades, min_students=MIN_STUDENTS):
+    """
+    Correlation of every pair of subjects over the students graded in both.
+    Args:
+        grades: Sparse student x subject matrix (see sparse_grades.read_grades)
+    Returns:
+        Subjects x subjects array
+    """
+    # Entry (i, j) of each sum is over the students graded in both i and j
+    count, sum_x, sum_xx, sum_xy = _pair_sums(grades, grades, [
+        lambda x, y: np.ones_like(x),
+        lambda x, y: x,
+        lambda x, y: x * x,
+        lambda x, y: x * y
+    ])
+    return _correlation(count, sum_x, sum_x.T, sum_xx, sum_xx.T, sum_xy, min_students)
+
+
+def activity_subject_correlation(incidence, grades, min_students=MIN_STUDENTS):
+    """
+    Correlation between taking part in each activity (0/1) and each subject's
+    grade, over the students graded in the subject.
+    Args:
+        incidence: Student x activity matrix with the same rows as grades
+        grades: Sparse student x subject matrix
+    Returns:
+        Activities x subjects array (NaN where fewer than min_students take part)
+    """
+    participants, grade_sums = _pair_sums(incidence, grades, [
+        lambda a, x: np.ones_like(x),
+        lambda a, x: x
+    ])
+    # Participation is 0/1, so its sum and sum of squares are both the participant count
+    count = grades.column_counts()[None, :]
+    correlation = _correlation(count, participants, grades.column_sums()[None, :], participants,
+                               grades.column_sums(2)[None, :], grade_sums, 0)
+    correlation[participants < min_students] = np.nan
+    return correlation
+
+
+@instrument
+def correlation_matrices(data_dir="data", min_students=MIN_STUDENTS):
+    """
+    Read the grades and ECA tables and compute all correlation matrices.
+    Returns:
+        Dictionary of DataFrames: 'subjects' (subject x subject), 'activities'
+        (activity x subject), 'co_participation' (activity x activity), and the
+        Series 'participants' (students per activity)
+    """
+    # Students listed twice in grades.csv keep their first row
+    grades = read_grades(os.path.join(data_dir, "grades.csv")).first_rows()
+    subjects = grades.column_names
+    matrices = {
+        'subjects': pd.DataFrame(subject_correlation(grades, min_students), index=subjects, columns=subjects)
+    }
+
+    eca_path = os.path.join(data_dir, "eca.csv")
+    if os.path.exists(eca_path):
+        eca = read_table(eca_path, compact=True, usecols=['username', 'activity'])
+    else:
+        eca = pd.DataFrame(columns=['username', 'activity'])
+    incidence = incidence_matrix(eca, grades.row_names)
+    activities = incidence.column_names
+    matrices['activities'] = pd.DataFrame(activity_subject_correlation(incidence, grades, min_students),
+                                          index=activities, columns=subjects)
+    co_participation, = _pair_sums(incidence, incidence, [lambda a, b: np.ones_like(a)])
+    matrices['co_participation'] = pd.DataFrame(co_participation, index=activities, columns=activities)
+    matrices['participants'] = pd.Series(incidence.column_counts(), index=activities)
+    return matrices
@@ -0,0 +1,218 @@
+"""
+Synthetic data generator matching the schemas of the files in data/.
+
+Students are named student0, student1, ... and all have the password
+'studentpass'; one admin account ('admin' / 'password') is always included.
+The data follows realistic distributions: each department takes its own set
+of subjects, grades depend on the student's ability and the subject's
+difficulty, activity popularity is Zipf-distributed and hours depend on the
+role held. Generation is vectorized and the files are written in chunks, so
+millions of students (tens of millions of grades) take seconds and memory
+does not grow with the size of the dataset.
+
+Usage: python datagen.py OUTPUT_DIR --students 100000 [--seed 0] [--zipf 1.2]
+"""
+import os
+import argparse
+import numpy as np
+
+# Students generated and written at a time
+CHUNK_STUDENTS = 250000
+
+# Subject name and its mean grade; harder subjects have lower means
+SUBJECTS = {
+    'English': 74, 'Math': 64, 'Physics': 62, 'Chemistry': 66, 'Biology': 71,
+    'Programming': 69, 'Databases': 72, 'Networking': 70, 'Statistics': 65,
+    'Economics': 68, 'Accounting': 67, 'Management': 73
+}
+
+# Department, share of the students and the subjects it takes
+DEPARTMENTS = {
+    'Computer Science': (0.30, ['English', 'Math', 'Physics', 'Programming', 'Databases', 'Networking']),
+    'IT': (0.20, ['English', 'Math', 'Programming', 'Databases', 'Networking']),
+    'Business': (0.15, ['English', 'Statistics', 'Economics', 'Accounting', 'Management']),
+    'Mathematics': (0.10, ['English', 'Math', 'Physics', 'Statistics', 'Programming']),
+    'Physics': (0.10, ['English', 'Math', 'Physics', 'Chemistry']),
+    'Biology': (0.15, ['English', 'Chemistry', 'Biology', 'Statistics'])
+}
+
+# Activities from most to least popular
+ACTIVITIES = [
+    'Football', 'Music', 'Basketball', 'Cricket', 'Dance', 'Badminton', 'Volleyball',
+    'Drama', 'Photography', 'Chess', 'Debate', 'Coding Club', 'Table Tennis', 'Art',
+    'Volunteering', 'Robotics', 'Swimming', 'Literature Club', 'Model UN', 'Astronomy'
+]
+
+# Role, probability and multiplier of the weekly hours
+ECA_ROLES = {'Member': (0.82, 1.0), 'Leader': (0.12, 1.6), 'Captain': (0.06, 2.0)}
+
+FIRST_NAMES = [
+    'Aarav', 'Aayush', 'Anish', 'Bibek', 'Bikash', 'Dipesh', 'Kiran', 'Manish', 'Nirajan',
+    'Prakash', 'Rohan', 'Sandeep', 'Sudan', 'Suraj', 'Ashmita', 'Bipana', 'Kabita', 'Manisha',
+    'Nisha', 'Pooja', 'Prerana', 'Sabina', 'Sarita', 'Sunita', 'James', 'Oliver', 'Emma', 'Sophia'
+]
+LAST_NAMES = [
+    'Sah', 'Sharma', 'Shrestha', 'Thapa', 'Gurung', 'Tamang', 'Rai', 'Magar', 'Karki', 'Adhikari',
+    'Pudasaini', 'Poudel', 'Bhattarai', 'Khadka', 'Basnet', 'Joshi', 'Smith', 'Jones', 'Brown'
+]
+# Share of the students living in each city
+CITIES = {'Kathmandu': 0.45, 'Lalitpur': 0.15, 'Bhaktapur': 0.1, 'Pokhara': 0.12,
+          'Biratnagar': 0.08, 'Butwal': 0.05, 'Dharan': 0.05}
+
+# Mean number of activities per student (Poisson), and the most one student has
+MEAN_ACTIVITIES = 1.3
+MAX_ACTIVITIES = 5
+
+
+def _encode(values):
+    """Convert a list of strings to a numpy byte string array"""
+    return np.array([value.encode() for value in values])
+
+
+def _numbers(values):
+    """Format non-negative integers as byte strings"""
+    text = values.astype(np.int64).astype('S')
+    # astype('S') allows for 21 digits; narrow it so joined rows stay small
+    return text.astype(f"S{max(1, int(np.strings.str_len(text).max(initial=1)))}")
+
+
+def _floats(values):
+    """Format numbers as byte strings with one decimal place ("85.0"), NaN as empty"""
+    missing = np.isnan(values)
+    tenths = np.rint(np.where(missing, 0, values) * 10).astype(np.int64)
+    # Values have few distinct tenths (grades, hours, levels), so format each once
+    table = _encode([f"{t // 10}.{t % 10}" for t in range(int(tenths.max(initial=0)) + 1)] + [''])
+    return table[np.where(missing, len(table) - 1, tenths)]
+
+
+def _write_rows(f, columns):
+    """
+    Write rows of comma-separated values.
+    Values are byte string arrays and must not contain commas, quotes or newlines.
+    """
+    line = columns[0]
+    for column in columns[1:]:
+        line = np.strings.add(np.strings.add(line, b','), column)
+    if len(line):
+        f.write(b'\n'.join(line.tolist()) + b'\n')
+
+
+def _zipf_weights(count, exponent):
+    """Probabilities of the ranks 1..count under Zipf's law"""
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _student_chunk(rng, start, stop, zipf):
+    """
+    Generate the rows of students start..stop-1.
+    Returns:
+        Tuple of (users, grades, eca) lists of byte string columns
+    """
+    n = stop - start
+    ids = _numbers(np.arange(start, stop))
+    usernames = np.strings.add(b'student', ids)
+
+    departments = list(DEPARTMENTS)
+    department = rng.choice(len(departments), n, p=[DEPARTMENTS[d][0] for d in departments])
+    first = rng.integers(0, len(FIRST_NAMES), n)
+    last = rng.integers(0, len(LAST_NAMES), n)
+    city = rng.choice(len(CITIES), n, p=list(CITIES.values()))
+    users = [
+        usernames,
+        np.strings.add(np.strings.add(_encode(FIRST_NAMES)[first], b' '), _encode(LAST_NAMES)[last]),
+        np.full(n, b'student'),
+        np.strings.add(usernames, b'@university.edu'),
+        np.strings.add(b'98', _numbers(rng.integers(10000000, 100000000, n))),
+        np.strings.add(np.strings.add(b'Ward ', _numbers(rng.integers(1, 33, n))),
+                       np.strings.add(b' ', _encode(list(CITIES))[city])),
+        _encode(departments)[department],
+        _floats(rng.choice([1, 2, 3, 4], n, p=[0.3, 0.27, 0.23, 0.2]).astype(float))
+    ]
+
+    # Grades: mean of the subject + student ability + noise, only for the subjects
+    # of the student's department; a few are missing (not graded yet)
+    subjects = list(SUBJECTS)
+    takes = np.array([[subject in DEPARTMENTS[d][1] for subject in subjects] for d in departments])
+    ability = rng.normal(0, 9, n)
+    grades = [usernames]
+    for i, subject in enumerate(subjects):
+        values = np.clip(np.rint(SUBJECTS[subject] + ability + rng.normal(0, 7, n)), 0, 100)
+        missing = ~takes[department, i] | (rng.random(n) < 0.02)
+        grades.append(_floats(np.where(missing, np.nan, values)))
+
+    # Activities: a Poisson number per student, each drawn by Zipf popularity,
+    # keeping one row per (student, activity)
+    per_student = np.minimum(rng.poisson(MEAN_ACTIVITIES, n), MAX_ACTIVITIES)
+    student = np.repeat(np.arange(n), per_student)
+    activity = rng.choice(len(ACTIVITIES), len(student), p=_zipf_weights(len(ACTIVITIES), zipf))
+    _, first_rows = np.unique(student * len(ACTIVITIES) + activity, return_index=True)
+    student, activity = student[first_rows], activity[first_rows]
+
+    roles = list(ECA_ROLES)
+    role = rng.choice(len(roles), len(student), p=[ECA_ROLES[r][0] for r in roles])
+    multiplier = np.array([ECA_ROLES[r][1] for r in roles])[role]
+    hours = np.clip(np.round(rng.gamma(2.0, 1.5, len(student)) * multiplier * 2) / 2, 0.5, 20)
+    eca = [
+        usernames[student],
+        _encode(ACTIVITIES)[activity],
+        _encode(roles)[role],
+        _floats(hours),
+        np.full(len(student), b'')
+    ]
+    return users, grades, eca
+
+
+def generate_dataset(data_dir, students, seed=0, zipf=1.2):
+    """
+    Write users.csv, passwords.csv, grades.csv and eca.csv for a number of students.
+    Args:
+        data_dir: Directory to write the files to (created if missing)
+        students: Number of students
+        seed: Random seed; the same seed always gives the same files
+        zipf: Exponent of the Zipf distribution of activity popularity
+    Returns:
+        Dictionary of table name to number of rows written, and the number
+        of grades in 'grade_values'
+    """
+    rng = np.random.default_rng(seed)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+
+    subjects = list(SUBJECTS)
+    files = {name: open(os.path.join(data_dir, f"{name}.csv"), 'wb')
+             for name in ('users', 'passwords', 'grades', 'eca')}
+    rows = {'users': 1, 'passwords': 1, 'grades': students, 'eca': 0, 'grade_values': 0}
+    try:
+        files['users'].write(b'username,full_name,role,email,phone,address,department,level\n'
+                             b'admin,Admin User,admin,admin@university.edu,1234567890,'
+                             b'123 Admin St,Administration,0.0\n')
+        files['passwords'].write(b'username,password,role\nadmin,password,admin\n')
+        files['grades'].write(','.join(['username'] + subjects).encode() + b'\n')
+        files['eca'].write(b'username,activity,role,hours_per_week,description\n')
+
+        for start in range(0, students, CHUNK_STUDENTS):
+            stop = min(start + CHUNK_STUDENTS, students)
+            users, grades, eca = _student_chunk(rng, start, stop, zipf)
+            _write_rows(files['users'], users)
+            _write_rows(files['passwords'], [users[0], np.full(stop - start, b'studentpass'), users[2]])
+            _write_rows(files['grades'], grades)
+            _write_rows(files['eca'], eca)
+            rows['users'] += stop - start
+            rows['passwords'] += stop - start
+            rows['eca'] += len(eca[0])
+            rows['grade_values'] += sum(int((column != b'').sum()) for column in grades[1:])
+    finally:
+        for f in files.values():
+            f.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset")
+    parser.add_argument('output_dir', help="Directory for the CSV files, e.g. a scratch copy of data/")
+    parser.add_argument('--students', type=int, default=1000, help="Number of students")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed")
+    parser.add_argument('--zipf', type=float, default=1.2, help="Zipf exponent of activity popularity")
+    args = parser.parse_args()
+    print(generate_dataset(args.output_dir, args.students, args.seed, args.zipf))
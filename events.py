@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import threading
+
+# Event types
+GRADE_CHANGED = 'grade_changed'
+ECA_CHANGED = 'eca_changed'
+USER_CHANGED = 'user_changed'
+USER_REMOVED = 'user_removed'
+
+EVENT_TYPES = (GRADE_CHANGED, ECA_CHANGED, USER_CHANGED, USER_REMOVED)
+
+EVENT_LOG = "data/events.log"
+# The log is truncated once it grows past this size; watchers notice and start over
+MAX_LOG_BYTES = 1024 * 1024
+
+
+class Event:
+    """A change to one user's data"""
+
+    def __init__(self, type, username, data=None, pid=None, timestamp=None):
+        self.type = type
+        self.username = username
+        self.data = data or {}
+        self.pid = pid if pid is not None else os.getpid()
+        self.timestamp = timestamp if timestamp is not None else time.time()
+
+    def to_dict(self):
+        return {
+            'type': self.type,
+            'username': self.username,
+            'data': self.data,
+            'pid': self.pid,
+            'timestamp': self.timestamp
+        }
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record['type'], record['username'], record.get('data'),
+                   record.get('pid'), record.get('timestamp'))
+
+    def __repr__(self):
+        return f"Event({self.type!r}, {self.username!r}, {self.data!r})"
+
+
+_subscribers = {event_type: [] for event_type in EVENT_TYPES}
+
+
+def subscribe(event_type, callback):
+    """
+    Register a callback for an event type.
+    Returns:
+        A function that removes the subscription
+    """
+    if event_type not in _subscribers:
+        raise ValueError(f"Unknown event type: {event_type}")
+    _subscribers[event_type].append(callback)
+
+    def unsubscribe():
+        if callback in _subscribers[event_type]:
+            _subscribers[event_type].remove(callback)
+    return unsubscribe
+
+
+def dispatch(event):
+    """Deliver an event to the in-process subscribers"""
+    for callback in list(_subscribers.get(event.type, [])):
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Error handling {event.type} event: {e}")
+
+
+def publish(event_type, username, **data):
+    """Publish a change to in-process subscribers and to the shared event log"""
+    event = Event(event_type, username, data)
+    dispatch(event)
+    _append_to_log(event)
+    return event
+
+
+def publish_many(event_type, changes):
+    """
+    Publish one event per (username, data) pair with a single event log write.
+    Used by bulk operations so that thousands of changes cost one append.
+    """
+    published = []
+    for username, data in changes:
+        event = Event(event_type, username, data)
+        dispatch(event)
+        published.append(event)
+    _append_to_log(*published)
+    return published
+
+
+def _append_to_log(*published):
+    """Append events to the event log read by other processes"""
+    if not published:
+        return
+    try:
+        if not os.path.exists("data"):
+            os.makedirs("data")
+        if os.path.exists(EVENT_LOG) and os.path.getsize(EVENT_LOG) > MAX_LOG_BYTES:
+            open(EVENT_LOG, 'w').close()
+        with open(EVENT_LOG, 'a') as f:
+            f.write("".join(json.dumps(event.to_dict(), default=str) + "\n" for event in published))
+    except Exception as e:
+        print(f"Error writing event log: {e}")
+
+
+class _LogTailer:
+    """Reads the events appended to the event log; one per log path and process"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Start at the end of the log: only changes from now on matter
+        self.offset = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def read_new(self):
+        """Events of other processes appended since the last read"""
+        if not os.path.exists(self.path):
+            self.offset = 0
+            return []
+
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            # The log was truncated
+            self.offset = 0
+        if size == self.offset:
+            return []
+
+        events = []
+        try:
+            with open(self.path, 'r') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith("\n"):
+                        # Partially written line, read it next time
+                        break
+                    self.offset += len(line.encode())
+                    event = Event.from_dict(json.loads(line))
+                    if event.pid != os.getpid():
+                        events.append(event)
+        except Exception as e:
+            print(f"Error reading event log: {e}")
+        return events
+
+
+_tailers = {}
+_tailers_lock = threading.Lock()
+
+
+class EventLogWatcher:
+    """
+    Picks up events published by other processes.
+    Only the bytes appended to the event log since the last poll are read, so
+    polling is cheap compared to re-reading the CSV files. All watchers of a
+    log in one process share its read position, so each event is dispatched
+    once however many windows poll for it.
+    """
+
+    def __init__(self, path=EVENT_LOG):
+        self.path = path
+        with _tailers_lock:
+            if path not in _tailers:
+                _tailers[path] = _LogTailer(path)
+            self._tailer = _tailers[path]
+
+    @property
+    def offset(self):
+        return self._tailer.offset
+
+    def poll(self):
+        """Dispatch new events from other processes and return them"""
+        with self._tailer.lock:
+            events = self._tailer.read_new()
+            for event in events:
+                dispatch(event)
+        return events
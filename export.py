@@ -0,0 +1,183 @@
+"""
+Streaming export of users, grades and ECA records to CSV, JSONL or Excel.
+
+Tables are first copied to a private snapshot inside wal.exclusive(), so all
+of them are from the same moment between logged changes (a copy is retried if
+the file still changes while it is copied), then read back in fixed-size
+chunks, so memory use depends on the chunk size rather than on the size of
+the table. Departments are matched as tables.group_key groups them.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+import pandas as pd
+import wal
+from tables import table_dtypes, group_key
+
+TABLES = {
+    'users': "data/users.csv",
+    'grades': "data/grades.csv",
+    'eca': "data/eca.csv"
+}
+
+FORMATS = ('csv', 'jsonl', 'xlsx')
+
+CHUNK_SIZE = 50000
+SNAPSHOT_RETRIES = 5
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _copy_stable(source, destination):
+    """Copy a file, retrying until it did not change during the copy"""
+    for _ in range(SNAPSHOT_RETRIES):
+        before = _file_version(source)
+        shutil.copyfile(source, destination)
+        if _file_version(source) == before:
+            return
+    raise RuntimeError(f"{source} kept changing while taking a snapshot")
+
+
+@contextmanager
+def snapshot_tables(names):
+    """
+    Copy tables into a temporary directory for consistent reading. No logged
+    change is applied while they are copied.
+    Yields:
+        Dictionary of table name to snapshot path
+    """
+    snapshot_dir = tempfile.mkdtemp(prefix="export_")
+    try:
+        paths = {}
+        with wal.exclusive():
+            for name in names:
+                if not os.path.exists(TABLES[name]):
+                    raise FileNotFoundError(f"{TABLES[name]} not found")
+                paths[name] = os.path.join(snapshot_dir, f"{name}.csv")
+                _copy_stable(TABLES[name], paths[name])
+        yield paths
+    finally:
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+
+def _matching_usernames(users_path, department=None, level=None):
+    """Get the usernames matching the department/level filters, read in chunks"""
+    usernames = set()
+    for chunk in pd.read_csv(users_path, usecols=['username', 'department', 'level'], chunksize=CHUNK_SIZE,
+                             dtype=table_dtypes(TABLES['users'])):
+        mask = pd.Series(True, index=chunk.index)
+        if department is not None:
+            mask &= chunk['department'].map(group_key) == group_key(department)
+        if level is not None:
+            mask &= pd.to_numeric(chunk['level'], errors='coerce') == float(level)
+        usernames.update(chunk.loc[mask, 'username'])
+    return usernames
+
+
+def iter_table_chunks(table, department=None, level=None, subjects=None, chunksize=CHUNK_SIZE):
+    """
+    Stream a table from a consistent snapshot in chunks.
+    Args:
+        table: 'users', 'grades' or 'eca'
+        department: Only include users in this department
+        level: Only include users at this level
+        subjects: For grades, only include these subject columns (rows with none of them are skipped)
+        chunksize: Number of rows per chunk
+    Yields:
+        DataFrame chunks of at most chunksize rows
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+
+    filter_users = department is not None or level is not None
+    names = [table] + (['users'] if filter_users and table != 'users' else [])
+    with snapshot_tables(names) as paths:
+        usernames = _matching_usernames(paths['users'], department, level) if filter_users else None
+
+        # Text schema so exported values match the stored text exactly
+        for chunk in pd.read_csv(paths[table], chunksize=chunksize, dtype=table_dtypes(TABLES[table])):
+            if usernames is not None:
+                chunk = chunk[chunk['username'].isin(usernames)]
+            if table == 'grades' and subjects:
+                columns = [subject for subject in subjects if subject in chunk.columns]
+                chunk = chunk[['username'] + columns].dropna(subset=columns, how='all')
+            if not chunk.empty:
+                yield chunk
+
+
+def _write_csv(chunks, path):
+    rows = 0
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+        rows += len(chunk)
+    if header:
+        # Nothing matched: still write an empty file
+        open(path, 'w').close()
+    return rows
+
+
+def _write_jsonl(chunks, path):
+    rows = 0
+    with open(path, 'w') as f:
+        for chunk in chunks:
+            text = chunk.to_json(orient='records', lines=True)
+            # Older pandas versions leave off the final newline
+            f.write(text if text.endswith("\n") else text + "\n")
+            rows += len(chunk)
+    return rows
+
+
+def _write_xlsx(chunks, path, sheet_name):
+    # openpyxl's write-only mode streams rows to disk instead of building the sheet in memory
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    rows = 0
+    header = True
+    for chunk in chunks:
+        if header:
+            sheet.append(list(chunk.columns))
+            header = False
+        for record in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            sheet.append(list(record))
+        rows += len(chunk)
+    workbook.save(path)
+    return rows
+
+
+def export_table(table, path, format='csv', department=None, level=None, subjects=None, chunksize=CHUNK_SIZE):
+    """
+    Export a table to a file.
+    Args:
+        table: 'users', 'grades' or 'eca'
+        path: Output file path
+        format: 'csv', 'jsonl' or 'xlsx' (xlsx requires openpyxl)
+        department, level, subjects: Filters, see iter_table_chunks
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        if format not in FORMATS:
+            return False, f"Format must be one of: {', '.join(FORMATS)}"
+
+        chunks = iter_table_chunks(table, department, level, subjects, chunksize)
+        if format == 'csv':
+            rows = _write_csv(chunks, path)
+        elif format == 'jsonl':
+            rows = _write_jsonl(chunks, path)
+        else:
+            try:
+                rows = _write_xlsx(chunks, path, table)
+            except ImportError:
+                return False, "Excel export requires the openpyxl package"
+
+        return True, f"Exported {rows} {table} rows to {path}"
+    except Exception as e:
+        return False, f"Error exporting {table}: {str(e)}"
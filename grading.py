@@ -0,0 +1,218 @@
+"""
+Grading scales and credit-weighted GPA.
+
+A scale maps a percentage grade to a letter and grade points through bands:
+each band has the lowest percentage it covers, a letter and its points. The
+'percentage' scale keeps the original conversion (points = grade / 25) and
+has no letters.
+
+A student's GPA is the credit-weighted mean of the points of their grades;
+subjects without a configured credit weight count 1. Conversion uses
+np.searchsorted over the band edges, so the whole grades matrix is converted
+at once and every GPA can be recomputed right after switching scales.
+
+The chosen scale, credit weights and any custom scales are kept in
+data/grading.json:
+
+    {"scale": "letter_4", "credits": {"Mathematics": 4, "Art": 2},
+     "scales": {"pass_fail": [{"min": 50, "letter": "P", "points": 4},
+                              {"min": 0, "letter": "F", "points": 0}]}}
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from metrics import instrument
+
+SETTINGS_FILE = "data/grading.json"
+DEFAULT_SCALE = 'percentage'
+
+# Bands as (lowest percentage, letter, points)
+BUILTIN_SCALES = {
+    'letter_4': [
+        (93, 'A', 4.0), (90, 'A-', 3.7), (87, 'B+', 3.3), (83, 'B', 3.0), (80, 'B-', 2.7),
+        (77, 'C+', 2.3), (73, 'C', 2.0), (70, 'C-', 1.7), (67, 'D+', 1.3), (65, 'D', 1.0), (0, 'F', 0.0)
+    ],
+    'letter_simple': [
+        (90, 'A', 4.0), (80, 'B', 3.0), (70, 'C', 2.0), (60, 'D', 1.0), (0, 'F', 0.0)
+    ],
+    'uk_honours': [
+        (70, 'First', 4.0), (60, '2:1', 3.3), (50, '2:2', 2.7), (40, 'Third', 2.0), (0, 'Fail', 0.0)
+    ]
+}
+
+
+class GradingScale:
+    """Conversion of percentage grades to letters and grade points"""
+
+    def __init__(self, name, bands=None, divisor=None):
+        """
+        Args:
+            name: Scale name
+            bands: List of (lowest percentage, letter, points), in any order
+            divisor: For a linear scale without bands, points = grade / divisor
+        """
+        self.name = name
+        self.divisor = divisor
+        bands = sorted(bands or [], key=lambda band: float(band[0]))
+        self.edges = np.array([float(band[0]) for band in bands])
+        self.letters = np.array([band[1] for band in bands], dtype=object)
+        self.points = np.array([float(band[2]) for band in bands])
+
+    @property
+    def bands(self):
+        """Bands from the highest to the lowest"""
+        return [(edge, letter, points) for edge, letter, points
+                in zip(self.edges[::-1], self.letters[::-1], self.points[::-1])]
+
+    def _bands_of(self, values):
+        """Band number of each value (-1 below the lowest band)"""
+        return np.searchsorted(self.edges, values, side='right') - 1
+
+    def to_points(self, values):
+        """Grade points of an array of percentages (NaN stays NaN)"""
+        values = np.asarray(values, dtype=float)
+        if self.divisor:
+            return values / self.divisor
+        band = self._bands_of(values)
+        return np.where(np.isnan(values) | (band < 0), np.nan, self.points[np.maximum(band, 0)])
+
+    def to_letters(self, values):
+        """Letters of an array of percentages (None where there is no band)"""
+        values = np.asarray(values, dtype=float)
+        if self.divisor or not len(self.edges):
+            return np.full(values.shape, None, dtype=object)
+        band = self._bands_of(values)
+        return np.where(np.isnan(values) | (band < 0), None, self.letters[np.maximum(band, 0)])
+
+
+def load_settings(path=SETTINGS_FILE):
+    """
+    Load the grading settings.
+    Returns:
+        Dictionary with 'scale' (name), 'credits' (subject -> weight) and 'scales' (custom bands)
+    """
+    settings = {'scale': DEFAULT_SCALE, 'credits': {}, 'scales': {}}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                settings.update(json.load(f))
+        except Exception as e:
+            print(f"Error loading grading settings, using the defaults: {e}")
+    return settings
+
+
+def save_settings(settings, path=SETTINGS_FILE):
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=2)
+
+
+def scale_names(settings=None):
+    """Names of all available scales"""
+    settings = settings or load_settings()
+    return [DEFAULT_SCALE] + sorted(set(BUILTIN_SCALES) | set(settings['scales']))
+
+
+def get_scale(name=None, settings=None):
+    """
+    Get a grading scale.
+    Args:
+        name: Scale name (default: the configured scale)
+    Returns:
+        GradingScale (the 'percentage' scale if the name is unknown)
+    """
+    settings = settings or load_settings()
+    name = name or settings['scale']
+    if name in settings['scales']:
+        return GradingScale(name, [(band['min'], band['letter'], band['points'])
+                                   for band in settings['scales'][name]])
+    if name in BUILTIN_SCALES:
+        return GradingScale(name, BUILTIN_SCALES[name])
+    return GradingScale(DEFAULT_SCALE, divisor=25)
+
+
+def set_scale(name):
+    """
+    Make a scale the one used for GPAs.
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        settings = load_settings()
+        if name not in scale_names(settings):
+            return False, f"Unknown grading scale: {name}"
+        settings['scale'] = name
+        save_settings(settings)
+        return True, f"Grading scale set to {name}"
+    except Exception as e:
+        return False, f"Error setting grading scale: {str(e)}"
+
+
+def set_credits(credits):
+    """
+    Set the credit weights of subjects (a weight of 1 removes the setting).
+    Args:
+        credits: Dictionary of subject -> credit weight
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        settings = load_settings()
+        for subject, weight in credits.items():
+            weight = float(weight)
+            if weight < 0:
+                return False, f"Credit weight of {subject} must not be negative"
+            if weight == 1:
+                settings['credits'].pop(subject, None)
+            else:
+                settings['credits'][subject] = weight
+        save_settings(settings)
+        return True, f"Credit weights updated for {len(credits)} subjects"
+    except Exception as e:
+        return False, f"Error setting credit weights: {str(e)}"
+
+
+def _weighted_gpa(points, weights, groups, size):
+    """Weighted mean of points per group, NaN for groups without weight"""
+    weights = np.where(np.isnan(points), 0.0, weights)
+    totals = np.bincount(groups, weights=np.nan_to_num(points) * weights, minlength=size)
+    weight_totals = np.bincount(groups, weights=weights, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weight_totals > 0, totals / weight_totals, np.nan)
+
+
+def student_gpa(grades, scale=None, settings=None):
+    """
+    GPA of one student.
+    Args:
+        grades: Dictionary or Series of subject -> percentage grade
+    Returns:
+        GPA rounded to 2 decimals, or None without grades
+    """
+    settings = settings or load_settings()
+    scale = scale or get_scale(settings=settings)
+    grades = pd.Series(grades, dtype=float).dropna()
+    if grades.empty:
+        return None
+    weights = np.array([float(settings['credits'].get(subject, 1)) for subject in grades.index])
+    gpa = _weighted_gpa(scale.to_points(grades.to_numpy()), weights, np.zeros(len(grades), dtype=np.int64), 1)[0]
+    return None if np.isnan(gpa) else round(float(gpa), 2)
+
+
+@instrument
+def batch_gpa(grades, scale=None, settings=None):
+    """
+    GPA of every student in one vectorized pass.
+    Args:
+        grades: Sparse student x subject matrix (see sparse_grades.SparseMatrix)
+    Returns:
+        Series of username -> GPA (NaN without grades), first row per username
+    """
+    settings = settings or load_settings()
+    scale = scale or get_scale(settings=settings)
+    grades = grades.first_rows()
+    subject_weights = np.array([float(settings['credits'].get(subject, 1)) for subject in grades.column_names])
+    points = scale.to_points(grades.data)
+    weights = subject_weights[grades.indices] if len(subject_weights) else np.ones(0)
+    gpa = _weighted_gpa(points, weights, grades.entry_rows(), grades.shape[0])
+    return pd.Series(gpa, index=grades.row_names, name='gpa')
@@ -0,0 +1,457 @@
+"""
+Consistency checks across the data tables, with optional repair.
+
+All four tables are read once and every check is a vectorized mask or
+anti-join (Series.isin against the usernames of another table), so a
+million-row dataset is checked in seconds. Each problem row is reported once,
+under the first check it fails, with the repair that fixes it:
+
+    drop_row     the row is removed
+    clear_value  the cell is emptied (invalid grade or level)
+    fix_role     passwords.csv gets the role from users.csv
+    add_column   a missing column is added with empty values
+    (none)       reported only; needs a decision by an admin
+
+repair() applies all repairs together while no logged call can run (see
+wal.exclusive): every changed table is written to data/.repair first, then a
+manifest naming them is written and the files are moved into place. A crash
+while they are moved leaves the manifest, and wal.recover() finishes the
+move (see finish_repair). Dropped users and cleared values are recorded in
+the audit log, and change events are published so open dashboards and
+caches follow.
+
+    python -m admin_cli check [--repair]
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import audit
+import events
+import wal
+from tables import read_table, write_table
+from admin import USER_COLUMNS, PASSWORD_COLUMNS
+from metrics import instrument
+
+ECA_COLUMNS = ['username', 'activity', 'role', 'hours_per_week', 'description']
+EXPECTED_COLUMNS = {'users': USER_COLUMNS, 'passwords': PASSWORD_COLUMNS, 'eca': ECA_COLUMNS}
+TABLES = ('users', 'passwords', 'grades', 'eca')
+ROLES = ('admin', 'student')
+
+ISSUE_COLUMNS = ['table', 'line', 'username', 'field', 'check', 'message', 'repair']
+# Tables written by repair() whose changes are recorded in the audit log (as by admin.remove_user)
+AUDITED_TABLES = ('users', 'grades')
+REPAIR_DIR = ".repair"
+
+
+def load_tables(data_dir="data"):
+    """Read every table that exists, keyed by table name (missing tables are None)"""
+    tables = {}
+    for name in TABLES:
+        path = os.path.join(data_dir, f"{name}.csv")
+        tables[name] = read_table(path, low_memory=False) if os.path.exists(path) else None
+    return tables
+
+
+def _issues(table, df, mask, check, message, repair, field=None):
+    """Issues for the rows of a table selected by a boolean mask"""
+    rows = df[mask]
+    return pd.DataFrame({
+        'table': table,
+        # Line number in the CSV file, counting the header as line 1
+        'line': rows.index.to_numpy() + 2,
+        'username': rows['username'].to_numpy(dtype=object) if 'username' in rows else None,
+        'field': field,
+        'check': check,
+        'message': message,
+        'repair': repair
+    }, columns=ISSUE_COLUMNS)
+
+
+def _row_checks(table, df, checks):
+    """
+    Run row checks in order; a row is reported under the first check it fails.
+    Args:
+        checks: List of (mask, check, message, repair)
+    Returns:
+        Tuple of (list of issue DataFrames, mask of the rows that will be dropped)
+    """
+    found = []
+    flagged = pd.Series(False, index=df.index)
+    dropped = pd.Series(False, index=df.index)
+    for mask, check, message, repair in checks:
+        mask = mask & ~flagged
+        if mask.any():
+            found.append(_issues(table, df, mask, check, message, repair))
+            flagged |= mask
+            if repair == 'drop_row':
+                dropped |= mask
+    return found, dropped
+
+
+def _schema_issues(table, df):
+    """Missing and unexpected columns of a table"""
+    found = []
+    expected = EXPECTED_COLUMNS.get(table, ['username'])
+    for column in expected:
+        if column not in df.columns:
+            found.append({'table': table, 'field': column, 'check': 'missing_column',
+                          'message': f"Column '{column}' is missing",
+                          'repair': 'add_column' if column != 'username' else None})
+    if table != 'grades':
+        for column in df.columns:
+            if column not in expected:
+                found.append({'table': table, 'field': column, 'check': 'unexpected_column',
+                              'message': f"Unexpected column '{column}'", 'repair': None})
+    else:
+        # pandas renames repeated headers to 'Name.1'
+        for column in df.columns:
+            base, _, suffix = str(column).rpartition('.')
+            if suffix.isdigit() and base in df.columns:
+                found.append({'table': table, 'field': column, 'check': 'duplicate_column',
+                              'message': f"Subject '{base}' appears more than once in the header", 'repair': None})
+    return pd.DataFrame(found, columns=ISSUE_COLUMNS)
+
+
+def _blank(series):
+    text = series.fillna('').astype(str)
+    return (text == '') | text.str.isspace()
+
+
+def check_tables(tables):
+    """
+    Check the tables against each other.
+    Args:
+        tables: Dictionary of table name to DataFrame (see load_tables)
+    Returns:
+        DataFrame of issues with table, line, username, field, check, message and repair
+    """
+    found = []
+    for name, df in tables.items():
+        if df is not None:
+            found.append(_schema_issues(name, df))
+    # Tables without a username column cannot be checked any further
+    usable = {name: df for name, df in tables.items() if df is not None and 'username' in df.columns}
+
+    users = usable.get('users')
+    if users is not None:
+        users = users.reindex(columns=USER_COLUMNS)
+        level = pd.to_numeric(users['level'], errors='coerce')
+        has_password = pd.Series(False, index=users.index)
+        if 'passwords' in usable:
+            has_password = users['username'].isin(usable['passwords']['username'])
+        has_records = pd.Series(False, index=users.index)
+        for name in ('grades', 'eca'):
+            if name in usable:
+                has_records |= users['username'].isin(usable[name]['username'])
+        issues, dropped = _row_checks('users', users, [
+            (_blank(users['username']), 'empty_username', "Username is empty", 'drop_row'),
+            (users['username'].duplicated(), 'duplicate_user', "Username appears more than once", 'drop_row'),
+            (~users['role'].isin(ROLES), 'invalid_role', "Role must be 'admin' or 'student'", None),
+            (~has_password & ~has_records, 'missing_password',
+             "No passwords.csv row (incomplete add_user); the account has no data", 'drop_row'),
+            (~has_password, 'missing_password',
+             "No passwords.csv row; the account cannot log in", None),
+        ])
+        found += issues
+        invalid_level = ~dropped & ~_blank(users['level']) & ~level.between(0, 4)
+        if invalid_level.any():
+            found.append(_issues('users', users, invalid_level, 'invalid_level',
+                                 "Level must be a number between 0 and 4", 'clear_value', 'level'))
+
+    # Roles of the users that remain after the repairs above
+    if users is not None:
+        valid_users = users[~_blank(users['username']) & ~users['username'].duplicated()]
+        roles = valid_users.set_index('username')['role']
+    else:
+        roles = pd.Series(dtype=object)
+
+    passwords = usable.get('passwords')
+    if passwords is not None:
+        passwords = passwords.reindex(columns=PASSWORD_COLUMNS)
+        user_role = passwords['username'].map(roles)
+        issues, _ = _row_checks('passwords', passwords, [
+            (_blank(passwords['username']), 'empty_username', "Username is empty", 'drop_row'),
+            (passwords['username'].duplicated(), 'duplicate_user', "Username appears more than once", 'drop_row'),
+            (user_role.isna(), 'orphan', "No matching user in users.csv", 'drop_row'),
+            (user_role.isin(ROLES) & (passwords['role'] != user_role), 'role_mismatch',
+             "Role differs from users.csv", 'fix_role'),
+        ])
+        found += issues
+
+    grades = usable.get('grades')
+    if grades is not None:
+        role = grades['username'].map(roles)
+        issues, dropped = _row_checks('grades', grades, [
+            (_blank(grades['username']), 'empty_username', "Username is empty", 'drop_row'),
+            (role.isna(), 'orphan', "No matching user in users.csv", 'drop_row'),
+            (role != 'student', 'not_a_student', "Grades recorded for a user who is not a student", 'drop_row'),
+            (grades['username'].duplicated(), 'duplicate_user', "Student has more than one grades row", 'drop_row'),
+        ])
+        found += issues
+        found.append(_grade_value_issues(grades[~dropped]))
+
+    eca = usable.get('eca')
+    if eca is not None:
+        eca = eca.reindex(columns=ECA_COLUMNS)
+        role = eca['username'].map(roles)
+        hours = pd.to_numeric(eca['hours_per_week'], errors='coerce')
+        issues, _ = _row_checks('eca', eca, [
+            (_blank(eca['username']) | _blank(eca['activity']), 'empty_key', "Username or activity is empty",
+             'drop_row'),
+            (role.isna(), 'orphan', "No matching user in users.csv", 'drop_row'),
+            (role != 'student', 'not_a_student', "Activity recorded for a user who is not a student", 'drop_row'),
+            (eca.duplicated(['username', 'activity']), 'duplicate_activity',
+             "Activity listed more than once for the student", 'drop_row'),
+            (~(hours >= 0), 'invalid_hours', "Hours per week must be a number of at least 0", 'drop_row'),
+        ])
+        found += issues
+
+    found = [issues for issues in found if not issues.empty]
+    if not found:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    return pd.concat(found, ignore_index=True)
+
+
+def _grade_value_issues(grades):
+    """Grade cells that are not numbers between 0 and 100, one issue per cell"""
+    subjects = [column for column in grades.columns if column != 'username']
+    raw = grades[subjects]
+    values = raw.apply(pd.to_numeric, errors='coerce')
+    invalid = (raw.notna() & values.isna()) | (values < 0) | (values > 100)
+    rows, columns = np.nonzero(invalid.to_numpy())
+    return pd.DataFrame({
+        'table': 'grades',
+        'line': grades.index.to_numpy()[rows] + 2,
+        'username': grades['username'].to_numpy(dtype=object)[rows],
+        'field': np.array(subjects, dtype=object)[columns],
+        'check': 'invalid_grade',
+        'message': "Grade must be a number between 0 and 100",
+        'repair': 'clear_value'
+    }, columns=ISSUE_COLUMNS)
+
+
+@instrument
+def check(data_dir="data"):
+    """
+    Read all tables once and check them.
+    Returns:
+        DataFrame of issues (see check_tables), or None on error
+    """
+    try:
+        return check_tables(load_tables(data_dir))
+    except Exception as e:
+        print(f"Error checking data integrity: {e}")
+        return None
+
+
+def _apply_repairs(tables, issues):
+    """
+    Apply the repairs of the issues to copies of the tables.
+    Returns:
+        Tuple of (repaired tables, set of changed table names)
+    """
+    repaired = dict(tables)
+    changed = set()
+    for name, table_issues in issues[issues['repair'].notna()].groupby('table'):
+        df = tables[name].copy()
+        rows = table_issues['line'] - 2
+        for column in table_issues.loc[table_issues['repair'] == 'add_column', 'field']:
+            df[column] = np.nan
+        for field, cells in table_issues[table_issues['repair'] == 'clear_value'].groupby('field'):
+            df.loc[cells['line'] - 2, field] = np.nan
+        if name in EXPECTED_COLUMNS and (table_issues['repair'] == 'add_column').any():
+            extra = [column for column in df.columns if column not in EXPECTED_COLUMNS[name]]
+            df = df[EXPECTED_COLUMNS[name] + extra]
+        fix_role = rows[table_issues['repair'] == 'fix_role']
+        if len(fix_role):
+            users = tables['users']
+            roles = users[~users['username'].duplicated()].set_index('username')['role']
+            df.loc[fix_role, 'role'] = df.loc[fix_role, 'username'].map(roles)
+        df = df.drop(index=rows[table_issues['repair'] == 'drop_row'].unique())
+        repaired[name] = df
+        changed.add(name)
+    return repaired, changed
+
+
+def _publish_repairs(tables, repaired, changed):
+    """Publish change events for the users whose data the repairs changed"""
+    remaining_users = set(repaired['users']['username']) if repaired.get('users') is not None else set()
+    removed = set()
+    for name in changed & {'users', 'grades', 'eca'}:
+        before = set(tables[name]['username'].dropna())
+        removed |= {username for username in before if username not in remaining_users}
+    if removed:
+        events.publish_many(events.USER_REMOVED, ((username, {}) for username in sorted(removed)))
+
+    if 'grades' in changed:
+        subjects = [column for column in tables['grades'].columns if column != 'username']
+        before = tables['grades'][~tables['grades']['username'].duplicated()].set_index('username')[subjects]
+        after = repaired['grades'][~repaired['grades']['username'].duplicated()].set_index('username')
+        after = after.reindex(index=before.index, columns=subjects)
+        # Grades that were valid before, and are gone (cleared or their row dropped)
+        before_values = before.apply(pd.to_numeric, errors='coerce')
+        kept = ~before.index.isin(list(removed))
+        gone = before_values.notna().to_numpy() & after.isna().to_numpy() & kept[:, None]
+        rows, columns = np.nonzero(gone)
+        events.publish_many(events.GRADE_CHANGED, (
+            (before.index[row], {'subject': subjects[column], 'grade': None}) for row, column in zip(rows, columns)
+        ))
+
+    if 'eca' in changed:
+        eca = repaired['eca']
+        dropped = tables['eca'].loc[~tables['eca'].index.isin(eca.index), 'username'].dropna()
+        affected = sorted(set(dropped) - removed)
+        if affected:
+            records = eca[eca['username'].isin(affected)].groupby('username')
+            events.publish_many(events.ECA_CHANGED, (
+                (username, {'records': records.get_group(username).to_dict('records')
+                            if username in records.groups else []})
+                for username in affected
+            ))
+
+
+def _repair_changes(tables, repaired, issues):
+    """
+    Audit changes of the repairs: every value of the users removed from a
+    table, and the values cleared in the rows that remain.
+    Returns:
+        List of (table, DataFrame with key, field, old and new columns)
+    """
+    changes = []
+    for name in AUDITED_TABLES:
+        before, after = tables.get(name), repaired.get(name)
+        if before is None or after is None or after is before:
+            continue
+        gone = set(before['username'].dropna()) - set(after['username'].dropna())
+        if gone:
+            rows = before[before['username'].isin(gone)].drop_duplicates('username')
+            values = rows.melt(id_vars='username', var_name='field', value_name='old').dropna(subset=['old'])
+            changes.append((name, values.rename(columns={'username': 'key'}).assign(new=None)))
+        cleared = issues[(issues['table'] == name) & (issues['repair'] == 'clear_value')]
+        cleared = cleared[(cleared['line'] - 2).isin(after.index)]
+        if len(cleared):
+            rows = cleared['line'].to_numpy() - 2
+            changes.append((name, pd.DataFrame({
+                'key': cleared['username'].to_numpy(dtype=object),
+                'field': cleared['field'].to_numpy(dtype=object),
+                'old': [before.at[row, field] for row, field in zip(rows, cleared['field'])],
+                'new': None
+            })))
+    return changes
+
+
+def _fsync_file(path):
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def _file_state(path):
+    """Identity and size of a table file, or None if it does not exist"""
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size]
+
+
+def _replace_tables(data_dir, frames, entries):
+    """
+    Replace several tables so that a crash cannot leave some of them old:
+    they are written to the repair directory with a manifest, then moved.
+    Args:
+        frames: Dictionary of table name to the repaired DataFrame
+        entries: Dictionary of table name to its audit entries (JSON lines)
+    """
+    temporary_dir = os.path.join(data_dir, REPAIR_DIR)
+    manifest_path = os.path.join(temporary_dir, "manifest.json")
+    written = []
+    try:
+        os.makedirs(temporary_dir, exist_ok=True)
+        for name, df in frames.items():
+            temporary_path = os.path.join(temporary_dir, f"{name}.csv")
+            write_table(df, temporary_path)
+            _fsync_file(temporary_path)
+            written.append(temporary_path)
+        # The files each move replaces, so recovery leaves tables that changed since alone
+        manifest = {'tables': {name: _file_state(os.path.join(data_dir, f"{name}.csv")) for name in frames},
+                    'entries': entries}
+        temporary = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, manifest_path)
+    except Exception:
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finish_repair(data_dir)
+
+
+def finish_repair(data_dir="data"):
+    """
+    Move the tables of a repair into place and record its audit entries, if
+    a crash interrupted it. Called by wal.recover() under wal.exclusive().
+    Returns:
+        Set of the names of the tables the repair replaced, or None if there was none to finish
+    """
+    temporary_dir = os.path.join(data_dir, REPAIR_DIR)
+    manifest_path = os.path.join(temporary_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        if os.path.isdir(temporary_dir):
+            # Tables of a repair that failed before its manifest was written
+            for name in os.listdir(temporary_dir):
+                os.remove(os.path.join(temporary_dir, name))
+            os.rmdir(temporary_dir)
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    replaced = set()
+    for name, state in manifest['tables'].items():
+        temporary_path = os.path.join(temporary_dir, f"{name}.csv")
+        path = os.path.join(data_dir, f"{name}.csv")
+        if not os.path.exists(temporary_path):
+            # Moved before the crash
+            replaced.add(name)
+        elif _file_state(path) == state:
+            os.replace(temporary_path, path)
+            replaced.add(name)
+        else:
+            print(f"Not finishing the repair of {name}.csv: it changed since the repair started")
+            os.remove(temporary_path)
+    audit.append_entries("".join(text for name, text in manifest['entries'].items() if name in replaced))
+    os.remove(manifest_path)
+    for name in os.listdir(temporary_dir):
+        os.remove(os.path.join(temporary_dir, name))
+    os.rmdir(temporary_dir)
+    return replaced
+
+
+@instrument
+def repair(data_dir="data"):
+    """
+    Check the tables and apply every repair in one step, while no logged
+    call can change the tables.
+    Returns:
+        Tuple of (success, message, issues DataFrame)
+    """
+    try:
+        with wal.exclusive():
+            # Calls left by crashed processes, and an interrupted repair, are finished first
+            wal.recover()
+            tables = load_tables(data_dir)
+            issues = check_tables(tables)
+            repaired, changed = _apply_repairs(tables, issues)
+            entries = {}
+            with audit.staging(lambda table, text: entries.update({table: entries.get(table, '') + text})):
+                for table, changes in _repair_changes(tables, repaired, issues):
+                    audit.record_frame(table, changes)
+            if changed:
+                _replace_tables(data_dir, {name: repaired[name] for name in changed}, entries)
+            _publish_repairs(tables, repaired, changed)
+
+        fixed = int(issues['repair'].notna().sum())
+        return True, f"Repaired {fixed} of {len(issues)} issues in {', '.join(sorted(changed)) or 'no tables'}", issues
+    except Exception as e:
+        return False, f"Error repairing data: {str(e)}", None
@@ -0,0 +1,170 @@
+"""
+Load test for api_server.py.
+
+Opens a number of keep-alive connections and sends requests on each as fast
+as responses come back, then reports requests/sec and latency percentiles.
+
+To test at scale, generate a dataset with datagen.py and start the server in
+its directory, then spread the requests over the generated students:
+    python datagen.py /tmp/loadtest/data --students 1000000
+    (cd /tmp/loadtest && python /path/to/api_server.py)
+    python load_test.py --students 1000000 --username admin
+
+The /students endpoints need a login: with --username the load test logs in
+first (the password is asked for, or read from --password-stdin) and sends
+the token with every request.
+
+Usage: python load_test.py [--url http://127.0.0.1:8000] [--connections 50]
+                           [--duration 10] [--path /students/student1/grades ...]
+                           [--students N] [--seed 0] [--username NAME [--password-stdin]]
+"""
+import sys
+import json
+import time
+import random
+import getpass
+import asyncio
+import argparse
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/students/student1/grades',
+    '/students/student1/eca',
+    '/students/student1/stats',
+    '/stats/overall'
+]
+
+# Paths requested for random students when --students is given
+STUDENT_PATHS = ['/students/{}/grades', '/students/{}/eca', '/students/{}/stats']
+
+
+def student_paths(students, count=10000, seed=0):
+    """
+    Build request paths for random students of a generated dataset (see datagen.py).
+    Args:
+        students: Number of students in the dataset (student0 .. student<N-1>)
+        count: Number of paths to build
+        seed: Random seed
+    """
+    rng = random.Random(seed)
+    return [
+        rng.choice(STUDENT_PATHS).format(f"student{rng.randrange(students)}")
+        for _ in range(count)
+    ]
+
+
+async def _read_response(reader):
+    """Read one HTTP response and return its status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Server closed the connection")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, _, value = line.decode('latin-1').partition(':')
+        if key.strip().lower() == 'content-length':
+            length = int(value.strip())
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def login(host, port, username, password):
+    """Log in and return the token for the Authorization header"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        body = json.dumps({'username': username, 'password': password}).encode()
+        writer.write((f"POST /login HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    if int(head.split()[1]) != 200:
+        raise ConnectionError(f"Login failed: {payload.decode(errors='replace')}")
+    return json.loads(payload)['token']
+
+
+async def _worker(host, port, paths, deadline, latencies, errors, offset, token=None):
+    """Send requests over one keep-alive connection until the deadline"""
+    reader, writer = await asyncio.open_connection(host, port)
+    authorization = f"Authorization: Bearer {token}\r\n" if token else ""
+    i = offset
+    try:
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{authorization}"
+                       f"Connection: keep-alive\r\n\r\n")
+            start = time.perf_counter()
+            writer.write(request.encode('latin-1'))
+            await writer.drain()
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+async def run_load_test(url, connections, duration, paths, username=None, password=None):
+    """Run the load test and return a dictionary of results"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    token = await login(host, port, username, password) if username else None
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        _worker(host, port, paths, deadline, latencies, errors, i, token)
+        for i in range(connections)
+    ])
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_sec': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else 0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the student data API")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--path', action='append', dest='paths')
+    parser.add_argument('--students', type=int, help="Request random students of a generated dataset of this size")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for --students")
+    parser.add_argument('--username', help="Log in as this user (admins can read every student)")
+    parser.add_argument('--password-stdin', action='store_true', help="Read the password from stdin")
+    args = parser.parse_args()
+    password = None
+    if args.username:
+        password = sys.stdin.readline().rstrip("\n") if args.password_stdin else getpass.getpass()
+
+    paths = args.paths or DEFAULT_PATHS
+    if args.students:
+        paths = (args.paths or []) + student_paths(args.students, seed=args.seed)
+    results = asyncio.run(run_load_test(args.url, args.connections, args.duration, paths,
+                                        args.username, password))
+    print(f"Requests:      {results['requests']} ({results['errors']} errors)")
+    print(f"Requests/sec:  {results['requests_per_sec']:.1f}")
+    print(f"Latency p50:   {results['p50_ms']:.2f} ms")
+    print(f"Latency p99:   {results['p99_ms']:.2f} ms")
+    print(f"Latency max:   {results['max_ms']:.2f} ms")
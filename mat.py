@@ -1,15 +1,70 @@
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
 import numpy as np
+from tables import (read_table, table_dtypes, iter_csv_chunks, merge_counts, count_stats, grade_value,
+                    exact_hours, eca_records, GRADE_DECIMALS)
+from sparse_grades import read_grades
+import grading
+import shards
+from metrics import instrument
+
+
+class _LazyPyplot:
+    """Stands in for matplotlib.pyplot and imports it on first use,
+    so callers that only need statistics never load matplotlib"""
+    
+    def __getattr__(self, name):
+        import matplotlib.pyplot
+        return getattr(matplotlib.pyplot, name)
+
+
+plt = _LazyPyplot()
+
+
+def grade_aggregates(data_dir, chunksize=None):
+    """Scan the grades.csv of a data directory (or shard) in chunks, keeping only mergeable partial aggregates"""
+    aggregates = {'rows': 0, 'subjects': [], 'counts': None}
+    path = os.path.join(data_dir, 'grades.csv')
+    for chunk in iter_csv_chunks(path, chunksize, dtype=table_dtypes(path, compact=True)):
+        aggregates['rows'] += len(chunk)
+        aggregates['subjects'] = [column for column in chunk.columns if column != 'username']
+        values = chunk[aggregates['subjects']].stack().astype(float).round(GRADE_DECIMALS)
+        aggregates['counts'] = merge_counts(aggregates['counts'], values.value_counts())
+    return aggregates
+
+
+def eca_aggregates(data_dir, chunksize=None):
+    """Scan the eca.csv of a data directory (or shard) in chunks, keeping only mergeable partial aggregates"""
+    aggregates = {'rows': 0, 'total_hours': 0.0, 'activity_counts': None}
+    path = os.path.join(data_dir, 'eca.csv')
+    for chunk in iter_csv_chunks(path, chunksize, dtype=table_dtypes(path, compact=True)):
+        aggregates['rows'] += len(chunk)
+        aggregates['total_hours'] += float(exact_hours(chunk['hours_per_week']).sum())
+        aggregates['activity_counts'] = merge_counts(aggregates['activity_counts'], chunk['activity'].value_counts())
+    return aggregates
+
 
 class StudentAnalytics:
     """Class for handling student analytics and visualizations"""
     
-    def __init__(self):
-        """Initialize the analytics class"""
+    def __init__(self, session=None, chunksize=None, charts_dir=None, chart_format='png', cleanup_charts=True,
+                 workers=None):
+        """Initialize the analytics class
+        Args:
+            session: Optional auth.Session whose preloaded data is used for its own user
+            chunksize: Rows read at a time by the whole-table statistics, bounding their memory use
+            charts_dir: Where charts are saved (data/charts by default)
+            chart_format: File format of the per-student charts, e.g. 'png' or 'pdf'
+            cleanup_charts: Delete old charts before drawing a new one
+            workers: Processes computing the statistics of the shards (default: CPU count)
+        """
+        self.session = session
+        self.chunksize = chunksize
         self.data_dir = "data"
-        self.charts_dir = os.path.join(self.data_dir, "charts")
+        self.charts_dir = charts_dir or os.path.join(self.data_dir, "charts")
+        self.chart_format = chart_format
+        self.cleanup_charts = cleanup_charts
+        self.workers = workers
         self._ensure_directories()
     
     def _ensure_directories(self):
@@ -19,12 +74,48 @@ class StudentAnalytics:
         if not os.path.exists(self.charts_dir):
             os.makedirs(self.charts_dir)
     
+    def _grade_aggregates(self):
+        """Aggregates of all grades, computed per shard in parallel and merged when the tables are sharded"""
+        parts = shards.map_shards(grade_aggregates, self.chunksize, data_dir=self.data_dir, workers=self.workers)
+        if not parts:
+            return grade_aggregates(self.data_dir, self.chunksize)
+        merged = {'rows': 0, 'subjects': [], 'counts': None}
+        for part in parts.values():
+            merged['rows'] += part['rows']
+            merged['subjects'] += [subject for subject in part['subjects'] if subject not in merged['subjects']]
+            if part['counts'] is not None:
+                merged['counts'] = merge_counts(merged['counts'], part['counts'])
+        return merged
+
+    def _grades_matrix(self):
+        """
+        The grades table as a sparse student x subject matrix, for per-student
+        and per-subject lookups (cached while it fits sparse_grades.CACHE_BYTES)
+        """
+        return read_grades(os.path.join(self.data_dir, 'grades.csv'), self.chunksize)
+
+    def _eca_aggregates(self):
+        """ECA aggregates, computed per shard in parallel and merged when the tables are sharded"""
+        parts = shards.map_shards(eca_aggregates, self.chunksize, data_dir=self.data_dir, workers=self.workers)
+        if not parts:
+            return eca_aggregates(self.data_dir, self.chunksize)
+        merged = {'rows': 0, 'total_hours': 0.0, 'activity_counts': None}
+        for part in parts.values():
+            merged['rows'] += part['rows']
+            merged['total_hours'] += part['total_hours']
+            if part['activity_counts'] is not None:
+                merged['activity_counts'] = merge_counts(merged['activity_counts'], part['activity_counts'])
+        return merged
+
     def _cleanup_old_charts(self):
         """Clean up old chart files"""
+        if not self.cleanup_charts:
+            return
         try:
             if os.path.exists(self.charts_dir):
+                extension = f".{self.chart_format}"
                 for file in os.listdir(self.charts_dir):
-                    if file.endswith('.png'):
+                    if file.endswith(extension):
                         file_path = os.path.join(self.charts_dir, file)
                         try:
                             os.remove(file_path)
@@ -33,6 +124,7 @@ class StudentAnalytics:
         except Exception as e:
             print(f"Error cleaning up charts: {e}")
     
+    @instrument
     def create_grades_chart(self, grades, username):
         """Create a bar chart for student grades"""
         try:
@@ -71,7 +163,7 @@ class StudentAnalytics:
             plt.tight_layout()
             
             # Save the chart
-            filename = f"grades_{username}.png"
+            filename = f"grades_{username}.{self.chart_format}"
             filepath = os.path.join(self.charts_dir, filename)
             plt.savefig(filepath)
             plt.close()
@@ -81,6 +173,7 @@ class StudentAnalytics:
             print(f"Error creating grades chart: {e}")
             return None
 
+    @instrument
     def create_eca_chart(self, eca, username):
         """Create a pie chart for student ECA activities"""
         try:
@@ -112,7 +205,7 @@ class StudentAnalytics:
             plt.tight_layout()
             
             # Save the chart
-            filename = f"eca_{username}.png"
+            filename = f"eca_{username}.{self.chart_format}"
             filepath = os.path.join(self.charts_dir, filename)
             plt.savefig(filepath, bbox_inches='tight')
             plt.close()
@@ -122,6 +215,7 @@ class StudentAnalytics:
             print(f"Error creating ECA chart: {e}")
             return None
 
+    @instrument
     def create_performance_summary(self, grades, eca, username):
         """Create a summary of student performance"""
         try:
@@ -169,7 +263,7 @@ class StudentAnalytics:
             plt.tight_layout()
             
             # Save the chart
-            filename = f"summary_{username}.png"
+            filename = f"summary_{username}.{self.chart_format}"
             filepath = os.path.join(self.charts_dir, filename)
             plt.savefig(filepath)
             plt.close()
@@ -179,56 +273,69 @@ class StudentAnalytics:
             print(f"Error creating performance summary: {e}")
             return None
 
+    def _uses_session(self, username):
+        """Check whether the preloaded session covers this user"""
+        return self.session is not None and self.session.username == username
+
+    def _student_grades(self, username):
+        """Get a student's grades as a dictionary of subject -> grade"""
+        if self._uses_session(username):
+            return {grade['subject']: float(grade['grade']) for grade in self.session.grades}
+            
+        return {subject: grade_value(value) for subject, value in self._grades_matrix().row(username).items()}
+
+    def _student_grade_values(self, username):
+        """Get the list of grade values for a student"""
+        return list(self._student_grades(username).values())
+
+    @instrument
     def calculate_gpa(self, username):
-        """Calculate GPA for a student"""
+        """Calculate a student's credit-weighted GPA on the configured grading scale"""
         try:
-            if not os.path.exists(os.path.join(self.data_dir, "grades.csv")):
-                return None
-                
-            grades_df = pd.read_csv(os.path.join(self.data_dir, "grades.csv"))
-            
-            if username not in grades_df['username'].values:
-                return None
-                
-            student_row = grades_df[grades_df['username'] == username].iloc[0]
-            grade_columns = [col for col in grades_df.columns if col != 'username']
-            grades = []
-            
-            for column in grade_columns:
-                grade_value = student_row[column]
-                if pd.notna(grade_value):
-                    grades.append(float(grade_value))
-            
-            if not grades:
-                return None
-                
-            gpa = np.mean(grades) / 25  # Converting percentage to 4.0 scale
-            return round(gpa, 2)
+            return grading.student_gpa(self._student_grades(username))
             
         except Exception as e:
             print(f"Error calculating GPA: {e}")
             return None
 
+    @instrument
+    def get_letter_grades(self, username):
+        """
+        Get a student's grades converted with the configured grading scale.
+        Returns:
+            List of dictionaries with 'subject', 'grade', 'letter' and 'points'
+        """
+        try:
+            grades = self._student_grades(username)
+            scale = grading.get_scale()
+            values = np.array(list(grades.values()), dtype=float)
+            return [
+                {'subject': subject, 'grade': grade, 'letter': letter, 'points': round(float(points), 2)}
+                for (subject, grade), letter, points
+                in zip(grades.items(), scale.to_letters(values), scale.to_points(values))
+            ]
+        except Exception as e:
+            print(f"Error converting grades: {e}")
+            return []
+
+    @instrument
+    def get_all_gpas(self):
+        """
+        Get the GPA of every student on the configured grading scale, computed in one pass.
+        Returns:
+            Series of username -> GPA (NaN without grades), or None on error
+        """
+        try:
+            return grading.batch_gpa(self._grades_matrix())
+        except Exception as e:
+            print(f"Error calculating GPAs: {e}")
+            return None
+
+    @instrument
     def get_grade_statistics(self, username):
         """Get statistical information about a student's grades"""
         try:
-            if not os.path.exists(os.path.join(self.data_dir, "grades.csv")):
-                return None
-                
-            grades_df = pd.read_csv(os.path.join(self.data_dir, "grades.csv"))
-            
-            if username not in grades_df['username'].values:
-                return None
-                
-            student_row = grades_df[grades_df['username'] == username].iloc[0]
-            grade_columns = [col for col in grades_df.columns if col != 'username']
-            grades = []
-            
-            for column in grade_columns:
-                grade_value = student_row[column]
-                if pd.notna(grade_value):
-                    grades.append(float(grade_value))
-            
+            grades = self._student_grade_values(username)
             if not grades:
                 return None
                 
@@ -246,24 +353,28 @@ class StudentAnalytics:
             print(f"Error calculating grade statistics: {e}")
             return None
 
+    @instrument
     def get_eca_summary(self, username):
         """Get summary of student's extracurricular activities"""
         try:
+            if self._uses_session(username):
+                return self.session.eca_summary()
+                
             if not os.path.exists(os.path.join(self.data_dir, "eca.csv")):
                 return None
                 
-            eca_df = pd.read_csv(os.path.join(self.data_dir, "eca.csv"))
+            eca_df = read_table(os.path.join(self.data_dir, "eca.csv"), compact=True)
             student_eca = eca_df[eca_df['username'] == username]
             
             if student_eca.empty:
                 return None
                 
-            total_hours = student_eca['hours_per_week'].sum()
+            total_hours = exact_hours(exact_hours(student_eca['hours_per_week']).sum())
             
             summary = {
                 'total_activities': len(student_eca),
                 'total_hours': total_hours,
-                'activities': student_eca.to_dict('records')
+                'activities': eca_records(student_eca)
             }
             
             return summary
@@ -272,25 +383,60 @@ class StudentAnalytics:
             print(f"Error getting ECA summary: {e}")
             return None
 
+    @instrument
+    def get_class_rank(self, username):
+        """
+        Get a student's rank and percentile overall (by average grade) and per subject.
+        Returns:
+            Dictionary of subject ('Overall' first) to {'rank', 'of', 'percentile'}
+        """
+        try:
+            from ranking import get_ranking
+            return get_ranking().student_ranks(username)
+        except Exception as e:
+            print(f"Error getting class rank: {e}")
+            return {}
+
+    @instrument
+    def get_top_students(self, k=10, subject=None):
+        """Get the k best students overall or in a subject as (username, grade) pairs"""
+        try:
+            from ranking import get_ranking
+            return get_ranking().top(k, subject)
+        except Exception as e:
+            print(f"Error getting top students: {e}")
+            return []
+
+    @instrument
+    def get_group_statistics(self, department=None, level=None):
+        """
+        Get grade and ECA statistics one level below a selection: per department,
+        per level of a department, or per subject of a department and level.
+        Returns:
+            DataFrame of statistics per group (see rollups.RollupCube.drill_down), or None on error
+        """
+        try:
+            from rollups import get_cube
+            return get_cube().drill_down(department, level)
+        except Exception as e:
+            print(f"Error getting group statistics: {e}")
+            return None
+
+    @instrument
     def create_overall_grades_distribution(self):
         """Create a bar chart showing the distribution of grades across all students"""
         try:
             # Clean up old charts
             self._cleanup_old_charts()
                 
-            grades_df = pd.read_csv(os.path.join(self.data_dir, 'grades.csv'))
-            
-            all_grades = []
-            for column in grades_df.columns:
-                if column != 'username':
-                    subject_grades = grades_df[column].dropna().tolist()
-                    all_grades.extend(subject_grades)
-            
-            if not all_grades:
+            grade_counts = self._grade_aggregates()['counts']
+            if grade_counts is None or grade_counts.empty:
                 return None
             
+            # Histogram of the distinct grades weighted by how often they occur
             plt.figure(figsize=(10, 6))
-            plt.hist(all_grades, bins=10, edgecolor='black')
+            plt.hist(grade_counts.index.to_numpy(dtype=float), bins=10,
+                     weights=grade_counts.to_numpy(), edgecolor='black')
             
             plt.xlabel('Grade')
             plt.ylabel('Number of Students')
@@ -307,20 +453,21 @@ class StudentAnalytics:
             print(f"Error creating overall grades distribution chart: {e}")
             return None
 
+    @instrument
     def create_subject_performance_comparison(self):
         """Create a box plot comparing performance across different subjects"""
         try:
             # Clean up old charts
             self._cleanup_old_charts()
                 
-            grades_df = pd.read_csv(os.path.join(self.data_dir, 'grades.csv'))
-            subject_columns = [col for col in grades_df.columns if col != 'username']
+            grades = self._grades_matrix()
+            subject_columns = grades.column_names
             
             if not subject_columns:
                 return None
             
             plt.figure(figsize=(12, 6))
-            data = [grades_df[subject].dropna().tolist() for subject in subject_columns]
+            data = [grades.column(subject) for subject in subject_columns]
             plt.boxplot(data, labels=subject_columns)
             
             plt.xlabel('Subject')
@@ -339,14 +486,17 @@ class StudentAnalytics:
             print(f"Error creating subject performance comparison chart: {e}")
             return None
 
+    @instrument
     def create_eca_distribution(self):
         """Create a pie chart showing the distribution of ECA types"""
         try:
             # Clean up old charts
             self._cleanup_old_charts()
                 
-            eca_df = pd.read_csv(os.path.join(self.data_dir, 'eca.csv'))
-            activity_counts = eca_df['activity'].value_counts()
+            activity_counts = self._eca_aggregates()['activity_counts']
+            if activity_counts is None:
+                return None
+            activity_counts = activity_counts.sort_values(ascending=False)
             
             plt.figure(figsize=(10, 8))
             plt.pie(activity_counts, labels=activity_counts.index, autopct='%1.1f%%')
@@ -362,13 +512,14 @@ class StudentAnalytics:
             print(f"Error creating ECA distribution chart: {e}")
             return None
 
+    @instrument
     def create_hours_distribution(self):
         """Create a histogram showing the distribution of hours per week in ECAs"""
         try:
             # Clean up old charts
             self._cleanup_old_charts()
                 
-            eca_df = pd.read_csv(os.path.join(self.data_dir, 'eca.csv'))
+            eca_df = read_table(os.path.join(self.data_dir, 'eca.csv'), compact=True)
             
             plt.figure(figsize=(10, 6))
             plt.hist(eca_df['hours_per_week'], bins=10, edgecolor='black')
@@ -388,30 +539,87 @@ class StudentAnalytics:
             print(f"Error creating hours distribution chart: {e}")
             return None
 
+    @instrument
+    def get_correlation_matrices(self):
+        """
+        Get the subject x subject, activity x subject and activity x activity matrices.
+        Returns:
+            Dictionary of matrices (see correlations.correlation_matrices), or None on error
+        """
+        try:
+            from correlations import correlation_matrices
+            return correlation_matrices(self.data_dir)
+        except Exception as e:
+            print(f"Error computing correlation matrices: {e}")
+            return None
+
+    def _save_heatmap(self, matrix, title, filename, figsize):
+        """Draw a correlation matrix (DataFrame) as a heatmap and save it in the charts directory"""
+        plt.figure(figsize=figsize)
+        plt.imshow(matrix.to_numpy(dtype=float), cmap='coolwarm', vmin=-1, vmax=1, aspect='auto')
+        plt.colorbar(label='Correlation')
+        plt.xticks(range(len(matrix.columns)), matrix.columns, rotation=45, ha='right')
+        plt.yticks(range(len(matrix.index)), matrix.index)
+        plt.title(title)
+        plt.tight_layout()
+
+        filepath = os.path.join(self.charts_dir, filename)
+        plt.savefig(filepath)
+        plt.close()
+        return filepath
+
+    @instrument
+    def create_subject_correlation_heatmap(self, matrices=None):
+        """Create a heatmap of the correlation between the grades of each pair of subjects"""
+        try:
+            self._cleanup_old_charts()
+            matrices = matrices or self.get_correlation_matrices()
+            if not matrices or matrices['subjects'].empty:
+                return None
+            return self._save_heatmap(matrices['subjects'], 'Subject Grade Correlation',
+                                      "subject_correlation.png", (10, 8))
+        except Exception as e:
+            print(f"Error creating subject correlation heatmap: {e}")
+            return None
+
+    @instrument
+    def create_activity_correlation_heatmap(self, matrices=None, limit=30):
+        """
+        Create a heatmap of the correlation between taking part in an activity and
+        the grade in each subject, for the limit activities with the most students.
+        """
+        try:
+            self._cleanup_old_charts()
+            matrices = matrices or self.get_correlation_matrices()
+            if not matrices or matrices['activities'].empty:
+                return None
+            popular = matrices['participants'].sort_values(ascending=False).index[:limit]
+            return self._save_heatmap(matrices['activities'].loc[popular], 'ECA Participation vs Grades',
+                                      "activity_correlation.png", (12, max(6, len(popular) * 0.3)))
+        except Exception as e:
+            print(f"Error creating activity correlation heatmap: {e}")
+            return None
+
+    @instrument
     def get_overall_statistics(self):
         """Get overall statistics for all students"""
         try:
-            grades_df = pd.read_csv(os.path.join(self.data_dir, 'grades.csv'))
-            eca_df = pd.read_csv(os.path.join(self.data_dir, 'eca.csv'))
-            
-            subject_columns = [col for col in grades_df.columns if col != 'username']
-            all_grades = []
-            
-            for column in subject_columns:
-                subject_grades = grades_df[column].dropna().tolist()
-                all_grades.extend(subject_grades)
+            # Both tables are scanned in chunks and reduced to mergeable aggregates
+            grades = self._grade_aggregates()
+            eca = self._eca_aggregates()
+            grade_stats = count_stats(grades['counts'])
             
             stats = {
-                'total_students': len(grades_df),
-                'total_grades': len(all_grades),
-                'total_ecas': len(eca_df),
-                'average_grade': np.mean(all_grades) if all_grades else 0,
-                'median_grade': np.median(all_grades) if all_grades else 0,
-                'grade_std_dev': np.std(all_grades) if all_grades else 0,
-                'average_hours': eca_df['hours_per_week'].mean() if not eca_df.empty else 0,
-                'total_hours': eca_df['hours_per_week'].sum() if not eca_df.empty else 0,
-                'unique_subjects': len(subject_columns),
-                'unique_activities': len(eca_df['activity'].unique()) if not eca_df.empty else 0
+                'total_students': grades['rows'],
+                'total_grades': grade_stats['count'],
+                'total_ecas': eca['rows'],
+                'average_grade': grade_stats['mean'] if grade_stats['count'] else 0,
+                'median_grade': grade_stats['median'] if grade_stats['count'] else 0,
+                'grade_std_dev': grade_stats['std_dev'] if grade_stats['count'] else 0,
+                'average_hours': eca['total_hours'] / eca['rows'] if eca['rows'] else 0,
+                'total_hours': exact_hours(eca['total_hours']),
+                'unique_subjects': len(grades['subjects']),
+                'unique_activities': len(eca['activity_counts']) if eca['rows'] else 0
             }
             
             return stats
@@ -0,0 +1,247 @@
+"""
+Lightweight instrumentation of the data and analytics functions.
+
+Functions decorated with @instrument record their call count, latency
+histogram, and the CSV bytes and rows they read and write. I/O is recorded by
+tables.read_table, tables.iter_csv_chunks and tables.write_table and counted
+for every instrumented call in progress, so an outer call (e.g. a dashboard
+refresh) includes the reads made by the functions it calls.
+
+Collection is off unless the SPMS_METRICS environment variable is set or
+enable() is called; a disabled wrapper only checks a flag before calling
+through.
+
+    from metrics import instrument
+
+    @instrument
+    def get_student_grades(username): ...
+
+The numbers can be read with snapshot() or exported with to_json() and
+to_prometheus().
+"""
+import os
+import json
+import time
+import bisect
+import threading
+from functools import wraps
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get('SPMS_METRICS', '').lower() in ('1', 'true', 'yes', 'on')
+_stats = {}
+_lock = threading.Lock()
+# Names of the instrumented calls in progress, per thread
+_active = threading.local()
+
+
+def enable():
+    """Start collecting metrics"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop collecting metrics (collected numbers are kept)"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Discard all collected numbers"""
+    with _lock:
+        _stats.clear()
+
+
+def _entry(name):
+    """Get the counters of a function, creating them on first use (caller holds _lock)"""
+    entry = _stats.get(name)
+    if entry is None:
+        entry = _stats[name] = {
+            'calls': 0,
+            'errors': 0,
+            'seconds': 0.0,
+            'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'bytes_read': 0,
+            'bytes_written': 0,
+            'rows_read': 0,
+            'rows_written': 0,
+            'reads': {},
+            'writes': {}
+        }
+    return entry
+
+
+def _stack():
+    stack = getattr(_active, 'stack', None)
+    if stack is None:
+        stack = _active.stack = []
+    return stack
+
+
+def instrument(function=None, name=None):
+    """
+    Decorator recording calls, latency and I/O of a function.
+    Args:
+        function: The function to wrap (when used as @instrument)
+        name: Name to report (default: module.qualname)
+    """
+    def decorate(function):
+        label = name or f"{function.__module__}.{function.__qualname__}"
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            stack = _stack()
+            stack.append(label)
+            failed = False
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                stack.pop()
+                with _lock:
+                    entry = _entry(label)
+                    entry['calls'] += 1
+                    entry['errors'] += failed
+                    entry['seconds'] += elapsed
+                    entry['buckets'][bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+        return wrapper
+
+    if function is not None:
+        return decorate(function)
+    return decorate
+
+
+def record_io(table, bytes_read=0, rows_read=0, bytes_written=0, rows_written=0):
+    """
+    Count I/O on a table against every instrumented call in progress.
+    Args:
+        table: Table name ('users', 'grades', ...)
+        bytes_read, rows_read: Read from the file
+        bytes_written, rows_written: Written to the file
+    """
+    if not _enabled:
+        return
+    stack = _stack()
+    if not stack:
+        return
+    with _lock:
+        # A recursive call is counted once
+        for label in set(stack):
+            entry = _entry(label)
+            entry['bytes_read'] += bytes_read
+            entry['rows_read'] += rows_read
+            entry['bytes_written'] += bytes_written
+            entry['rows_written'] += rows_written
+            if bytes_read:
+                entry['reads'][table] = entry['reads'].get(table, 0) + 1
+            if bytes_written:
+                entry['writes'][table] = entry['writes'].get(table, 0) + 1
+
+
+def file_size(path):
+    """Size of a file in bytes, or 0 if it does not exist"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _quantile(buckets, calls, q):
+    """Estimate a latency quantile as the upper bound of the bucket holding it"""
+    rank = q * calls
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), buckets):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float('inf')
+
+
+def snapshot():
+    """
+    Get a copy of the collected numbers.
+    Returns:
+        Dictionary of function name to its counters, with the mean latency and
+        estimated p50/p99 latency (bucket upper bounds) added
+    """
+    with _lock:
+        stats = {
+            label: dict(entry, buckets=list(entry['buckets']), reads=dict(entry['reads']),
+                        writes=dict(entry['writes']))
+            for label, entry in _stats.items()
+        }
+    for entry in stats.values():
+        calls = entry['calls']
+        entry['mean_seconds'] = entry['seconds'] / calls if calls else 0.0
+        entry['p50_seconds'] = _quantile(entry['buckets'], calls, 0.5) if calls else 0.0
+        entry['p99_seconds'] = _quantile(entry['buckets'], calls, 0.99) if calls else 0.0
+    return stats
+
+
+def to_json(indent=2):
+    """Collected numbers as a JSON document"""
+    stats = snapshot()
+    for entry in stats.values():
+        # Infinity is not valid JSON
+        for key in ('p50_seconds', 'p99_seconds'):
+            if entry[key] == float('inf'):
+                entry[key] = None
+        entry['buckets'] = dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], entry['buckets']))
+    return json.dumps({'enabled': _enabled, 'functions': stats}, indent=indent)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def to_prometheus(prefix='spms'):
+    """Collected numbers in the Prometheus text exposition format"""
+    stats = snapshot()
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    metric('function_calls_total', 'counter', "Calls of an instrumented function")
+    for label, entry in stats.items():
+        lines.append(f'{prefix}_function_calls_total{{function="{_label(label)}"}} {entry["calls"]}')
+
+    metric('function_errors_total', 'counter', "Calls that raised an exception")
+    for label, entry in stats.items():
+        lines.append(f'{prefix}_function_errors_total{{function="{_label(label)}"}} {entry["errors"]}')
+
+    metric('function_duration_seconds', 'histogram', "Latency of an instrumented function")
+    for label, entry in stats.items():
+        cumulative = 0
+        for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], entry['buckets']):
+            cumulative += count
+            lines.append(f'{prefix}_function_duration_seconds_bucket{{function="{_label(label)}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_function_duration_seconds_sum{{function="{_label(label)}"}} {entry["seconds"]}')
+        lines.append(f'{prefix}_function_duration_seconds_count{{function="{_label(label)}"}} {entry["calls"]}')
+
+    for key, help_text in (('bytes_read', "CSV bytes read"), ('bytes_written', "CSV bytes written"),
+                           ('rows_read', "CSV rows read"), ('rows_written', "CSV rows written")):
+        metric(f'csv_{key}_total', 'counter', f"{help_text} by an instrumented function")
+        for label, entry in stats.items():
+            lines.append(f'{prefix}_csv_{key}_total{{function="{_label(label)}"}} {entry[key]}')
+
+    for key, help_text in (('reads', "Reads"), ('writes', "Writes")):
+        metric(f'csv_table_{key}_total', 'counter', f"{help_text} of a table by an instrumented function")
+        for label, entry in stats.items():
+            for table, count in sorted(entry[key].items()):
+                lines.append(f'{prefix}_csv_table_{key}_total{{function="{_label(label)}",table="{_label(table)}"}} {count}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,142 @@
+"""
+Opt-in profiling of dashboard actions.
+
+Methods decorated with @profiled run under cProfile when profiling is on.
+Each action writes a pstats file and a text summary of the functions with the
+highest cumulative time to PROFILE_DIR; only the last MAX_PROFILES actions
+are kept. The admin dashboard lists them in its Profiles tab.
+
+Profiling is on when the SPMS_PROFILE environment variable is set, or when
+the app is started with `python user_view.py --profile`. SPMS_PROFILE_KEEP
+changes how many profiles are kept.
+"""
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+from datetime import datetime
+from functools import wraps
+
+PROFILE_DIR = "data/profiles"
+MAX_PROFILES = int(os.environ.get('SPMS_PROFILE_KEEP', 20))
+# Functions listed in each summary
+SUMMARY_LIMIT = 25
+
+_enabled = os.environ.get('SPMS_PROFILE', '').lower() in ('1', 'true', 'yes', 'on')
+# Set while an action is being profiled in this thread; nested actions are
+# part of the outer profile since only one profiler can be active
+_active = threading.local()
+
+
+def enable():
+    """Start profiling actions"""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Stop profiling actions (saved profiles are kept)"""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def profiled(function=None, name=None):
+    """
+    Decorator profiling each call of a function while profiling is on.
+    Args:
+        function: The function to wrap (when used as @profiled)
+        name: Action name used in the profile file name (default: function name)
+    """
+    def decorate(function):
+        action = name or function.__name__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled or getattr(_active, 'profiling', False):
+                return function(*args, **kwargs)
+            profiler = cProfile.Profile()
+            _active.profiling = True
+            start = time.perf_counter()
+            try:
+                return profiler.runcall(function, *args, **kwargs)
+            finally:
+                _active.profiling = False
+                _save(profiler, action, time.perf_counter() - start)
+        return wrapper
+
+    if function is not None:
+        return decorate(function)
+    return decorate
+
+
+def summarize(stats, limit=SUMMARY_LIMIT):
+    """Text table of the functions with the highest cumulative time"""
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+def _save(profiler, action, seconds):
+    """Write a profile and its summary, then drop the oldest profiles"""
+    try:
+        if not os.path.exists(PROFILE_DIR):
+            os.makedirs(PROFILE_DIR)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S_%f')
+        path = os.path.join(PROFILE_DIR, f"{stamp}_{action}.prof")
+        profiler.dump_stats(path)
+        with open(path[:-len('.prof')] + '.txt', 'w') as f:
+            f.write(f"Action: {action}\nWall time: {seconds:.3f}s\n\n")
+            f.write(summarize(pstats.Stats(profiler)))
+
+        for old in list_profiles()[MAX_PROFILES:]:
+            for old_path in (old['path'], old['summary_path']):
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+    except Exception as e:
+        print(f"Error saving profile for {action}: {e}")
+
+
+def list_profiles(limit=None):
+    """
+    List the saved profiles, newest first.
+    Returns:
+        List of dictionaries with 'action', 'time', 'path' and 'summary_path'
+    """
+    if not os.path.exists(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith('.prof'):
+            continue
+        # File names are <date>T<time>_<microseconds>_<action>.prof
+        stamp, _, action = filename[:-len('.prof')].partition('_')
+        micros, _, action = action.partition('_')
+        try:
+            when = datetime.strptime(f"{stamp}_{micros}", '%Y%m%dT%H%M%S_%f')
+        except ValueError:
+            continue
+        path = os.path.join(PROFILE_DIR, filename)
+        profiles.append({
+            'action': action,
+            'time': when,
+            'path': path,
+            'summary_path': path[:-len('.prof')] + '.txt'
+        })
+    return profiles[:limit] if limit else profiles
+
+
+def read_summary(profile):
+    """Get the text summary of a saved profile"""
+    try:
+        with open(profile['summary_path']) as f:
+            return f.read()
+    except OSError:
+        # Summaries can be rebuilt from the profile itself
+        return summarize(pstats.Stats(profile['path']))
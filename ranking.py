@@ -0,0 +1,267 @@
+"""
+Class rank and percentile per subject and overall.
+
+Each subject, and the overall average grade, has a RankIndex: a Fenwick tree
+counting grades over the 0-100 domain in steps of 0.01, so rank and
+percentile queries take O(log n) instead of sorting the grades table. The
+indexes are built once from grades.csv and then kept up to date from the
+GRADE_CHANGED and USER_REMOVED events published by every write. The version
+of grades.csv the indexes match is noted after the build and after each
+event; get_ranking() rebuilds them when the file has changed otherwise (a
+snapshot restore, an integrity repair, or a write by another process whose
+events are not watched).
+
+    from ranking import get_ranking
+    get_ranking().student_ranks('student1')
+"""
+import os
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+import events
+from tables import read_table
+from metrics import instrument
+
+# Grades are counted in bins of this width
+RESOLUTION = 0.01
+MAX_GRADE = 100
+OVERALL = 'Overall'
+
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+class RankIndex:
+    """
+    Ranks of values in 0..MAX_GRADE. Counts per bin are kept in a Fenwick tree
+    and the usernames per bin in a dictionary, with the occupied bins sorted
+    for top-k queries.
+    """
+
+    def __init__(self):
+        self.size = int(round(MAX_GRADE / RESOLUTION)) + 1
+        self.tree = np.zeros(self.size + 1, dtype=np.int64)
+        self.values = {}     # username -> value
+        self.members = {}    # bin -> set of usernames
+        self.bins = []       # occupied bins in ascending order
+
+    def __len__(self):
+        return len(self.values)
+
+    def _bin(self, value):
+        return min(max(int(round(float(value) / RESOLUTION)), 0), self.size - 1)
+
+    def _add_count(self, position, delta):
+        position += 1
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def _count_upto(self, position):
+        """Number of values in bins 0..position"""
+        total = 0
+        position += 1
+        while position > 0:
+            total += self.tree[position]
+            position -= position & -position
+        return int(total)
+
+    def build(self, usernames, values):
+        """
+        Replace the contents with a batch of values in O(n + size).
+        Args:
+            usernames: Array of usernames
+            values: Array of values (NaN values are skipped)
+        """
+        values = np.asarray(values, dtype=float)
+        usernames = np.asarray(usernames, dtype=object)
+        present = ~np.isnan(values)
+        usernames, values = usernames[present], values[present]
+        bins = np.clip(np.rint(values / RESOLUTION).astype(np.int64), 0, self.size - 1)
+
+        # Fenwick tree from the bin counts: each node adds itself to its parent
+        tree = np.zeros(self.size + 1, dtype=np.int64)
+        tree[1:] = np.bincount(bins, minlength=self.size)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+        self.values = dict(zip(usernames.tolist(), values.tolist()))
+        groups = pd.Series(usernames).groupby(bins).indices
+        self.members = {int(b): set(usernames[positions].tolist()) for b, positions in groups.items()}
+        self.bins = sorted(self.members)
+
+    def set(self, username, value):
+        """Add or change the value of a user (None or NaN removes it)"""
+        self.remove(username)
+        if value is None or pd.isna(value):
+            return
+        position = self._bin(value)
+        self.values[username] = float(value)
+        self._add_count(position, 1)
+        if position not in self.members:
+            self.members[position] = set()
+            bisect.insort(self.bins, position)
+        self.members[position].add(username)
+
+    def remove(self, username):
+        """Remove a user's value if present"""
+        value = self.values.pop(username, None)
+        if value is None:
+            return
+        position = self._bin(value)
+        self._add_count(position, -1)
+        self.members[position].discard(username)
+        if not self.members[position]:
+            del self.members[position]
+            del self.bins[bisect.bisect_left(self.bins, position)]
+
+    def rank(self, username):
+        """1-based rank (1 is the highest value; ties share a rank), or None"""
+        if username not in self.values:
+            return None
+        return len(self.values) - self._count_upto(self._bin(self.values[username])) + 1
+
+    def percentile(self, username):
+        """Percentage of values at or below the user's value, or None"""
+        if username not in self.values:
+            return None
+        return 100.0 * self._count_upto(self._bin(self.values[username])) / len(self.values)
+
+    def top(self, k):
+        """The k highest values as a list of (username, value), highest first"""
+        leaders = []
+        for position in reversed(self.bins):
+            for username in sorted(self.members[position]):
+                leaders.append((username, self.values[username]))
+                if len(leaders) == k:
+                    return leaders
+        return leaders
+
+
+class GradeRanking:
+    """Rank indexes for every subject and for the overall average grade"""
+
+    def __init__(self):
+        self.subjects = {}
+        self.overall = RankIndex()
+        self.path = None
+        self.version = None   # version of the grades table the indexes match
+        self._unsubscribers = []
+
+    @instrument
+    def build(self, path="data/grades.csv"):
+        """Build all indexes from the grades table"""
+        self.subjects = {}
+        self.overall = RankIndex()
+        self.path = path
+        # Noted before reading, so a change made while reading causes another build
+        self.version = _file_version(path)
+        if not os.path.exists(path):
+            return
+        grades = read_table(path, compact=True).drop_duplicates('username')
+        usernames = grades['username'].to_numpy(dtype=object)
+        for subject in grades.columns:
+            if subject != 'username':
+                self.subjects[subject] = RankIndex()
+                self.subjects[subject].build(usernames, grades[subject].to_numpy(dtype=float))
+        if self.subjects:
+            self.overall.build(usernames, grades.drop(columns='username').astype(float).mean(axis=1).to_numpy())
+
+    def subscribe(self):
+        """Keep the indexes up to date from change events"""
+        self._unsubscribers = [
+            events.subscribe(events.GRADE_CHANGED, self.apply_event),
+            events.subscribe(events.USER_REMOVED, self.apply_event)
+        ]
+
+    def close(self):
+        for unsubscribe in self._unsubscribers:
+            unsubscribe()
+        self._unsubscribers = []
+
+    def is_current(self):
+        """Whether the grades table is unchanged since the indexes last matched it"""
+        return self.path is not None and self.version == _file_version(self.path)
+
+    def apply_event(self, event):
+        """Apply a grade change or user removal in O(log n) per index"""
+        if event.type == events.USER_REMOVED:
+            for index in self.subjects.values():
+                index.remove(event.username)
+            self.overall.remove(event.username)
+        else:
+            subject = event.data.get('subject')
+            if subject is None:
+                return
+            if subject not in self.subjects:
+                self.subjects[subject] = RankIndex()
+            self.subjects[subject].set(event.username, event.data.get('grade'))
+            self._update_overall(event.username)
+        # Events are published once the table is written
+        if self.path is not None:
+            self.version = _file_version(self.path)
+
+    def _update_overall(self, username):
+        grades = [index.values[username] for index in self.subjects.values() if username in index.values]
+        self.overall.set(username, sum(grades) / len(grades) if grades else None)
+
+    def _index(self, subject):
+        return self.overall if subject in (None, OVERALL) else self.subjects.get(subject)
+
+    def rank(self, username, subject=None):
+        """
+        Rank of a student in a subject, or overall by average grade.
+        Returns:
+            Dictionary with 'rank', 'of' and 'percentile', or None if not graded
+        """
+        index = self._index(subject)
+        if index is None or username not in index.values:
+            return None
+        return {'rank': index.rank(username), 'of': len(index), 'percentile': round(index.percentile(username), 1)}
+
+    def student_ranks(self, username):
+        """Ranks of a student overall and in each graded subject, keyed by subject"""
+        ranks = {}
+        for subject in [OVERALL] + sorted(self.subjects):
+            rank = self.rank(username, subject)
+            if rank is not None:
+                ranks[subject] = rank
+        return ranks
+
+    def top(self, k=10, subject=None):
+        """Leaderboard of the k best students in a subject, or overall"""
+        index = self._index(subject)
+        return index.top(k) if index is not None else []
+
+
+def format_ranks(ranks):
+    """Format the result of student_ranks as text lines for display"""
+    return "\n".join(
+        f"{subject}: {rank['rank']} of {rank['of']} ({rank['percentile']:.1f} percentile)"
+        for subject, rank in ranks.items()
+    )
+
+
+_ranking = None
+_ranking_lock = threading.Lock()
+
+
+def get_ranking():
+    """Get the shared GradeRanking, building it on first use and again when grades.csv changed otherwise"""
+    global _ranking
+    with _ranking_lock:
+        if _ranking is None:
+            _ranking = GradeRanking()
+            _ranking.build()
+            _ranking.subscribe()
+        elif not _ranking.is_current():
+            _ranking.build(_ranking.path)
+        return _ranking
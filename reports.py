@@ -0,0 +1,190 @@
+"""
+Batch generation of per-student performance reports.
+
+For every selected student a summary chart and a JSON file of statistics are
+written to the output directory, plus an index.csv covering the whole cohort.
+The tables are loaded once in the parent process and shared read-only with a
+pool of worker processes (inherited through fork where available and the
+calling process runs no other threads, whose locks a forked child could find
+held; otherwise sent to each worker once); students are handed out in chunks
+so each work unit amortises the process round trip. Departments are matched
+as tables.group_key groups them.
+
+Usage: python reports.py [--department "Computer Science"] [--output reports]
+                         [--workers 4] [--chunk-size 100] [--format png|pdf]
+"""
+import os
+import json
+import argparse
+import threading
+import multiprocessing
+import matplotlib
+matplotlib.use('Agg')  # Reports are rendered off-screen
+import pandas as pd
+from auth import Session, user_details_from_row
+from student import grades_from_row
+from tables import read_table, group_key
+
+# Tables shared with the worker processes, set before the pool starts
+_shared = None
+
+
+def load_cohort(department=None):
+    """
+    Load the tables once and index the rows of each student.
+    Returns:
+        Dictionary with the users/grades/eca tables, their per-username row
+        positions and the list of selected student usernames
+    """
+    users = read_table("data/users.csv", compact=True)
+    grades = read_table("data/grades.csv", compact=True) if os.path.exists("data/grades.csv") else pd.DataFrame(columns=['username'])
+    eca = read_table("data/eca.csv", compact=True) if os.path.exists("data/eca.csv") else pd.DataFrame(columns=['username'])
+
+    students = users[users['role'] == 'student']
+    if department is not None:
+        students = students[students['department'].astype(object).map(group_key) == group_key(department)]
+
+    return {
+        'users': users,
+        'grades': grades,
+        'eca': eca,
+        'user_rows': users.groupby('username', sort=False).indices,
+        'grade_rows': grades.groupby('username', sort=False).indices if not grades.empty else {},
+        'eca_rows': eca.groupby('username', sort=False).indices if not eca.empty else {},
+        'usernames': students['username'].tolist()
+    }
+
+
+def _init_worker(shared):
+    """Pool initializer: keep the shared tables (None when inherited through fork)"""
+    global _shared
+    if shared is not None:
+        _shared = shared
+
+
+def _student_session(username):
+    """Build a Session for a student from the shared tables"""
+    user_row = _shared['users'].iloc[_shared['user_rows'][username][0]]
+    session = Session(username, 'student', user_details_from_row(user_row))
+
+    grade_rows = _shared['grade_rows'].get(username)
+    if grade_rows is not None:
+        grades = _shared['grades']
+        session.grades = grades_from_row(grades.iloc[grade_rows[0]], grades.columns)
+    eca_rows = _shared['eca_rows'].get(username)
+    if eca_rows is not None:
+        session.eca = _shared['eca'].iloc[eca_rows].to_dict('records')
+    return session
+
+
+def _report_chunk(args):
+    """Worker: generate the reports for one chunk of students"""
+    usernames, output_dir, chart_format = args
+    from mat import StudentAnalytics
+
+    results = []
+    for username in usernames:
+        try:
+            session = _student_session(username)
+            # Other workers write to the same directory, so old charts must not be cleaned up
+            analytics = StudentAnalytics(session, charts_dir=output_dir,
+                                         chart_format=chart_format, cleanup_charts=False)
+            gpa = analytics.calculate_gpa(username)
+            grade_stats = analytics.get_grade_statistics(username)
+            eca_summary = analytics.get_eca_summary(username)
+
+            if session.grades and session.eca:
+                chart_path = analytics.create_performance_summary(session.grades, session.eca, username)
+            elif session.grades:
+                chart_path = analytics.create_grades_chart(session.grades, username)
+            elif session.eca:
+                chart_path = analytics.create_eca_chart(session.eca, username)
+            else:
+                chart_path = None
+
+            statistics = {
+                'username': username,
+                'full_name': session.user_details['full_name'],
+                'department': session.user_details['department'],
+                'gpa': gpa,
+                'grade_statistics': grade_stats,
+                'total_activities': eca_summary['total_activities'] if eca_summary else 0,
+                'total_hours': eca_summary['total_hours'] if eca_summary else 0.0
+            }
+            with open(os.path.join(output_dir, f"stats_{username}.json"), 'w') as f:
+                json.dump(statistics, f, indent=2, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+            results.append({
+                'username': username,
+                'gpa': gpa,
+                'mean_grade': grade_stats['mean'] if grade_stats else None,
+                'total_hours': statistics['total_hours'],
+                'chart': chart_path,
+                'error': ''
+            })
+        except Exception as e:
+            results.append({'username': username, 'gpa': None, 'mean_grade': None,
+                            'total_hours': None, 'chart': None, 'error': str(e)})
+    return results
+
+
+def generate_reports(output_dir="reports", department=None, workers=None, chunk_size=100, chart_format='png'):
+    """
+    Generate reports for all students, or those in one department.
+    Returns:
+        Tuple of (success, message)
+    """
+    global _shared
+    try:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        cohort = load_cohort(department)
+        usernames = cohort['usernames']
+        if not usernames:
+            return False, "No students found"
+
+        chunks = [
+            (usernames[i:i + chunk_size], output_dir, chart_format)
+            for i in range(0, len(usernames), chunk_size)
+        ]
+
+        # With fork the workers inherit the loaded tables without copying or
+        # pickling them, but forking while other threads run can deadlock the workers
+        methods = multiprocessing.get_all_start_methods()
+        if 'fork' in methods and threading.active_count() == 1:
+            context = multiprocessing.get_context('fork')
+            _shared = cohort
+            initargs = (None,)
+        else:
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            initargs = (cohort,)
+
+        results = []
+        with context.Pool(workers or os.cpu_count(), initializer=_init_worker, initargs=initargs) as pool:
+            for chunk_results in pool.imap_unordered(_report_chunk, chunks):
+                results.extend(chunk_results)
+
+        index = pd.DataFrame(results).sort_values('username')
+        index.to_csv(os.path.join(output_dir, "index.csv"), index=False)
+        failed = int((index['error'] != '').sum())
+        return True, f"Generated {len(index) - failed} reports in {output_dir} ({failed} failed)"
+    except Exception as e:
+        return False, f"Error generating reports: {str(e)}"
+    finally:
+        _shared = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate per-student performance reports")
+    parser.add_argument('--department', help="Only students in this department")
+    parser.add_argument('--output', default="reports", help="Output directory")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument('--chunk-size', type=int, default=100, help="Students per work unit")
+    parser.add_argument('--format', default='png', choices=['png', 'pdf'], help="Chart file format")
+    args = parser.parse_args()
+
+    success, message = generate_reports(args.output, args.department, args.workers,
+                                        args.chunk_size, args.format)
+    print(message)
+    raise SystemExit(0 if success else 1)
@@ -0,0 +1,199 @@
+"""
+Rule-based scoring of at-risk students.
+
+The users, grades and ECA tables are joined into one row of features per
+student, then every rule is evaluated over all students at once with
+DataFrame.eval. A student's score is the sum of the weights of the rules they
+match; the result is ranked by score with the reasons listed.
+
+Rules are dictionaries with a name, a pandas expression over the features, a
+weight and a reason. DEFAULT_RULES are used unless data/risk_rules.json holds
+a list of rules.
+
+Features:
+    gpa (on the configured grading scale, see grading.py), mean_grade,
+    min_grade, grades_count, failing_subjects,
+    mean_change (change of mean_grade since the saved baseline),
+    eca_hours, max_eca_hours, activities, level
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+from tables import read_table, exact_hours, GRADE_DECIMALS
+from sparse_grades import read_grades
+from grading import batch_gpa
+from metrics import instrument
+
+RULES_FILE = "data/risk_rules.json"
+# Mean grade of every student when the baseline was saved, used to detect falling grades
+BASELINE_FILE = "data/risk_baseline.csv"
+
+# Grades below this are failing
+PASS_MARK = 40
+
+DEFAULT_RULES = [
+    {'name': 'low_gpa', 'expression': 'gpa < 2.0', 'weight': 40,
+     'reason': "GPA below 2.0"},
+    {'name': 'failing_subjects', 'expression': 'failing_subjects >= 1', 'weight': 25,
+     'reason': f"Failing at least one subject (below {PASS_MARK})"},
+    {'name': 'falling_grades', 'expression': 'mean_change <= -10', 'weight': 25,
+     'reason': "Average grade fell by 10 or more points since the baseline"},
+    {'name': 'excessive_eca', 'expression': 'eca_hours > 20', 'weight': 20,
+     'reason': "More than 20 hours per week of extracurricular activities"},
+    {'name': 'eca_over_grades', 'expression': 'eca_hours > 10 and mean_grade < 60', 'weight': 15,
+     'reason': "Heavy extracurricular load with an average below 60"},
+    {'name': 'no_grades', 'expression': 'grades_count == 0', 'weight': 10,
+     'reason': "No grades recorded"}
+]
+
+
+def load_rules(path=RULES_FILE):
+    """Load the rules from a JSON file, or DEFAULT_RULES if there is none"""
+    if not os.path.exists(path):
+        return DEFAULT_RULES
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading risk rules, using the defaults: {e}")
+        return DEFAULT_RULES
+
+
+def save_rules(rules, path=RULES_FILE):
+    """Save a list of rules as the configured rules"""
+    with open(path, 'w') as f:
+        json.dump(rules, f, indent=2)
+
+
+def _unique(df):
+    """Keep the first row per username (the tables should already be unique)"""
+    duplicated = df['username'].duplicated()
+    return df[~duplicated] if duplicated.any() else df
+
+
+def _grade_features(grades):
+    """Per-student grade features from the sparse grades matrix, indexed by username"""
+    grades = grades.first_rows()
+    students = grades.shape[0]
+    rows = grades.entry_rows()
+    values = grades.data.astype(float).round(GRADE_DECIMALS)
+    count = np.bincount(rows, minlength=students)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(rows, weights=values, minlength=students) / count
+    minimum = np.full(students, np.inf)
+    np.minimum.at(minimum, rows, values)
+    return pd.DataFrame({
+        'mean_grade': mean,
+        'min_grade': np.where(count > 0, minimum, np.nan),
+        'grades_count': count,
+        'failing_subjects': np.bincount(rows[values < PASS_MARK], minlength=students)
+    }, index=grades.row_names)
+
+
+def build_features(data_dir="data"):
+    """
+    Join users, grades and ECA into one row of features per student.
+    Returns:
+        DataFrame indexed by username with full_name, department and the features
+    """
+    users = read_table(os.path.join(data_dir, "users.csv"), compact=True,
+                       usecols=['username', 'full_name', 'role', 'department', 'level'])
+    students = _unique(users[users['role'] == 'student']).set_index('username')
+    features = students[['full_name', 'department']].copy()
+    features['level'] = students['level'].astype(float)
+
+    grades_path = os.path.join(data_dir, "grades.csv")
+    if os.path.exists(grades_path):
+        grades = read_grades(grades_path)
+        features = features.join(_grade_features(grades))
+        features['gpa'] = batch_gpa(grades).reindex(features.index)
+    else:
+        features = features.assign(mean_grade=np.nan, min_grade=np.nan, grades_count=0, failing_subjects=0,
+                                   gpa=np.nan)
+    features['grades_count'] = features['grades_count'].fillna(0).astype(int)
+    features['failing_subjects'] = features['failing_subjects'].fillna(0).astype(int)
+
+    baseline_path = os.path.join(data_dir, os.path.basename(BASELINE_FILE))
+    if os.path.exists(baseline_path):
+        baseline = _unique(pd.read_csv(baseline_path, dtype={'username': str}))
+        previous = baseline.set_index('username')['mean_grade'].reindex(features.index)
+        features['mean_change'] = (features['mean_grade'] - previous).fillna(0.0)
+    else:
+        features['mean_change'] = 0.0
+
+    eca_path = os.path.join(data_dir, "eca.csv")
+    if os.path.exists(eca_path):
+        eca = read_table(eca_path, compact=True, usecols=['username', 'hours_per_week'])
+        eca['hours_per_week'] = exact_hours(eca['hours_per_week'])
+        hours = eca.groupby('username', sort=False)['hours_per_week'].agg(['sum', 'max', 'size'])
+        hours = hours.reindex(features.index)
+        features['eca_hours'] = exact_hours(hours['sum'].fillna(0))
+        features['max_eca_hours'] = hours['max'].fillna(0)
+        features['activities'] = hours['size'].fillna(0).astype(int)
+    else:
+        features = features.assign(eca_hours=0.0, max_eca_hours=0.0, activities=0)
+    return features
+
+
+def score_features(features, rules=None, min_score=1):
+    """
+    Evaluate the rules over a features table (see build_features).
+    Args:
+        features: DataFrame of per-student features indexed by username
+        rules: List of rules (default: load_rules())
+        min_score: Leave out students scoring below this
+    Returns:
+        DataFrame ranked by score (highest first) with username, full_name,
+        department, level, score, reasons and the features
+    """
+    rules = rules if rules is not None else load_rules()
+
+    score = np.zeros(len(features))
+    reasons = np.full(len(features), '', dtype=object)
+    for rule in rules:
+        try:
+            matched = np.asarray(features.eval(rule['expression']), dtype=bool)
+        except Exception as e:
+            print(f"Error evaluating risk rule {rule.get('name')}: {e}")
+            continue
+        score += matched * float(rule.get('weight', 1))
+        # Reasons are joined with '; ' in rule order
+        separator = np.where(reasons[matched] == '', '', '; ')
+        reasons[matched] = reasons[matched] + separator + rule.get('reason', rule.get('name', ''))
+
+    ranked = features.assign(score=score, reasons=reasons)
+    ranked = ranked[ranked['score'] >= min_score]
+    ranked = ranked.sort_values(['score', 'gpa'], ascending=[False, True], na_position='first', kind='stable')
+    columns = ['full_name', 'department', 'level', 'score', 'reasons', 'gpa', 'mean_grade',
+               'min_grade', 'failing_subjects', 'mean_change', 'eca_hours', 'activities']
+    return ranked[columns].rename_axis('username').reset_index()
+
+
+@instrument
+def score_students(rules=None, data_dir="data", min_score=1):
+    """
+    Read the tables and score every student against the rules.
+    Returns:
+        Ranked DataFrame (see score_features), or None on error
+    """
+    try:
+        return score_features(build_features(data_dir), rules, min_score)
+    except Exception as e:
+        print(f"Error scoring students: {e}")
+        return None
+
+
+def save_baseline(data_dir="data"):
+    """
+    Save every student's current mean grade as the baseline for 'mean_change'.
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        features = build_features(data_dir)
+        baseline = features[['mean_grade']].rename_axis('username').reset_index()
+        baseline.to_csv(os.path.join(data_dir, os.path.basename(BASELINE_FILE)), index=False)
+        return True, f"Baseline saved for {len(baseline)} students"
+    except Exception as e:
+        return False, f"Error saving baseline: {str(e)}"
@@ -0,0 +1,377 @@
+"""
+Grade and ECA statistics grouped by department, level and subject.
+
+RollupCube holds one cell per (department, level, subject) with the count,
+sum and sum of squares of the grades, and one cell per (department, level)
+with the number of students, activities and weekly hours. The cube is built
+in one vectorized pass over the tables, then kept up to date from the change
+events published by every write, so queries aggregate the cube and never
+re-scan the tables. The versions of the tables the cube matches are noted
+after the build and after each event; get_cube() builds it again when the
+tables have changed otherwise (a snapshot restore, an integrity repair, or a
+write by another process whose events are not watched).
+
+    from rollups import get_cube
+    get_cube().grade_rollup(['department'])
+    get_cube().drill_down(department='IT')
+
+Departments are grouped case-insensitively with whitespace collapsed (see
+tables.group_key) and shown as first spelled in the tables.
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+import events
+from tables import read_table, group_key, group_label
+from metrics import instrument
+
+DIMENSIONS = ('department', 'level', 'subject')
+SOURCE_TABLES = ('users', 'grades', 'eca')
+
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _department(value):
+    """Normalise a department for use in a cell key (None when missing)"""
+    return group_key(value)
+
+
+def _level(value):
+    """Normalise a level for use in a cell key (None when missing or not a number)"""
+    try:
+        level = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(level) else level
+
+
+class RollupCube:
+    """Department x level x subject cells of grade and ECA sufficient statistics"""
+
+    def __init__(self):
+        self.grade_cells = {}     # (department, level, subject) -> [count, sum, sum of squares]
+        self.eca_cells = {}       # (department, level) -> [activities, hours, sum of squares]
+        self.student_counts = {}  # (department, level) -> number of students
+        # Per-student state, needed to take a student's old values out of the cells
+        self.profiles = {}        # username -> (department, level) for students
+        self.subjects = []
+        self.rows = {}            # username -> row of the grade matrix
+        self.matrix = np.empty((0, 0))
+        self.eca = {}             # username -> {activity: hours per week}
+        self.department_names = {}  # department key -> name shown
+        self.data_dir = None
+        self.versions = None      # versions of the source tables the cube matches
+        self._unsubscribers = []
+
+    @instrument
+    def build(self, data_dir="data"):
+        """Build the cube and the per-student state from the tables"""
+        unsubscribers = self._unsubscribers
+        self.__init__()
+        self._unsubscribers = unsubscribers
+        self.data_dir = data_dir
+        # Noted before reading, so a change made while reading causes another build
+        self.versions = self._source_versions()
+        users_path = os.path.join(data_dir, "users.csv")
+        if not os.path.exists(users_path):
+            return
+        users = read_table(users_path, compact=True, usecols=['username', 'role', 'department', 'level'])
+        users = users[users['role'] == 'student'].drop_duplicates('username')
+
+        # One group code per (department, level) pair; only the distinct values are normalised
+        department_codes, departments = pd.factorize(users['department'].astype(object))
+        for department in departments:
+            self._name_department(department)
+        level_codes, levels = pd.factorize(pd.to_numeric(users['level'], errors='coerce'))
+        pair_codes, pairs = pd.factorize(department_codes * (len(levels) + 1) + level_codes)
+        first = pd.Series(np.arange(len(pair_codes))).groupby(pair_codes).first().to_numpy()
+        keys = np.empty(len(pairs), dtype=object)
+        keys[:] = [
+            (_department(departments[d]) if d >= 0 else None, _level(levels[l]) if l >= 0 else None)
+            for d, l in zip(department_codes[first], level_codes[first])
+        ]
+        # Normalising can merge pairs (e.g. 'IT' and 'it '), so group codes are taken from the keys
+        group_codes, groups = pd.factorize(keys)
+        codes = group_codes[pair_codes]
+        groups = list(groups)
+        usernames = users['username'].to_numpy(dtype=object)
+        self.profiles = dict(zip(usernames.tolist(), keys[pair_codes].tolist()))
+        student_code = pd.Series(codes, index=usernames)
+        counts = np.bincount(codes, minlength=len(groups))
+        self.student_counts = {group: int(count) for group, count in zip(groups, counts)}
+
+        grades_path = os.path.join(data_dir, "grades.csv")
+        if os.path.exists(grades_path):
+            grades = read_table(grades_path, compact=True).drop_duplicates('username')
+            self.subjects = [column for column in grades.columns if column != 'username']
+            self.matrix = np.array(grades[self.subjects], dtype=float)
+            self.rows = dict(zip(grades['username'].tolist(), range(len(grades))))
+            row_codes = student_code.reindex(grades['username'].to_numpy()).to_numpy()
+            for i, subject in enumerate(self.subjects):
+                values = self.matrix[:, i]
+                mask = ~np.isnan(values) & ~np.isnan(row_codes)
+                code = row_codes[mask].astype(np.int64)
+                stats = (np.bincount(code, minlength=len(groups)),
+                         np.bincount(code, weights=values[mask], minlength=len(groups)),
+                         np.bincount(code, weights=values[mask] ** 2, minlength=len(groups)))
+                for g in np.flatnonzero(stats[0]):
+                    self.grade_cells[groups[g] + (subject,)] = [int(stats[0][g]), stats[1][g], stats[2][g]]
+
+        eca_path = os.path.join(data_dir, "eca.csv")
+        if os.path.exists(eca_path):
+            eca = read_table(eca_path, compact=True, usecols=['username', 'activity', 'hours_per_week'])
+            # A repeated activity counts once, its last row winning, as when events update it
+            eca = eca.drop_duplicates(['username', 'activity'], keep='last')
+            hours = eca['hours_per_week'].to_numpy(dtype=float)
+            hours = np.where(np.isnan(hours), 0.0, hours)
+            for username, activity, value in zip(eca['username'].tolist(), eca['activity'].tolist(), hours.tolist()):
+                self.eca.setdefault(username, {})[activity] = value
+            row_codes = student_code.reindex(eca['username'].to_numpy()).to_numpy()
+            mask = ~np.isnan(row_codes)
+            code = row_codes[mask].astype(np.int64)
+            stats = (np.bincount(code, minlength=len(groups)),
+                     np.bincount(code, weights=hours[mask], minlength=len(groups)),
+                     np.bincount(code, weights=hours[mask] ** 2, minlength=len(groups)))
+            for g in np.flatnonzero(stats[0]):
+                self.eca_cells[groups[g]] = [int(stats[0][g]), stats[1][g], stats[2][g]]
+
+    def _source_versions(self):
+        return [_file_version(os.path.join(self.data_dir, f"{table}.csv")) for table in SOURCE_TABLES]
+
+    def is_current(self):
+        """Whether the tables are unchanged since the cube last matched them"""
+        return self.data_dir is not None and self.versions == self._source_versions()
+
+    def subscribe(self):
+        """Keep the cube up to date from change events"""
+        self._unsubscribers = [
+            events.subscribe(event_type, self.apply_event)
+            for event_type in (events.GRADE_CHANGED, events.ECA_CHANGED,
+                               events.USER_CHANGED, events.USER_REMOVED)
+        ]
+
+    def close(self):
+        for unsubscribe in self._unsubscribers:
+            unsubscribe()
+        self._unsubscribers = []
+
+    def _name_department(self, value):
+        """Remember how a department is shown (its first spelling)"""
+        key = _department(value)
+        if key is not None:
+            self.department_names.setdefault(key, group_label(value))
+
+    def _show_departments(self, grouped):
+        if 'department' in grouped.columns:
+            grouped['department'] = grouped['department'].map(lambda key: self.department_names.get(key, key))
+        return grouped
+
+    # Incremental updates
+    @staticmethod
+    def _add(cells, key, value, sign):
+        cell = cells.setdefault(key, [0, 0.0, 0.0])
+        cell[0] += sign
+        cell[1] += sign * value
+        cell[2] += sign * value * value
+        if cell[0] <= 0:
+            del cells[key]
+
+    def _student_grades(self, username):
+        """(subject, grade) pairs of a student from the grade matrix"""
+        row = self.rows.get(username)
+        if row is None:
+            return []
+        return [(subject, value) for subject, value in zip(self.subjects, self.matrix[row]) if not np.isnan(value)]
+
+    def _add_student(self, username, sign):
+        """Add (sign=1) or take out (sign=-1) all of a student's values"""
+        group = self.profiles.get(username)
+        if group is None:
+            return
+        self.student_counts[group] = self.student_counts.get(group, 0) + sign
+        if self.student_counts[group] <= 0:
+            del self.student_counts[group]
+        for subject, value in self._student_grades(username):
+            self._add(self.grade_cells, group + (subject,), value, sign)
+        for value in self.eca.get(username, {}).values():
+            self._add(self.eca_cells, group, value, sign)
+
+    def _row(self, username):
+        """Row of a student in the grade matrix, adding one (capacity doubles) if needed"""
+        if username not in self.rows:
+            if len(self.rows) == len(self.matrix):
+                grown = np.full((max(2 * len(self.matrix), 16), len(self.subjects)), np.nan)
+                grown[:len(self.matrix)] = self.matrix
+                self.matrix = grown
+            self.rows[username] = len(self.rows)
+        return self.rows[username]
+
+    def _set_grade(self, username, subject, grade):
+        if subject not in self.subjects:
+            self.subjects.append(subject)
+            self.matrix = np.hstack([self.matrix, np.full((len(self.matrix), 1), np.nan)])
+        row, column = self._row(username), self.subjects.index(subject)
+
+        group = self.profiles.get(username)
+        old = self.matrix[row, column]
+        if group is not None and not np.isnan(old):
+            self._add(self.grade_cells, group + (subject,), old, -1)
+        self.matrix[row, column] = np.nan if grade is None else float(grade)
+        if group is not None and grade is not None:
+            self._add(self.grade_cells, group + (subject,), float(grade), 1)
+
+    def _set_activity(self, username, activity, hours):
+        group = self.profiles.get(username)
+        activities = self.eca.setdefault(username, {})
+        old = activities.pop(activity, None)
+        if group is not None and old is not None:
+            self._add(self.eca_cells, group, old, -1)
+        if hours is not None:
+            activities[activity] = hours
+            if group is not None:
+                self._add(self.eca_cells, group, hours, 1)
+
+    @staticmethod
+    def _hours(record):
+        try:
+            hours = float(record.get('hours_per_week'))
+        except (TypeError, ValueError):
+            return 0.0
+        return 0.0 if np.isnan(hours) else hours
+
+    def apply_event(self, event):
+        """Apply one change event to the cells"""
+        self._apply(event)
+        # Events are published once the tables are written
+        if self.data_dir is not None:
+            self.versions = self._source_versions()
+
+    def _apply(self, event):
+        username = event.username
+        if event.type == events.GRADE_CHANGED:
+            if event.data.get('subject') is not None:
+                self._set_grade(username, event.data['subject'], event.data.get('grade'))
+
+        elif event.type == events.ECA_CHANGED:
+            if 'records' in event.data:
+                for activity in list(self.eca.get(username, {})):
+                    self._set_activity(username, activity, None)
+                for record in event.data['records']:
+                    self._set_activity(username, record['activity'], self._hours(record))
+            else:
+                record = event.data.get('record')
+                self._set_activity(username, event.data['activity'],
+                                   None if record is None else self._hours(record))
+
+        elif event.type == events.USER_CHANGED:
+            fields = event.data.get('fields', {})
+            old = self.profiles.get(username)
+            role = fields.get('role')
+            if old is None and role != 'student':
+                return
+            if 'department' in fields:
+                self._name_department(fields['department'])
+            department = _department(fields['department']) if 'department' in fields else old[0] if old else None
+            level = _level(fields['level']) if 'level' in fields else old[1] if old else None
+            new = None if role not in (None, 'student') else (department, level)
+            if new != old:
+                self._add_student(username, -1)
+                if new is None:
+                    self.profiles.pop(username, None)
+                else:
+                    self.profiles[username] = new
+                    self._add_student(username, 1)
+
+        elif event.type == events.USER_REMOVED:
+            self._add_student(username, -1)
+            self.profiles.pop(username, None)
+            row = self.rows.get(username)
+            if row is not None:
+                self.matrix[row] = np.nan
+            self.eca.pop(username, None)
+
+    # Queries
+    def grade_rollup(self, by=('department',), department=None, level=None, subject=None):
+        """
+        Grade statistics grouped by any of department, level and subject.
+        Args:
+            by: Dimensions to group by
+            department, level, subject: Only include cells with these values
+        Returns:
+            DataFrame with the dimensions, grade_count, mean_grade and std_dev
+        """
+        department = _department(department)
+        rows = [
+            {'department': d, 'level': l, 'subject': s, 'grade_count': c, 'sum': total, 'sum_sq': squares}
+            for (d, l, s), (c, total, squares) in self.grade_cells.items()
+            if (department is None or d == department) and (level is None or l == level)
+            and (subject is None or s == subject)
+        ]
+        cells = pd.DataFrame(rows, columns=list(DIMENSIONS) + ['grade_count', 'sum', 'sum_sq'])
+        grouped = cells.groupby(list(by), dropna=False, sort=True)[['grade_count', 'sum', 'sum_sq']].sum()
+        grouped['mean_grade'] = grouped['sum'] / grouped['grade_count']
+        variance = (grouped['sum_sq'] / grouped['grade_count'] - grouped['mean_grade'] ** 2).clip(lower=0)
+        grouped['std_dev'] = variance ** 0.5
+        return self._show_departments(grouped[['grade_count', 'mean_grade', 'std_dev']].reset_index())
+
+    def eca_rollup(self, by=('department',), department=None, level=None):
+        """
+        Student and ECA statistics grouped by department and/or level.
+        Returns:
+            DataFrame with the dimensions, students, activities, total_hours and
+            average_hours (per activity)
+        """
+        department = _department(department)
+        keys = set(self.student_counts) | set(self.eca_cells)
+        rows = [
+            {'department': d, 'level': l, 'students': self.student_counts.get((d, l), 0),
+             'activities': self.eca_cells.get((d, l), [0, 0.0])[0],
+             'total_hours': self.eca_cells.get((d, l), [0, 0.0])[1]}
+            for d, l in keys
+            if (department is None or d == department) and (level is None or l == level)
+        ]
+        cells = pd.DataFrame(rows, columns=['department', 'level', 'students', 'activities', 'total_hours'])
+        grouped = cells.groupby(list(by), dropna=False, sort=True)[['students', 'activities', 'total_hours']].sum()
+        grouped['average_hours'] = grouped['total_hours'] / grouped['activities'].where(grouped['activities'] > 0)
+        return self._show_departments(grouped.reset_index())
+
+    def drill_down(self, department=None, level=None):
+        """
+        Statistics one level below a selection: departments, then the levels
+        of a department, then the subjects of a department and level.
+        Returns:
+            DataFrame with the next dimension and the grade (and, above subject
+            level, ECA) statistics
+        """
+        if department is None:
+            by, filters = ['department'], {}
+        elif level is None:
+            by, filters = ['level'], {'department': department}
+        else:
+            return self.grade_rollup(['subject'], department=department, level=level)
+        grades = self.grade_rollup(by, **filters)
+        activities = self.eca_rollup(by, **filters)
+        return activities.merge(grades, on=by, how='outer').sort_values(by, na_position='last')
+
+
+_cube = None
+_cube_lock = threading.Lock()
+
+
+def get_cube():
+    """Get the shared RollupCube, building it on first use and again when the tables changed otherwise"""
+    global _cube
+    with _cube_lock:
+        if _cube is None:
+            _cube = RollupCube()
+            _cube.build()
+            _cube.subscribe()
+        elif not _cube.is_current():
+            _cube.build(_cube.data_dir)
+        return _cube
@@ -0,0 +1,554 @@
+"""
+Grades and ECA tables partitioned by a shard key (department, or campus if
+users.csv has such a column).
+
+build() splits grades.csv and eca.csv into one directory per key value,
+data/shards/<shard>/grades.csv and eca.csv, so each shard looks like a small
+data directory. A routing index maps every username to its shard. It is
+hashed into ROUTING_BUCKETS files, so finding a user's shard reads one small
+file (and then only that shard's table) instead of the whole table.
+
+Key values are grouped case-insensitively with whitespace collapsed (see
+tables.group_key), so 'Computer Science' and 'computer  science' share a
+shard.
+
+data/grades.csv and data/eca.csv stay the tables every write goes to; the
+shards follow them from the change events every write publishes. The events
+of a logged call (see wal.py) are applied when the call completes, touching
+only the shards of the users it changed. manifest.json records the versions
+of the source tables the shards match. Reads take no lock: while the tables
+differ from those versions (between a write and the update of its shards,
+or after a change without matching events such as a snapshot restore) they
+go to the whole tables, and a background thread rebuilds the shards once no
+logged call of any process is in progress.
+
+map_shards() runs a function over the shards in worker processes and keeps
+each result until that shard's files change, so adding a campus only costs
+the work for the new shard. The workers are one pool kept for the life of
+the process and started with forkserver (or spawn), since the GUI, the API
+server and the rebuild thread run other threads that fork must not copy.
+
+    import shards
+    shards.get_store().build('department')
+    shards.get_store().table_path('student1', 'grades')   # data/shards/<shard>/grades.csv
+    shards.map_shards(count_rows)                          # {shard: result}
+"""
+import os
+import re
+import json
+import time
+import zlib
+import shutil
+import atexit
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+import events
+import wal
+from tables import read_table, write_table, iter_csv_chunks, table_dtypes, group_key, group_label
+from metrics import instrument
+
+SHARD_DIR_NAME = "shards"
+SHARD_KEY = 'department'
+# Shard of users without a key value, and of rows whose user is unknown
+UNASSIGNED = '_unassigned'
+SHARDED_TABLES = ('grades', 'eca')
+SOURCE_TABLES = ('users', 'grades', 'eca')
+ROUTING_BUCKETS = 64
+ECA_COLUMNS = ['username', 'activity', 'role', 'hours_per_week', 'description']
+
+_stores = {}
+# map_shards results: (function, shard directory) -> (file versions, result)
+_results = {}
+# Worker pool of map_shards: (pool, workers, process id that created it)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shard_name(value):
+    """Directory name of the shard for a key value, e.g. 'Computer Science' -> 'computer-science'"""
+    key = group_key(value)
+    if key is None:
+        return UNASSIGNED
+    return re.sub(r'[^a-z0-9]+', '-', key).strip('-') or UNASSIGNED
+
+
+def _bucket(username):
+    return zlib.crc32(str(username).encode()) % ROUTING_BUCKETS
+
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _empty_table(table):
+    return pd.DataFrame(columns=['username'] if table == 'grades' else ECA_COLUMNS)
+
+
+class ShardStore:
+    """The shards of one data directory, with the routing index"""
+
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        self.shard_dir = os.path.join(data_dir, SHARD_DIR_NAME)
+        self._manifest = (None, None)   # (file version, manifest)
+        self._routes = {}               # bucket -> (file version, {username: shard})
+        self._pending = []              # events of this process not applied yet
+        self._rebuilder = None          # thread rebuilding stale shards
+        self._rebuilder_lock = threading.Lock()
+
+    # Layout
+    def _manifest_path(self):
+        return os.path.join(self.shard_dir, "manifest.json")
+
+    def _routing_path(self, bucket):
+        return os.path.join(self.shard_dir, "routing", f"{bucket:02d}.csv")
+
+    def source_path(self, table):
+        return os.path.join(self.data_dir, f"{table}.csv")
+
+    def manifest(self):
+        """The manifest (key, shards and source versions), or None if the tables are not sharded"""
+        version = _file_version(self._manifest_path())
+        if version is None:
+            return None
+        if self._manifest[0] != version:
+            with open(self._manifest_path()) as f:
+                self._manifest = (version, json.load(f))
+        return self._manifest[1]
+
+    def is_enabled(self):
+        return os.path.exists(self._manifest_path())
+
+    def shards(self):
+        """Names of the shards"""
+        manifest = self.manifest()
+        return sorted(manifest['shards']) if manifest else []
+
+    def shard_path(self, shard, table):
+        return os.path.join(self.shard_dir, shard, f"{table}.csv")
+
+    def _source_versions(self):
+        return {table: _file_version(self.source_path(table)) for table in SOURCE_TABLES}
+
+    def _write_manifest(self, manifest, directory=None):
+        path = os.path.join(directory or self.shard_dir, "manifest.json")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, path)
+
+    # Building
+    @instrument
+    def build(self, key=SHARD_KEY):
+        """
+        Partition the grades and ECA tables by a users column.
+        Args:
+            key: Column of users.csv holding the shard key (e.g. 'department' or 'campus')
+        Returns:
+            Tuple of (success, message)
+        """
+        building = f"{self.shard_dir}.{os.getpid()}.tmp"
+        try:
+            with wal.get_apply_lock():
+                self._pending = []
+                versions = self._source_versions()
+                if versions['users'] is None:
+                    return False, "users.csv not found"
+                users = read_table(self.source_path('users'), usecols=['username', key])
+                users = users.drop_duplicates('username')
+                # Name each distinct key value once
+                codes, values = pd.factorize(users[key].astype(object))
+                names = np.array([shard_name(value) for value in values] + [UNASSIGNED], dtype=object)
+                routes = pd.Series(names[codes], index=users['username'].to_numpy(dtype=object))
+                # Spellings of one shard's key are listed as the first one found
+                shards = {}
+                for name, value in zip(names, list(values) + [None]):
+                    shards.setdefault(name, value)
+
+                shutil.rmtree(building, ignore_errors=True)
+                os.makedirs(os.path.join(building, "routing"))
+                for table in SHARDED_TABLES:
+                    path = self.source_path(table)
+                    for chunk in iter_csv_chunks(path, dtype=table_dtypes(path)):
+                        chunk_shards = routes.reindex(chunk['username'].to_numpy()).fillna(UNASSIGNED).to_numpy()
+                        for shard, part in chunk.groupby(chunk_shards, sort=False):
+                            target = os.path.join(building, shard, f"{table}.csv")
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            write_table(part, target, mode='a', header=not os.path.exists(target))
+
+                buckets = np.array([_bucket(username) for username in routes.index], dtype=np.int64)
+                routing = pd.DataFrame({'username': routes.index, 'shard': routes.to_numpy()})
+                for bucket, part in routing.groupby(buckets):
+                    part.to_csv(os.path.join(building, "routing", f"{bucket:02d}.csv"), index=False)
+
+                # Shards without users or rows are not listed
+                used = set(routes.unique()) | set(os.listdir(building))
+                listed = {name: group_label(value) for name, value in shards.items() if name in used}
+                self._write_manifest({'key': key, 'shards': listed, 'sources': versions,
+                                      'time': time.time()}, building)
+
+                # Swap the new shards in
+                old = f"{self.shard_dir}.{os.getpid()}.old"
+                if os.path.exists(self.shard_dir):
+                    os.replace(self.shard_dir, old)
+                os.replace(building, self.shard_dir)
+                shutil.rmtree(old, ignore_errors=True)
+                self._manifest = (None, None)
+                self._routes = {}
+            return True, f"Partitioned the tables by {key} into {len(listed)} shards"
+        except Exception as e:
+            return False, f"Error building shards: {str(e)}"
+        finally:
+            shutil.rmtree(building, ignore_errors=True)
+
+    def disable(self):
+        """Remove the shards; reads go to the whole tables again"""
+        with wal.get_apply_lock():
+            shutil.rmtree(self.shard_dir, ignore_errors=True)
+            self._pending = []
+            self._manifest = (None, None)
+            self._routes = {}
+
+    def ensure_current(self):
+        """
+        Apply pending changes, and rebuild the shards if the tables changed
+        in a way they do not reflect. Waits for the logged calls of every
+        process to finish; reads use current_manifest() instead.
+        Returns:
+            The manifest, or None if the tables are not sharded
+        """
+        with wal.exclusive():
+            self.flush()
+            manifest = self.manifest()
+            if manifest is not None and manifest['sources'] != self._source_versions():
+                success, message = self.build(manifest['key'])
+                if not success:
+                    print(message)
+                manifest = self.manifest()
+            return manifest
+
+    def current_manifest(self):
+        """
+        The manifest if the shards match the tables, without taking any lock.
+        Stale shards are rebuilt in the background.
+        Returns:
+            The manifest, or None if the tables are not sharded or the shards
+            are stale (read the whole tables then)
+        """
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        if manifest['sources'] != self._source_versions():
+            self.rebuild_in_background()
+            return None
+        return manifest
+
+    def rebuild_in_background(self):
+        """Start a thread that brings the shards up to date, unless one is running"""
+        with self._rebuilder_lock:
+            if self._rebuilder is None:
+                self._rebuilder = threading.Thread(target=self._rebuild, name="shard-rebuild", daemon=True)
+                self._rebuilder.start()
+
+    def _rebuild(self):
+        try:
+            self.ensure_current()
+        except Exception as e:
+            print(f"Error rebuilding shards: {e}")
+        finally:
+            with self._rebuilder_lock:
+                self._rebuilder = None
+
+    def wait(self, timeout=None):
+        """Wait for a background rebuild to finish"""
+        rebuilder = self._rebuilder
+        if rebuilder is not None:
+            rebuilder.join(timeout)
+
+    # Routing
+    def _bucket_routes(self, bucket):
+        path = self._routing_path(bucket)
+        version = _file_version(path)
+        cached = self._routes.get(bucket)
+        if cached is None or cached[0] != version:
+            if version is None:
+                routes = {}
+            else:
+                routing = pd.read_csv(path, dtype=str, keep_default_na=False)
+                routes = dict(zip(routing['username'], routing['shard']))
+            cached = self._routes[bucket] = (version, routes)
+        return cached[1]
+
+    def shard_of(self, username):
+        """Shard holding a user's rows (UNASSIGNED for unknown users)"""
+        return self._bucket_routes(_bucket(username)).get(username, UNASSIGNED)
+
+    def table_path(self, username, table):
+        """
+        Path of the table holding a user's rows.
+        Returns:
+            The owning shard's file, or the whole table if the tables are not sharded
+        """
+        if table not in SHARDED_TABLES or self.current_manifest() is None:
+            return self.source_path(table)
+        return self.shard_path(self.shard_of(username), table)
+
+    # Following changes
+    def apply_event(self, event):
+        """Queue a change made by this process (other processes apply their own)"""
+        if event.pid == os.getpid() and self.is_enabled():
+            self._pending.append(event)
+
+    def flush(self):
+        """Apply the queued changes to the shards they touch"""
+        with wal.get_apply_lock():
+            pending, self._pending = self._pending, []
+            manifest = self.manifest()
+            if not pending or manifest is None:
+                return
+            changes = _ShardChanges(self, manifest)
+            start = 0
+            # Consecutive events of one type are applied together
+            for end in range(1, len(pending) + 1):
+                if end == len(pending) or pending[end].type != pending[start].type:
+                    changes.apply(pending[start].type, pending[start:end])
+                    start = end
+            changes.save()
+            manifest['sources'] = self._source_versions()
+            self._write_manifest(manifest)
+
+
+class _ShardChanges:
+    """Changes to the shards from a run of events, written back by save()"""
+
+    def __init__(self, store, manifest):
+        self.store = store
+        self.manifest = manifest
+        self.frames = {}   # (shard, table) -> DataFrame
+        self.routes = {}   # username -> new shard, or None when removed
+
+    def route(self, username):
+        if username in self.routes:
+            return self.routes[username] or UNASSIGNED
+        return self.store.shard_of(username)
+
+    def frame(self, shard, table):
+        if (shard, table) not in self.frames:
+            path = self.store.shard_path(shard, table)
+            self.frames[shard, table] = read_table(path) if os.path.exists(path) else _empty_table(table)
+        return self.frames[shard, table]
+
+    def apply(self, event_type, batch):
+        if event_type == events.GRADE_CHANGED:
+            self._set_grades(batch)
+        elif event_type == events.ECA_CHANGED:
+            self._set_eca(batch)
+        elif event_type == events.USER_CHANGED:
+            self._move_users(batch)
+        elif event_type == events.USER_REMOVED:
+            self._remove_users(batch)
+
+    def _set_grades(self, batch):
+        cells = pd.DataFrame([(event.username, event.data['subject'], event.data.get('grade'))
+                              for event in batch if event.data.get('subject') is not None],
+                             columns=['username', 'subject', 'grade'])
+        cells = cells.drop_duplicates(['username', 'subject'], keep='last')
+        cells['grade'] = pd.to_numeric(cells['grade'], errors='coerce')
+        shards = np.array([self.route(username) for username in cells['username']], dtype=object)
+        for shard, part in cells.groupby(shards, sort=False):
+            grades = self.frame(shard, 'grades')
+            new_users = pd.unique(part['username'][~part['username'].isin(grades['username'])])
+            if len(new_users):
+                grades = pd.concat([grades, pd.DataFrame({'username': new_users})], ignore_index=True)
+            # The first row of a username holds its grades
+            first = pd.Series(np.arange(len(grades)), index=grades['username'].to_numpy())
+            first = first[~first.index.duplicated()]
+            for subject, subject_cells in part.groupby('subject', sort=False):
+                if subject not in grades.columns:
+                    grades[subject] = np.nan
+                grades.iloc[first[subject_cells['username']].to_numpy(), grades.columns.get_loc(subject)] = \
+                    subject_cells['grade'].to_numpy(dtype=float)
+            self.frames[shard, 'grades'] = grades
+
+    def _set_eca(self, batch):
+        replaced = set()   # users whose activities were all replaced
+        records = {}       # (username, activity) -> record, or None when removed
+        for event in batch:
+            username = event.username
+            if 'records' in event.data:
+                replaced.add(username)
+                records = {key: record for key, record in records.items() if key[0] != username}
+                for record in event.data['records']:
+                    records[username, record['activity']] = record
+            else:
+                records[username, event.data['activity']] = event.data.get('record')
+        users = replaced | {username for username, _ in records}
+        by_shard = {}
+        for username in users:
+            by_shard.setdefault(self.route(username), set()).add(username)
+        for shard, shard_users in by_shard.items():
+            eca = self.frame(shard, 'eca')
+            keys = [key for key in records if key[0] in shard_users]
+            drop = eca['username'].isin(replaced & shard_users).to_numpy()
+            if keys:
+                drop = drop | pd.MultiIndex.from_frame(eca[['username', 'activity']].astype(str)).isin(keys)
+            added = pd.DataFrame([records[key] for key in keys if records[key] is not None])
+            added = added.reindex(columns=ECA_COLUMNS)
+            self.frames[shard, 'eca'] = pd.concat([eca[~drop], added], ignore_index=True) if len(added) \
+                else eca[~drop].reset_index(drop=True)
+
+    def _take_rows(self, usernames_by_shard):
+        """Remove the rows of users from their shards, returning them per (table, username)"""
+        taken = {}
+        for shard, usernames in usernames_by_shard.items():
+            for table in SHARDED_TABLES:
+                path = self.store.shard_path(shard, table)
+                if (shard, table) not in self.frames and not os.path.exists(path):
+                    continue
+                frame = self.frame(shard, table)
+                mask = frame['username'].isin(usernames).to_numpy()
+                if mask.any():
+                    taken.setdefault(table, []).append(frame[mask])
+                    self.frames[shard, table] = frame[~mask].reset_index(drop=True)
+        return {table: pd.concat(parts, ignore_index=True) for table, parts in taken.items()}
+
+    def _move_users(self, batch):
+        key = self.manifest['key']
+        moves = {}
+        for event in batch:
+            fields = event.data.get('fields', {})
+            if key in fields:
+                shard = moves[event.username] = shard_name(fields[key])
+                if shard not in self.manifest['shards']:
+                    self.manifest['shards'][shard] = None if shard == UNASSIGNED else group_label(fields[key])
+        origins = {}
+        for username, shard in moves.items():
+            origin = self.route(username)
+            self.routes[username] = shard
+            if origin != shard:
+                origins.setdefault(origin, set()).add(username)
+        for table, rows in self._take_rows(origins).items():
+            targets = np.array([self.route(username) for username in rows['username']], dtype=object)
+            for shard, part in rows.groupby(targets, sort=False):
+                self.frames[shard, table] = pd.concat([self.frame(shard, table), part], ignore_index=True)
+
+    def _remove_users(self, batch):
+        by_shard = {}
+        for event in batch:
+            by_shard.setdefault(self.route(event.username), set()).add(event.username)
+            self.routes[event.username] = None
+        self._take_rows(by_shard)
+
+    def save(self):
+        """Write the changed shard tables and routing buckets"""
+        for (shard, table), frame in self.frames.items():
+            os.makedirs(os.path.join(self.store.shard_dir, shard), exist_ok=True)
+            write_table(frame, self.store.shard_path(shard, table))
+        buckets = {}
+        for username, shard in self.routes.items():
+            buckets.setdefault(_bucket(username), {})[username] = shard
+        for bucket, changes in buckets.items():
+            routes = dict(self.store._bucket_routes(bucket))
+            for username, shard in changes.items():
+                if shard is None:
+                    routes.pop(username, None)
+                else:
+                    routes[username] = shard
+            path = self.store._routing_path(bucket)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_table(pd.DataFrame({'username': list(routes), 'shard': list(routes.values())}), path)
+
+
+def get_store(data_dir="data"):
+    """Get the ShardStore of a data directory"""
+    if data_dir not in _stores:
+        _stores[data_dir] = ShardStore(data_dir)
+    return _stores[data_dir]
+
+
+def _shard_versions(shard_dir):
+    return [_file_version(os.path.join(shard_dir, f"{table}.csv")) for table in SHARDED_TABLES]
+
+
+def map_shards(function, *args, data_dir="data", workers=None):
+    """
+    Run function(shard_dir, *args) for every shard, in parallel worker
+    processes. Results are kept until the shard's files change, so only new
+    and changed shards are computed again.
+    Args:
+        function: Module-level function (it is run in other processes)
+        workers: Worker processes (default: CPU count)
+    Returns:
+        Dictionary of shard name -> result (empty if the tables are not sharded
+        or the shards are being rebuilt)
+    """
+    store = get_store(data_dir)
+    if store.current_manifest() is None:
+        return {}
+    results = {}
+    stale = []
+    for shard in store.shards():
+        shard_dir = os.path.join(store.shard_dir, shard)
+        key = (f"{function.__module__}.{function.__qualname__}", shard_dir, args)
+        cached = _results.get(key)
+        if cached is not None and cached[0] == _shard_versions(shard_dir):
+            results[shard] = cached[1]
+        else:
+            stale.append((shard, shard_dir, key))
+
+    if len(stale) > 1 and (workers or os.cpu_count() or 1) > 1:
+        pool = _worker_pool(workers or os.cpu_count())
+        # Absolute paths: the workers keep the directory the pool was started in
+        computed = pool.starmap(function, [(os.path.abspath(shard_dir),) + args for _, shard_dir, _ in stale])
+    else:
+        computed = [function(shard_dir, *args) for _, shard_dir, _ in stale]
+
+    for (shard, shard_dir, key), result in zip(stale, computed):
+        _results[key] = (_shard_versions(shard_dir), result)
+        results[shard] = result
+    return results
+
+
+def _worker_pool(workers):
+    """
+    The process's worker pool, started on first use and again only when more
+    workers are asked for (the old pool finishes its work and exits).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool[1] < workers or _pool[2] != os.getpid():
+            if _pool is not None and _pool[2] == os.getpid():
+                _pool[0].close()
+            # Not fork: the calling process may be running other threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = (context.Pool(workers), workers, os.getpid())
+        return _pool[0]
+
+
+@atexit.register
+def _close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool[2] == os.getpid():
+            _pool[0].terminate()
+        _pool = None
+
+
+def _queue_event(event):
+    get_store().apply_event(event)
+
+
+def _flush():
+    get_store().flush()
+
+
+# Every process that changes the tables keeps the shards of data/ current
+for _event_type in (events.GRADE_CHANGED, events.ECA_CHANGED, events.USER_CHANGED, events.USER_REMOVED):
+    events.subscribe(_event_type, _queue_event)
+wal.after_apply(_flush)
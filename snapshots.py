@@ -0,0 +1,310 @@
+"""
+Consistent, incremental snapshots of the data tables with point-in-time restore.
+
+A snapshot records users, passwords, grades and eca as they were at one
+moment. Each table is split into blocks of about BLOCK_LINES lines; a block
+ends at a line chosen by a hash of the first bytes of the next line (the
+username), so editing or inserting rows only changes the blocks around them.
+Blocks are stored once, zlib-compressed, under their SHA-256 in
+data/snapshots/objects, and a snapshot is a manifest in
+data/snapshots/manifests listing the blocks of each table. A table whose
+file is unchanged since the previous snapshot (same inode, size and
+modification time) is not read at all, so a snapshot of a large dataset
+with few changes only reads and compresses the changed tables' new blocks.
+
+All tables of a snapshot are read inside wal.exclusive(), while no process
+can apply a logged change, and the table files are checked again afterwards
+so a change made outside the log during the snapshot makes it start over.
+A restore first recovers interrupted changes, so none is replayed over the
+restored tables later.
+
+    import snapshots
+    snapshots.take_snapshot()
+    snapshots.restore("2026-10-19T15:00:00")   # latest snapshot at or before this time
+"""
+import os
+import json
+import time
+import zlib
+import mmap
+import hashlib
+from datetime import datetime, timezone
+import numpy as np
+import wal
+from metrics import instrument
+
+SNAPSHOT_DIR = "data/snapshots"
+TABLES = {
+    'users': "data/users.csv",
+    'passwords': "data/passwords.csv",
+    'grades': "data/grades.csv",
+    'eca': "data/eca.csv"
+}
+# Average number of lines per block
+BLOCK_LINES = 16384
+# Blocks are cut at the next line once they grow past this size
+MAX_BLOCK_BYTES = 8 * 1024 * 1024
+# zlib level 1 compresses CSV about 5x at several times the speed of the default level
+COMPRESSION_LEVEL = 1
+# Attempts to take a snapshot while other processes keep changing the tables
+MAX_ATTEMPTS = 5
+
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def block_boundaries(buffer):
+    """
+    Split a CSV file's bytes into blocks at line starts.
+    Args:
+        buffer: Bytes (or a memory map) of the file
+    Returns:
+        Array of block end offsets (the last one is the file size)
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    size = len(data)
+    # Start of every line after the first
+    starts = np.flatnonzero(data == 10) + 1
+    starts = starts[starts < size]
+    if not len(starts):
+        return np.array([size], dtype=np.int64)
+    # Hash the first 16 bytes of each line, which hold the username for most
+    # rows (the last byte repeats at the end of the file)
+    key = np.zeros(len(starts), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for part, multiplier in ((0, 0x9E3779B97F4A7C15), (8, 0xC2B2AE3D27D4EB4F)):
+            word = np.zeros(len(starts), dtype=np.uint64)
+            for i in range(part, part + 8):
+                word = (word << np.uint64(8)) | data[np.minimum(starts + i, size - 1)].astype(np.uint64)
+            key ^= word * np.uint64(multiplier)
+        key ^= key >> np.uint64(29)
+        key *= np.uint64(0xBF58476D1CE4E5B9)
+        key ^= key >> np.uint64(32)
+    cuts = starts[key % np.uint64(BLOCK_LINES) == 0]
+
+    # Blocks larger than MAX_BLOCK_BYTES are also cut at the first line start past the limit
+    ends = []
+    previous = 0
+    for cut in cuts.tolist() + [size]:
+        while cut - previous > MAX_BLOCK_BYTES:
+            i = np.searchsorted(starts, previous + MAX_BLOCK_BYTES)
+            if i >= len(starts) or starts[i] >= cut:
+                break
+            previous = int(starts[i])
+            ends.append(previous)
+        ends.append(cut)
+        previous = cut
+    return np.array(ends, dtype=np.int64)
+
+
+def _object_path(snapshot_dir, digest):
+    return os.path.join(snapshot_dir, "objects", digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    """Write a file under a temporary name, fsync it and rename it into place"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def _store_table(path, snapshot_dir, stats):
+    """
+    Store the blocks of a table that are not stored yet.
+    Returns:
+        Dictionary with the table's size, content hash and list of [block hash, length]
+    """
+    blocks = []
+    content = hashlib.sha256()
+    size = os.path.getsize(path)
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            start = 0
+            for end in block_boundaries(buffer).tolist():
+                with memoryview(buffer)[start:end] as block:
+                    digest = hashlib.sha256(block).hexdigest()
+                    object_path = _object_path(snapshot_dir, digest)
+                    if not os.path.exists(object_path):
+                        _write_atomic(object_path, zlib.compress(block, COMPRESSION_LEVEL))
+                        stats['new_blocks'] += 1
+                        stats['bytes_stored'] += end - start
+                blocks.append([digest, int(end - start)])
+                content.update(digest.encode())
+                start = end
+        stats['bytes_read'] += size
+    return {'size': size, 'sha256': content.hexdigest(), 'blocks': blocks}
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """
+    List the snapshots, oldest first.
+    Returns:
+        List of manifests (dictionaries with id, time and tables)
+    """
+    manifest_dir = os.path.join(snapshot_dir, "manifests")
+    if not os.path.exists(manifest_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(manifest_dir)):
+        if name.endswith(".json"):
+            with open(os.path.join(manifest_dir, name)) as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: manifest['time'])
+
+
+@instrument
+def take_snapshot(snapshot_dir=SNAPSHOT_DIR, tables=TABLES):
+    """
+    Take a consistent snapshot of all tables, storing only new blocks.
+    Returns:
+        Tuple of (success, message, manifest)
+    """
+    try:
+        previous = list_snapshots(snapshot_dir)
+        previous = previous[-1]['tables'] if previous else {}
+        for attempt in range(MAX_ATTEMPTS):
+            stats = {'new_blocks': 0, 'bytes_read': 0, 'bytes_stored': 0}
+            manifest = {'tables': {}}
+            with wal.exclusive():
+                versions = {name: _file_version(path) for name, path in tables.items()}
+                manifest['time'] = time.time()
+                for name, path in tables.items():
+                    if versions[name] is None:
+                        continue
+                    last = previous.get(name)
+                    if last is not None and last.get('version') == versions[name]:
+                        entry = dict(last)
+                    else:
+                        entry = _store_table(path, snapshot_dir, stats)
+                    entry['version'] = versions[name]
+                    manifest['tables'][name] = entry
+                # A table was changed outside the log while it was being read: start over
+                if versions == {name: _file_version(path) for name, path in tables.items()}:
+                    break
+        else:
+            return False, "The tables kept changing; no consistent snapshot could be taken", None
+
+        moment = datetime.fromtimestamp(manifest['time'], timezone.utc)
+        manifest['id'] = moment.strftime("%Y%m%dT%H%M%S.%fZ")
+        manifest.update(stats)
+        _write_atomic(os.path.join(snapshot_dir, "manifests", f"{manifest['id']}.json"),
+                      json.dumps(manifest).encode())
+        return True, (f"Snapshot {manifest['id']}: {stats['new_blocks']} new blocks, "
+                      f"{stats['bytes_stored']} of {stats['bytes_read']} bytes read were new"), manifest
+    except Exception as e:
+        return False, f"Error taking snapshot: {str(e)}", None
+
+
+def find_snapshot(point, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Find a snapshot by id, or the latest one taken at or before a time.
+    Args:
+        point: Snapshot id, ISO 8601 time (UTC unless it has an offset), epoch
+            seconds, or None for the latest snapshot
+    Returns:
+        Manifest, or None if there is no such snapshot
+    """
+    manifests = list_snapshots(snapshot_dir)
+    if point is None:
+        return manifests[-1] if manifests else None
+    for manifest in manifests:
+        if manifest['id'] == point:
+            return manifest
+    if isinstance(point, (int, float)):
+        moment = float(point)
+    else:
+        parsed = datetime.fromisoformat(str(point))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        moment = parsed.timestamp()
+    earlier = [manifest for manifest in manifests if manifest['time'] <= moment]
+    return earlier[-1] if earlier else None
+
+
+def _rebuild_table(entry, snapshot_dir, path):
+    """Write a table from its blocks, checking every block's hash"""
+    with open(path, 'wb') as f:
+        for digest, length in entry['blocks']:
+            with open(_object_path(snapshot_dir, digest), 'rb') as block_file:
+                block = zlib.decompress(block_file.read())
+            if len(block) != length or hashlib.sha256(block).hexdigest() != digest:
+                raise ValueError(f"Block {digest} is damaged")
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+@instrument
+def restore(point=None, snapshot_dir=SNAPSHOT_DIR, tables=TABLES):
+    """
+    Restore every table to a snapshot. All tables are rebuilt and checked
+    before any is replaced; tables that did not exist at the time are removed.
+    No change events are published, so running apps should be restarted.
+    Args:
+        point: Snapshot id or time (see find_snapshot); None for the latest
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        manifest = find_snapshot(point, snapshot_dir)
+        if manifest is None:
+            return False, f"No snapshot found for {point}" if point is not None else "No snapshots found"
+
+        with wal.exclusive():
+            # Finish interrupted changes first so they are not replayed onto the restored tables
+            wal.recover()
+            rebuilt = {}
+            try:
+                for name, path in tables.items():
+                    if name in manifest['tables']:
+                        rebuilt[path] = f"{path}.{os.getpid()}.restore"
+                        _rebuild_table(manifest['tables'][name], snapshot_dir, rebuilt[path])
+                for path, temporary in rebuilt.items():
+                    os.replace(temporary, path)
+                for name, path in tables.items():
+                    if name not in manifest['tables'] and os.path.exists(path):
+                        os.remove(path)
+            finally:
+                for temporary in rebuilt.values():
+                    if os.path.exists(temporary):
+                        os.remove(temporary)
+        return True, f"Restored snapshot {manifest['id']}"
+    except Exception as e:
+        return False, f"Error restoring snapshot: {str(e)}"
+
+
+def prune(keep, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Delete all but the newest snapshots and the blocks only they used.
+    Args:
+        keep: Number of snapshots to keep
+    Returns:
+        Tuple of (success, message)
+    """
+    try:
+        manifests = list_snapshots(snapshot_dir)
+        removed = manifests[:-keep] if keep > 0 else manifests
+        if not removed:
+            return True, "No snapshots to delete"
+        for manifest in removed:
+            os.remove(os.path.join(snapshot_dir, "manifests", f"{manifest['id']}.json"))
+        used = {digest for manifest in manifests[len(removed):]
+                for entry in manifest['tables'].values() for digest, _ in entry['blocks']}
+        deleted = 0
+        object_dir = os.path.join(snapshot_dir, "objects")
+        for folder in os.listdir(object_dir):
+            for digest in os.listdir(os.path.join(object_dir, folder)):
+                if digest not in used and not digest.endswith(".tmp"):
+                    os.remove(os.path.join(object_dir, folder, digest))
+                    deleted += 1
+        return True, f"Deleted {len(removed)} snapshots and {deleted} blocks"
+    except Exception as e:
+        return False, f"Error deleting snapshots: {str(e)}"
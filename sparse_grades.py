@@ -0,0 +1,222 @@
+"""
+Sparse student x subject grades matrix.
+
+grades.csv is a wide table with one column per subject, mostly empty once
+many subjects exist. read_grades() turns it into a row-compressed (CSR)
+SparseMatrix holding only the grades that exist, built chunk by chunk so the
+dense table never has to fit in memory at once. Memory grows with the number
+of grades (8 bytes each) plus 8 bytes per student for the row pointers, and
+the matrix is cached until grades.csv changes. The cache holds at most
+CACHE_BYTES of matrices and evicts the least recently used; a matrix larger
+than that is rebuilt on every call instead of being kept for the life of the
+process.
+
+    from sparse_grades import read_grades
+    grades = read_grades()
+    grades.row('student1')        # Series of subject -> grade
+    grades.column('Mathematics')  # array of the Mathematics grades
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from tables import table_dtypes, iter_csv_chunks
+
+# Entries paired at a time by row_pairs, bounding its memory use
+PAIR_BLOCK_ENTRIES = 1000000
+
+# Memory the cached matrices may use, row names included
+CACHE_BYTES = 256 * 1024 * 1024
+
+# path -> (file version, matrix, bytes), least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class SparseMatrix:
+    """
+    Sparse matrix in CSR form with names for its rows and columns. The
+    entries of row i are indices[indptr[i]:indptr[i + 1]] (column numbers, in
+    increasing order) and data[indptr[i]:indptr[i + 1]] (values).
+    """
+
+    def __init__(self, indptr, indices, data, row_names, column_names):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.data = np.asarray(data)
+        self.row_names = pd.Index(row_names)
+        self.column_names = list(column_names)
+
+    @classmethod
+    def from_dense(cls, values, row_names, column_names):
+        """Build from a 2-D array in which NaN marks a missing entry"""
+        present = ~np.isnan(values)
+        rows, columns = np.nonzero(present)
+        indptr = np.concatenate([[0], np.cumsum(present.sum(axis=1))])
+        return cls(indptr, columns, values[rows, columns], row_names, column_names)
+
+    @classmethod
+    def from_coordinates(cls, rows, columns, data, row_names, column_names):
+        """Build from unordered (row, column, value) entries; each position must appear once"""
+        order = np.lexsort((columns, rows))
+        counts = np.bincount(rows, minlength=len(row_names))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return cls(indptr, np.asarray(columns)[order], np.asarray(data)[order], row_names, column_names)
+
+    @classmethod
+    def stack(cls, blocks):
+        """Stack matrices with the same columns on top of each other"""
+        if not blocks:
+            return cls([0], [], np.empty(0, dtype=np.float32), [], [])
+        offsets = np.cumsum([0] + [block.nnz for block in blocks[:-1]])
+        indptr = np.concatenate([[0]] + [block.indptr[1:] + offset for block, offset in zip(blocks, offsets)])
+        return cls(indptr,
+                   np.concatenate([block.indices for block in blocks]),
+                   np.concatenate([block.data for block in blocks]),
+                   np.concatenate([block.row_names.to_numpy(dtype=object) for block in blocks]),
+                   blocks[0].column_names)
+
+    @property
+    def shape(self):
+        return (len(self.row_names), len(self.column_names))
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the numeric arrays (row and column names not included)"""
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def first_rows(self):
+        """The matrix without repeated row names (the first row of each name is kept)"""
+        keep = ~self.row_names.duplicated()
+        if keep.all():
+            return self
+        counts = np.diff(self.indptr)
+        entries = np.repeat(keep, counts)
+        return SparseMatrix(np.concatenate([[0], np.cumsum(counts[keep])]), self.indices[entries],
+                            self.data[entries], self.row_names[keep], self.column_names)
+
+    def entry_rows(self):
+        """Row number of every entry"""
+        return np.repeat(np.arange(len(self.row_names)), np.diff(self.indptr))
+
+    def row(self, name):
+        """
+        Entries of a row.
+        Returns:
+            Series of column name -> value (empty if the row does not exist)
+        """
+        try:
+            i = self.row_names.get_loc(name)
+        except KeyError:
+            return pd.Series(dtype=float)
+        # Duplicate row names give a slice or mask; the first row wins, as with the dense table
+        if isinstance(i, slice):
+            i = i.start
+        elif not isinstance(i, (int, np.integer)):
+            i = int(np.flatnonzero(i)[0])
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return pd.Series(self.data[start:end], index=[self.column_names[j] for j in self.indices[start:end]])
+
+    def column(self, name):
+        """Values present in a column"""
+        return self.data[self.indices == self.column_names.index(name)]
+
+    def column_counts(self):
+        """Number of entries in each column"""
+        return np.bincount(self.indices, minlength=len(self.column_names))
+
+    def column_sums(self, power=1):
+        """Sum of each column's values raised to a power"""
+        return np.bincount(self.indices, weights=self.data.astype(float) ** power, minlength=len(self.column_names))
+
+    def to_dense(self):
+        """Dense 2-D float array with NaN for missing entries"""
+        dense = np.full(self.shape, np.nan)
+        dense[self.entry_rows(), self.indices] = self.data
+        return dense
+
+    def to_scipy(self):
+        """The matrix as a scipy.sparse.csr_matrix (requires scipy)"""
+        from scipy import sparse
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+def row_pairs(left, right, block_entries=PAIR_BLOCK_ENTRIES):
+    """
+    Pair every entry of left with every entry of right in the same row, for
+    products such as left.T @ right. Both matrices must have the same rows.
+    Yields:
+        Tuples of (left entry numbers, right entry numbers), in blocks of rows
+        with about block_entries pairs each
+    """
+    left_counts = np.diff(left.indptr)
+    right_counts = np.diff(right.indptr)
+    pair_counts = np.cumsum(left_counts * right_counts)
+    start = 0
+    while start < len(left_counts):
+        # Rows start..end hold about block_entries pairs (at least one row)
+        base = pair_counts[start - 1] if start else 0
+        end = max(int(np.searchsorted(pair_counts, base + block_entries, side='right')), start + 1)
+        end = min(end, len(left_counts))
+        left_entries = np.arange(left.indptr[start], left.indptr[end])
+        rows = np.repeat(np.arange(start, end), left_counts[start:end])
+        # Each left entry is repeated once per right entry of its row
+        repeats = right_counts[rows]
+        left_index = np.repeat(left_entries, repeats)
+        offsets = np.arange(len(left_index)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        right_index = np.repeat(right.indptr[rows], repeats) + offsets
+        yield left_index, right_index
+        start = end
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def read_grades(path="data/grades.csv", chunksize=None):
+    """
+    Read grades.csv as a sparse student x subject matrix, reusing the cached
+    matrix while the file is unchanged.
+    Args:
+        path: Path to grades.csv
+        chunksize: Rows converted at a time (DEFAULT_CHUNK_ROWS if not given)
+    Returns:
+        SparseMatrix of float32 grades with usernames as rows and subjects as columns
+    """
+    if not os.path.exists(path):
+        return SparseMatrix.stack([])
+    version = _file_version(path)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(path)
+            return cached[1]
+
+    blocks = []
+    for chunk in iter_csv_chunks(path, chunksize, dtype=table_dtypes(path, compact=True)):
+        subjects = [column for column in chunk.columns if column != 'username']
+        blocks.append(SparseMatrix.from_dense(np.array(chunk[subjects], dtype=np.float32),
+                                              chunk['username'].to_numpy(dtype=object), subjects))
+    matrix = SparseMatrix.stack(blocks)
+    if not blocks:
+        matrix.column_names = [column for column in pd.read_csv(path, nrows=0).columns if column != 'username']
+    _remember(path, version, matrix)
+    return matrix
+
+
+def _remember(path, version, matrix):
+    """Cache a matrix, evicting the least recently used ones to stay within CACHE_BYTES"""
+    size = matrix.nbytes + int(matrix.row_names.memory_usage(deep=True))
+    with _cache_lock:
+        _cache.pop(path, None)
+        if size > CACHE_BYTES:
+            return
+        while _cache and sum(entry[2] for entry in _cache.values()) + size > CACHE_BYTES:
+            _cache.popitem(last=False)
+        _cache[path] = (version, matrix, size)
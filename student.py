@@ -4,8 +4,25 @@ Importing all the libraries
 import pandas as pd
 import numpy as np
 import os
+import events
+import wal
+import audit
+import shards
+from tables import read_table, write_table, grade_value, records_frame, eca_records
+from metrics import instrument
+
+
+# Results of the logged functions when their call cannot be logged (see wal.logged)
+def _failed(message):
+    print(message)
+    return False
+
+
+def _failed_with_errors(message):
+    return False, message, []
 
 """Get student profile information"""
+@instrument
 def get_student_profile(username):
     """Get student profile information"""
     try:
@@ -13,7 +30,7 @@ def get_student_profile(username):
             print("Error: File not found")
             return None
             
-        users_df = pd.read_csv('data/users.csv')
+        users_df = read_table('data/users.csv', compact=True)
         if users_df.empty:
             print("Error: File is empty")
             return None
@@ -36,6 +53,20 @@ def get_student_profile(username):
         print(f"Error fetching student profile: {str(e)}")
         return None
 
+def grades_from_row(student_row, columns):
+    """Convert a grades.csv row to a list of {'subject', 'grade'} dictionaries."""
+    grades = []
+    for column in columns:
+        if column != 'username':  # Skip the username column
+            value = student_row[column]
+            if pd.notna(value):  # Check if the grade is not NaN
+                grades.append({
+                    'subject': column,
+                    'grade': grade_value(value)
+                })
+    return grades
+
+@instrument
 def get_student_grades(username):
     """Fetch grades for a student from grades.csv."""
     if not username:
@@ -46,7 +77,9 @@ def get_student_grades(username):
             print("Error: File not found.")
             return None
             
-        df = pd.read_csv("data/grades.csv")
+        # When the tables are sharded only the shard holding the student is read
+        path = shards.get_store().table_path(username, 'grades')
+        df = read_table(path, compact=True) if os.path.exists(path) else pd.DataFrame(columns=['username'])
         
         # Check if the student exists in the grades file
         if username not in df['username'].values:
@@ -55,24 +88,13 @@ def get_student_grades(username):
             
         # Get the student's row
         student_row = df[df['username'] == username].iloc[0]
-        
-        # Convert to the expected format (list of dictionaries with subject and grade)
-        grades = []
-        for column in df.columns:
-            if column != 'username':  # Skip the username column
-                grade_value = student_row[column]
-                if pd.notna(grade_value):  # Check if the grade is not NaN
-                    grades.append({
-                        'subject': column,
-                        'grade': float(grade_value)
-                    })
-        
-        return grades
+        return grades_from_row(student_row, df.columns)
             
     except Exception as e:
         print(f"Error getting student grades: {e}")
         return None
 
+@instrument
 def get_student_eca(username):
     """Fetch extracurricular activities for a student from eca.csv."""
     if not username:
@@ -86,17 +108,22 @@ def get_student_eca(username):
             print("Error: eca.csv file not found.")
             return None
             
-        df = pd.read_csv("data/eca.csv")
+        path = shards.get_store().table_path(username, 'eca')
+        if not os.path.exists(path):
+            return []
+        df = read_table(path, compact=True)
         user_eca = df[df['username'] == username]
         
         if not user_eca.empty:
-            return user_eca.to_dict('records')
+            return eca_records(user_eca)
         return []
             
     except Exception as e:
         print(f"Error getting student ECA: {e}")
         return None
 
+@wal.logged(tables=('users',), failure=_failed)
+@instrument
 def update_student_profile(username, data):
     """Update the student's profile information in users.csv."""
     if not username or not data:
@@ -111,7 +138,7 @@ def update_student_profile(username, data):
             print("Error: users.csv file not found")
             return False
             
-        df = pd.read_csv("data/users.csv")
+        df = read_table("data/users.csv")
         if df.empty:
             print("Error: users.csv is empty")
             return False
@@ -132,12 +159,15 @@ def update_student_profile(username, data):
                 return False
                 
         # Update the user's information
+        old = df.loc[df['username'] == username].iloc[0]
         for key, value in data.items():
             if key in df.columns:
                 df.loc[df['username'] == username, key] = value
                 
+        audit.record('users', username, [(key, old[key], value) for key, value in data.items() if key in df.columns])
         # Save changes
-        df.to_csv("data/users.csv", index=False)
+        write_table(df, "data/users.csv")
+        events.publish(events.USER_CHANGED, username, fields=data)
         print("Profile updated successfully")
         return True
         
@@ -145,6 +175,8 @@ def update_student_profile(username, data):
         print(f"Error updating student profile: {e}")
         return False
 
+@wal.logged(tables=('grades',), failure=_failed)
+@instrument
 def add_student_grade(username, subject, grade):
     """Add a new grade for a student."""
     try:
@@ -158,7 +190,7 @@ def add_student_grade(username, subject, grade):
             print("Users file not found")
             return False
             
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv")
         if username not in users_df['username'].values:
             print(f"Student with username '{username}' not found")
             return False
@@ -184,14 +216,16 @@ def add_student_grade(username, subject, grade):
             pd.DataFrame(columns=columns).to_csv("data/grades.csv", index=False)
             
         # Read existing grades
-        df = pd.read_csv("data/grades.csv")
+        df = read_table("data/grades.csv")
         
         # Check if the subject column exists, if not add it
         if subject not in df.columns:
             df[subject] = None
             
         # Check if student already exists in the grades file
+        old_grade = None
         if username in df['username'].values:
+            old_grade = df.loc[df['username'] == username, subject].iloc[0]
             # Update the grade for the existing student
             df.loc[df['username'] == username, subject] = grade
         else:
@@ -206,8 +240,10 @@ def add_student_grade(username, subject, grade):
             # Append the new row to the dataframe
             df = pd.concat([df, new_row], ignore_index=True)
         
+        audit.record('grades', username, [(subject, old_grade, grade)])
         # Save to CSV
-        df.to_csv("data/grades.csv", index=False)
+        write_table(df, "data/grades.csv")
+        events.publish(events.GRADE_CHANGED, username, subject=subject, grade=grade)
         print(f"Grade added successfully for {username} in {subject}")
         return True
         
@@ -215,6 +251,8 @@ def add_student_grade(username, subject, grade):
         print(f"Error adding student grade: {e}")
         return False
 
+@wal.logged(tables=('eca',), failure=_failed)
+@instrument
 def add_student_eca(username, activity, role, hours_per_week, description=""):
     """Add a new extracurricular activity for a student."""
     try:
@@ -228,7 +266,7 @@ def add_student_eca(username, activity, role, hours_per_week, description=""):
             print("Users file not found")
             return False
             
-        users_df = pd.read_csv("data/users.csv")
+        users_df = read_table("data/users.csv")
         if username not in users_df['username'].values:
             print(f"Student with username '{username}' not found")
             return False
@@ -252,7 +290,7 @@ def add_student_eca(username, activity, role, hours_per_week, description=""):
             pd.DataFrame(columns=['username', 'activity', 'role', 'hours_per_week', 'description']).to_csv("data/eca.csv", index=False)
             
         # Read existing ECA records
-        df = pd.read_csv("data/eca.csv")
+        df = read_table("data/eca.csv")
         
         # Check if activity already exists for this student
         existing_eca = df[
@@ -276,10 +314,151 @@ def add_student_eca(username, activity, role, hours_per_week, description=""):
             df = pd.concat([df, new_eca], ignore_index=True)
         
         # Save to CSV
-        df.to_csv("data/eca.csv", index=False)
+        write_table(df, "data/eca.csv")
+        events.publish(events.ECA_CHANGED, username, activity=activity, record={
+            'username': username,
+            'activity': activity,
+            'role': role,
+            'hours_per_week': hours_per_week,
+            'description': description
+        })
         print(f"ECA added successfully for {username}: {activity}")
         return True
         
     except Exception as e:
         print(f"Error adding student ECA: {e}")
-        return False 
\ No newline at end of file
+        return False
+
+
+def _known_usernames():
+    """Get the set of usernames in users.csv"""
+    if not os.path.exists("data/users.csv"):
+        return set()
+    return set(read_table("data/users.csv", usecols=['username'])['username'].dropna())
+
+
+def _first_errors(batch, checks):
+    """Rejected rows of a batch as {'row', 'username', 'error'}, keeping the first failed check per row"""
+    errors = pd.Series('', index=batch.index)
+    for mask, message in checks:
+        errors = errors.mask((errors == '') & mask, message)
+    rejected = [
+        {'row': int(row), 'username': batch.at[row, 'username'], 'error': message}
+        for row, message in errors[errors != ''].items()
+    ]
+    return errors == '', rejected
+
+
+@wal.logged(files=('file_or_records',), tables=('grades',), failure=_failed_with_errors)
+@instrument
+def import_grades(file_or_records):
+    """
+    Add or update many grades at once, reading and writing grades.csv once.
+    Args:
+        file_or_records: CSV path, DataFrame or iterable of dictionaries with
+            username, subject and grade
+    Returns:
+        Tuple of (success, message, errors)
+    """
+    try:
+        batch = records_frame(file_or_records, ['username', 'subject', 'grade'])
+        grade = pd.to_numeric(batch['grade'], errors='coerce')
+        valid, rejected = _first_errors(batch, [
+            ((batch[['username', 'subject']] == '').any(axis=1), "Username and subject are required"),
+            (grade.isna(), "Grade must be a number"),
+            (~grade.between(0, 100), "Grade must be between 0 and 100"),
+            (~batch['username'].isin(_known_usernames()), "Student not found"),
+        ])
+        batch = batch[valid].assign(grade=grade[valid])
+        if batch.empty:
+            return False, "No valid grades to import", rejected
+            
+        if not os.path.exists("data"):
+            os.makedirs("data")
+        if os.path.exists("data/grades.csv"):
+            df = read_table("data/grades.csv")
+        else:
+            df = pd.DataFrame(columns=['username', 'Physics', 'Math', 'Chemistry', 'Biology', 'English'])
+            
+        # A later row for the same student and subject wins
+        changes = batch.drop_duplicates(['username', 'subject'], keep='last')
+        # The first row of a student holds their grades; repeated rows (see
+        # integrity.py) are left for repair
+        first = pd.Series(np.arange(len(df)), index=df['username'].to_numpy())
+        first = first[~first.index.duplicated()]
+        new_students = pd.unique(changes['username'][~changes['username'].isin(first.index)])
+        first = pd.concat([first, pd.Series(np.arange(len(df), len(df) + len(new_students)), index=new_students)])
+        new_subjects = [subject for subject in changes['subject'].unique() if subject not in df.columns]
+        df = pd.concat([df, pd.DataFrame({'username': new_students})], ignore_index=True)
+        df = df.reindex(columns=list(df.columns) + new_subjects)
+        df = df.astype({subject: float for subject in changes['subject'].unique()})
+        rows = first[changes['username']].to_numpy()
+        old_grades = np.full(len(changes), np.nan)
+        for subject in changes['subject'].unique():
+            in_subject = (changes['subject'] == subject).to_numpy()
+            column = df.columns.get_loc(subject)
+            old_grades[in_subject] = df[subject].to_numpy(dtype=float)[rows[in_subject]]
+            df.iloc[rows[in_subject], column] = changes['grade'].to_numpy(dtype=float)[in_subject]
+        audit.record_frame('grades', pd.DataFrame({'key': changes['username'], 'field': changes['subject'],
+                                                   'old': old_grades, 'new': changes['grade']}))
+        write_table(df, "data/grades.csv")
+        
+        events.publish_many(events.GRADE_CHANGED, (
+            (row.username, {'subject': row.subject, 'grade': float(row.grade)})
+            for row in changes.itertuples(index=False)
+        ))
+        return True, f"Imported {len(batch)} grades ({len(rejected)} rejected)", rejected
+    except Exception as e:
+        return False, f"Error importing grades: {str(e)}", []
+
+
+@wal.logged(files=('file_or_records',), tables=('eca',), failure=_failed_with_errors)
+@instrument
+def import_eca(file_or_records):
+    """
+    Add or update many extracurricular activities at once, reading and writing eca.csv once.
+    Args:
+        file_or_records: CSV path, DataFrame or iterable of dictionaries with
+            username, activity, role, hours_per_week and description
+    Returns:
+        Tuple of (success, message, errors)
+    """
+    try:
+        keys = ['username', 'activity']
+        fields = ['role', 'hours_per_week', 'description']
+        batch = records_frame(file_or_records, keys + fields)
+        hours = pd.to_numeric(batch['hours_per_week'], errors='coerce')
+        valid, rejected = _first_errors(batch, [
+            ((batch[['username', 'activity', 'role']] == '').any(axis=1), "Username, activity, and role are required"),
+            (hours.isna(), "Hours per week must be a number"),
+            (hours < 0, "Hours per week must be positive"),
+            (~batch['username'].isin(_known_usernames()), "Student not found"),
+        ])
+        batch = batch[valid].assign(hours_per_week=hours[valid]).drop_duplicates(keys, keep='last')
+        if batch.empty:
+            return False, "No valid activities to import", rejected
+            
+        if not os.path.exists("data"):
+            os.makedirs("data")
+        if os.path.exists("data/eca.csv"):
+            df = read_table("data/eca.csv")
+        else:
+            df = pd.DataFrame(columns=keys + fields)
+            
+        # Update existing (username, activity) rows in place, then append the new ones
+        merged = df[keys].merge(batch, on=keys, how='left', indicator=True)
+        matched = (merged['_merge'] == 'both').to_numpy()
+        for field in fields:
+            df.loc[matched, field] = merged.loc[matched, field].to_numpy()
+        existing = pd.MultiIndex.from_frame(df[keys])
+        new_rows = batch[~pd.MultiIndex.from_frame(batch[keys]).isin(existing)]
+        df = pd.concat([df, new_rows[keys + fields]], ignore_index=True)
+        write_table(df, "data/eca.csv")
+        
+        events.publish_many(events.ECA_CHANGED, (
+            (record['username'], {'activity': record['activity'], 'record': record})
+            for record in batch.to_dict('records')
+        ))
+        return True, f"Imported {len(batch)} activities ({len(rejected)} rejected)", rejected
+    except Exception as e:
+        return False, f"Error importing ECA: {str(e)}", []
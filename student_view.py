@@ -3,15 +3,27 @@ from tkinter import ttk, messagebox
 from student import get_student_grades, get_student_eca, update_student_profile
 from auth import get_user_details
 from mat import StudentAnalytics
+from view_utils import TreeviewSync
+from ranking import format_ranks
+import events
+import audit
+from metrics import instrument
+from profiling import profiled
 from PIL import Image, ImageTk
 import os
 
 
+# How often to check the event log for changes made by other processes
+POLL_INTERVAL_MS = 1000
+
+
 class StudentView:
-    def __init__(self, username, parent=None):
+    def __init__(self, username, parent=None, session=None):
         self.username = username
-        self.user_details = get_user_details(username)
-        self.analytics = StudentAnalytics()
+        # Reuse the data preloaded at login instead of re-reading each table
+        self.session = session if session is not None and session.username == username else None
+        self.user_details = self.session.user_details if self.session else get_user_details(username)
+        self.analytics = StudentAnalytics(self.session)
         
         # Create main window
         self.root = tk.Toplevel(parent) if parent else tk.Tk()
@@ -27,9 +39,45 @@ class StudentView:
         
         self.create_widgets()
         
+        # Apply changes made elsewhere while the dashboard is open
+        self.unsubscribers = [
+            events.subscribe(event_type, self._on_change)
+            for event_type in (events.GRADE_CHANGED, events.ECA_CHANGED, events.USER_CHANGED)
+        ]
+        self.event_watcher = events.EventLogWatcher()
+        self.root.bind('<Destroy>', self._on_destroy, add='+')
+        self._watch_events()
+        
         if not parent:
             self.root.mainloop()
             
+    def _watch_events(self):
+        """Poll the event log for changes made by other processes"""
+        self.event_watcher.poll()
+        self.watch_job = self.root.after(POLL_INTERVAL_MS, self._watch_events)
+        
+    def _on_destroy(self, event):
+        """Stop listening for changes once the window is closed"""
+        if event.widget is not self.root:
+            return
+        for unsubscribe in self.unsubscribers:
+            unsubscribe()
+        self.root.after_cancel(self.watch_job)
+        
+    def _on_change(self, event):
+        """Update only the parts of the dashboard affected by a change event"""
+        if event.username != self.username:
+            return
+        if self.session:
+            self.session.apply_event(event)
+            
+        if event.type == events.GRADE_CHANGED:
+            self.load_grades()
+            self.load_analytics()
+        elif event.type == events.ECA_CHANGED:
+            self.load_eca()
+            self.load_analytics()
+            
     def create_widgets(self):
         # Create notebook for tabs
         notebook = ttk.Notebook(self.root)
@@ -96,6 +144,7 @@ class StudentView:
         # Create treeview for grades
         columns = ('Subject', 'Grade')
         self.grades_tree = ttk.Treeview(parent, columns=columns, show='headings')
+        self.grades_sync = TreeviewSync(self.grades_tree)
         
         # Set column headings
         for col in columns:
@@ -117,6 +166,7 @@ class StudentView:
         # Create treeview for ECA
         columns = ('Activity', 'Role', 'Hours/Week', 'Description')
         self.eca_tree = ttk.Treeview(parent, columns=columns, show='headings')
+        self.eca_sync = TreeviewSync(self.eca_tree)
         
         # Set column headings
         for col in columns:
@@ -155,35 +205,44 @@ class StudentView:
         # Load analytics
         self.load_analytics()
     
+    def _get_grades(self):
+        """Get the student's grades, preferring the login session"""
+        if self.session:
+            return self.session.grades
+        return get_student_grades(self.username)
+        
+    def _get_eca(self):
+        """Get the student's ECA records, preferring the login session"""
+        if self.session:
+            return self.session.eca
+        return get_student_eca(self.username)
+        
+    @instrument
     def load_grades(self):
-        # Clear existing items
-        for item in self.grades_tree.get_children():
-            self.grades_tree.delete(item)
-            
-        # Load grades from database
-        grades = get_student_grades(self.username)
-        if grades:
-            for grade in grades:
-                self.grades_tree.insert('', 'end', values=(
-                    grade['subject'],
-                    grade['grade']
-                ))
+        # Load grades from session or database
+        grades = self._get_grades() or []
+        
+        # Only changed rows are touched, keyed by subject
+        self.grades_sync.sync(
+            (grade['subject'], (grade['subject'], grade['grade']))
+            for grade in grades
+        )
                 
+    @instrument
     def load_eca(self):
-        # Clear existing items
-        for item in self.eca_tree.get_children():
-            self.eca_tree.delete(item)
-            
-        # Load ECA from database
-        eca = get_student_eca(self.username)
-        if eca:
-            for activity in eca:
-                self.eca_tree.insert('', 'end', values=(
-                    activity['activity'],
-                    activity['role'],
-                    activity['hours_per_week'],
-                    activity['description']
-                ))
+        # Load ECA from session or database
+        eca = self._get_eca() or []
+        
+        # Only changed rows are touched, keyed by activity
+        self.eca_sync.sync(
+            (activity['activity'], (
+                activity['activity'],
+                activity['role'],
+                activity['hours_per_week'],
+                activity['description']
+            ))
+            for activity in eca
+        )
                 
     def update_profile(self):
         # Collect updated data
@@ -197,18 +256,23 @@ class StudentView:
         }
         
         # Update profile
-        if update_student_profile(self.username, data):
+        with audit.acting_as(self.username):
+            updated = update_student_profile(self.username, data)
+        if updated:
             messagebox.showinfo("Success", "Profile updated successfully!")
             self.user_details.update(data)
         else:
             messagebox.showerror("Error", "Failed to update profile")
             
+    @profiled
+    @instrument
     def load_analytics(self):
         """Load and display analytics data"""
+        self.stats_display.delete('1.0', tk.END)
         
         # Get data
-        grades = get_student_grades(self.username)
-        eca = get_student_eca(self.username)
+        grades = self._get_grades()
+        eca = self._get_eca()
         
         if not grades and not eca:
             self.stats_display.insert(tk.END, "No data available.")
@@ -218,6 +282,7 @@ class StudentView:
         gpa = self.analytics.calculate_gpa(self.username)
         grade_stats = self.analytics.get_grade_statistics(self.username)
         eca_summary = self.analytics.get_eca_summary(self.username)
+        ranks = self.analytics.get_class_rank(self.username)
         
         
         # Display statistics
@@ -234,6 +299,12 @@ Minimum: {grade_stats['min']}
 Maximum: {grade_stats['max']}
 Standard Deviation: {grade_stats['std_dev']}
 
+"""
+        
+        if ranks:
+            stats_text += f"""Class Rank:
+{format_ranks(ranks)}
+
 """
         
         if eca_summary:
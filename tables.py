@@ -0,0 +1,235 @@
+"""
+Shared helpers for reading the CSV tables in the data directory.
+"""
+import os
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+import metrics
+
+# Rows read per chunk when iterating over a table. Memory used by chunked
+# readers depends on this setting rather than on the size of the file.
+DEFAULT_CHUNK_ROWS = 100000
+
+# Column types used whenever a table is read. Identifiers and free text are
+# always read as strings so that values such as phone numbers and numeric
+# passwords keep their exact text.
+TEXT_SCHEMAS = {
+    'users': {'username': str, 'full_name': str, 'role': str, 'email': str,
+              'phone': str, 'address': str, 'department': str},
+    'passwords': {'username': str, 'password': str, 'role': str},
+    'grades': {'username': str},
+    'eca': {'username': str, 'activity': str, 'role': str, 'description': str}
+}
+
+# Compact column types for tables that are only read, e.g. kept resident for
+# analytics. Low-cardinality text becomes categorical and numbers use 32-bit
+# floats. Tables read this way must not be written back: categoricals reject
+# new values and float32 would change the stored grade text.
+COMPACT_SCHEMAS = {
+    'users': {'username': str, 'full_name': str, 'role': 'category', 'email': str,
+              'phone': str, 'address': str, 'department': 'category', 'level': str},
+    'passwords': {'username': str, 'password': str, 'role': 'category'},
+    # Every column other than username is a subject
+    'grades': defaultdict(lambda: 'float32', username=str),
+    'eca': {'username': str, 'activity': 'category', 'role': 'category',
+            'hours_per_week': 'float32', 'description': str}
+}
+
+# float32 holds grades up to 100 exactly to this many decimal places
+GRADE_DECIMALS = 4
+
+
+def table_name(path):
+    """Get the table name ('users', 'grades', ...) for a CSV path"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def table_dtypes(path, compact=False):
+    """Get the dtype mapping to pass to pd.read_csv for a table, or None if unknown"""
+    schemas = COMPACT_SCHEMAS if compact else TEXT_SCHEMAS
+    return schemas.get(table_name(path))
+
+
+def _compact_levels(df):
+    """Store level as a nullable 8-bit integer, or float32 if any level has a fraction"""
+    if 'level' in df.columns:
+        level = pd.to_numeric(df['level'], errors='coerce').astype('float32')
+        whole = level.dropna()
+        fits_int8 = (whole == whole.round()).all() and whole.between(-128, 127).all()
+        df['level'] = level.astype('Int8') if fits_int8 else level
+    return df
+
+
+def read_table(path, compact=False, **kwargs):
+    """
+    Read one of the data tables with its schema applied.
+    Args:
+        path: Path to users.csv, passwords.csv, grades.csv or eca.csv
+        compact: Use the memory-saving COMPACT_SCHEMAS (read-only use)
+        **kwargs: Passed on to pd.read_csv
+    """
+    df = pd.read_csv(path, dtype=table_dtypes(path, compact), **kwargs)
+    if metrics.is_enabled():
+        metrics.record_io(table_name(path), bytes_read=metrics.file_size(path), rows_read=len(df))
+    if compact:
+        df = _compact_levels(df)
+    return df
+
+
+def write_table(df, path, mode='w', header=True):
+    """
+    Write a data table (or append rows to it) as CSV without the index.
+    A replaced table is written to a temporary file first and renamed over
+    the old one, so a crash never leaves a truncated table.
+    Args:
+        df: Rows to write
+        path: Path to the CSV file
+        mode: 'w' to replace the file, 'a' to append
+        header: Whether to write the header row
+    """
+    size_before = metrics.file_size(path) if mode == 'a' and metrics.is_enabled() else 0
+    if mode == 'w':
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            df.to_csv(temporary, header=header, index=False)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    else:
+        df.to_csv(path, mode=mode, header=header, index=False)
+    if metrics.is_enabled():
+        metrics.record_io(table_name(path), bytes_written=metrics.file_size(path) - size_before,
+                          rows_written=len(df))
+
+
+def records_frame(file_or_records, columns):
+    """
+    Normalise bulk input to a DataFrame of stripped strings.
+    Args:
+        file_or_records: Path to a CSV file, a DataFrame, or an iterable of dictionaries
+        columns: Expected columns; missing ones are added as empty strings
+    """
+    if isinstance(file_or_records, pd.DataFrame):
+        batch = file_or_records.copy()
+    elif isinstance(file_or_records, (str, os.PathLike)):
+        batch = pd.read_csv(file_or_records, dtype=str, keep_default_na=False)
+    else:
+        batch = pd.DataFrame(list(file_or_records))
+        
+    batch = batch.reindex(columns=columns).reset_index(drop=True)
+    return batch.fillna('').astype(str).apply(lambda column: column.str.strip())
+
+
+def json_safe(value):
+    """Convert numpy/pandas values (including NaN and NA) into JSON-friendly Python values"""
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if value is pd.NA:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def grade_value(value):
+    """Convert a stored grade (possibly float32) to a Python float"""
+    return round(float(value), GRADE_DECIMALS)
+
+
+def group_label(value):
+    """A grouping value such as a department with its whitespace collapsed, or None when missing"""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    label = " ".join(str(value).split())
+    return label or None
+
+
+def group_key(value):
+    """
+    Key under which a grouping value is grouped, so 'Computer Science' and
+    ' computer  science' fall in the same group (None when missing)
+    """
+    label = group_label(value)
+    return None if label is None else label.casefold()
+
+
+def exact_hours(values):
+    """
+    Hours per week as float64 without the float32 noise of compact reads
+    (7.300000190734863 -> 7.3). Hours below 1000 are exact to GRADE_DECIMALS.
+    Args:
+        values: A Series of hours or a single value
+    """
+    if isinstance(values, pd.Series):
+        return pd.to_numeric(values, errors='coerce').astype(float).round(GRADE_DECIMALS)
+    return round(float(values), GRADE_DECIMALS)
+
+
+def eca_records(df):
+    """ECA rows as a list of dictionaries, with exact hours (see exact_hours)"""
+    if 'hours_per_week' in df.columns:
+        df = df.assign(hours_per_week=exact_hours(df['hours_per_week']))
+    return df.to_dict('records')
+
+
+def iter_csv_chunks(path, chunksize=None, **kwargs):
+    """
+    Read a CSV file in chunks of at most chunksize rows.
+    Args:
+        path: CSV file to read
+        chunksize: Rows per chunk (DEFAULT_CHUNK_ROWS if not given)
+        **kwargs: Passed on to pd.read_csv
+    Yields:
+        DataFrame chunks
+    """
+    if not os.path.exists(path):
+        return
+    # The file size is counted with the first chunk, rows as they are read
+    size = metrics.file_size(path)
+    with pd.read_csv(path, chunksize=chunksize or DEFAULT_CHUNK_ROWS, **kwargs) as reader:
+        for chunk in reader:
+            if metrics.is_enabled():
+                metrics.record_io(table_name(path), bytes_read=size, rows_read=len(chunk))
+                size = 0
+            yield chunk
+
+
+def merge_counts(total, counts):
+    """Merge a value_counts() Series into a running total"""
+    # Categorical indexes from different chunks do not align, so use plain values
+    counts = pd.Series(counts.to_numpy(), index=counts.index.to_numpy())
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0)
+
+
+def count_stats(counts):
+    """
+    Compute count, mean, median and population standard deviation from value counts.
+    Returns:
+        Dictionary with 'count', 'mean', 'median' and 'std_dev' (None values when empty)
+    """
+    if counts is None or counts.sum() == 0:
+        return {'count': 0, 'mean': None, 'median': None, 'std_dev': None}
+
+    counts = counts[counts > 0].sort_index()
+    values = counts.index.to_numpy(dtype=float)
+    weights = counts.to_numpy(dtype=float)
+    n = int(weights.sum())
+
+    mean = float((values * weights).sum() / n)
+    std_dev = float(((values - mean) ** 2 * weights).sum() / n) ** 0.5
+
+    # Median: middle value, or the average of the two middle values
+    cumulative = weights.cumsum()
+    lower = values[cumulative.searchsorted((n - 1) // 2, side='right')]
+    upper = values[cumulative.searchsorted(n // 2, side='right')]
+    median = float((lower + upper) / 2)
+
+    return {'count': n, 'mean': mean, 'median': median, 'std_dev': std_dev}
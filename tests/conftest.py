@@ -0,0 +1,46 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def _reset_module_state():
+    """Forget per-process state tied to the previous test's data directory"""
+    for name, reset in (
+        ('wal', lambda module: (module._log.close() if module._log else None, setattr(module, '_log', None),
+                                os.close(module._lock_fd) if module._lock_fd is not None else None,
+                                setattr(module, '_lock_fd', None))),
+        ('sparse_grades', lambda module: module._cache.clear()),
+        ('audit', lambda module: (module._current_cache.clear(), module._segment_cache.clear(),
+                                  module._current_counts.clear(),
+                                  module.set_actor(None))),
+        ('shards', lambda module: ([store.wait() for store in module._stores.values()],
+                                   module._stores.clear(), module._results.clear())),
+    ):
+        if name in sys.modules:
+            reset(sys.modules[name])
+    for name, attribute in (('ranking', '_ranking'), ('rollups', '_cube')):
+        module = sys.modules.get(name)
+        if module is not None and getattr(module, attribute) is not None:
+            getattr(module, attribute).close()
+            setattr(module, attribute, None)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty directory; the modules use the relative data/ paths"""
+    monkeypatch.chdir(tmp_path)
+    _reset_module_state()
+    yield tmp_path
+    _reset_module_state()
+
+
+@pytest.fixture
+def data_dir(workdir):
+    """A data directory with the default admin and sample student"""
+    import auth
+    auth.initialize_data_files()
+    return workdir / "data"
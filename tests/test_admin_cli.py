@@ -0,0 +1,61 @@
+import io
+import json
+import sys
+
+import admin_cli
+from auth import authenticate
+
+
+def run(capsys, *argv):
+    code = admin_cli.main(list(argv))
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_add_user_reads_password_from_stdin(data_dir, capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO("s3cretpw\n"))
+    code, result = run(capsys, 'add-user', 'alice', 'Alice A', 'student', '--password-stdin')
+    assert code == 0 and result['success']
+    assert authenticate('alice', 's3cretpw') is not None
+
+
+def test_add_user_asks_for_password(data_dir, capsys, monkeypatch):
+    monkeypatch.setattr(admin_cli.getpass, 'getpass', lambda prompt='': "typedpw1")
+    code, result = run(capsys, 'add-user', 'bob', 'Bob B', 'student')
+    assert code == 0
+    assert authenticate('bob', 'typedpw1') is not None
+
+
+def test_failure_reports_the_underlying_error(data_dir, capsys):
+    code, result = run(capsys, 'add-grade', 'nobody', 'Math', '90')
+    assert code == 1
+    assert not result['success']
+    assert result['message'] == "Student with username 'nobody' not found"
+
+
+def test_result_keeps_tuple_messages():
+    assert admin_cli._result((False, "Bad grade"), "ok") == {'success': False, 'message': "Bad grade"}
+    assert admin_cli._result(True, "Done", ["noise"]) == {'success': True, 'message': "Done"}
+    assert admin_cli._result(False, "Done", ["Error: disk full"])['message'] == "Error: disk full"
+
+
+def test_only_writing_commands_recover(data_dir, capsys, monkeypatch):
+    import wal
+    recovered = []
+    monkeypatch.setattr(wal, 'recover', lambda: recovered.append(True) or 0)
+    for argv in (['stats'], ['audit'], ['snapshot', '--list'], ['list-users'], ['check']):
+        run(capsys, *argv)
+    assert recovered == []
+    run(capsys, 'add-grade', 'nobody', 'Math', '90')
+    assert recovered == [True]
+
+
+def test_restore_accepts_epoch_seconds(data_dir, capsys):
+    code, taken = run(capsys, 'snapshot')
+    assert code == 0
+    code, listed = run(capsys, 'snapshot', '--list')
+    moment = listed['snapshots'][0]['time']
+    code, result = run(capsys, 'restore', str(moment))
+    assert code == 0, result
+    assert result['message'] == f"Restored snapshot {taken['id']}"
+    code, result = run(capsys, 'restore', str(moment - 3600))
+    assert code == 1
@@ -0,0 +1,89 @@
+import json
+import asyncio
+import pytest
+import admin
+import student
+from api_server import APIServer
+
+
+@pytest.fixture
+def server(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 80)
+    return APIServer()
+
+
+def request(server, method, path, body=None, token=None):
+    headers = {'authorization': f"Bearer {token}"} if token else {}
+    data = json.dumps(body).encode() if body is not None else b''
+    return asyncio.run(server.dispatch(method, path, data, headers))
+
+
+def login(server, username, password):
+    status, payload = request(server, 'POST', '/login', {'username': username, 'password': password})
+    assert status == 200
+    return payload['token']
+
+
+def test_student_routes_need_a_token(server):
+    assert request(server, 'GET', '/students/alice/grades')[0] == 401
+    assert request(server, 'GET', '/students/alice/grades', token='made-up')[0] == 401
+
+
+def test_students_only_read_their_own_record(server):
+    token = login(server, 'alice', 'alicepw1')
+    status, grades = request(server, 'GET', '/students/alice/grades', token=token)
+    assert status == 200
+    assert {'subject': 'Math', 'grade': 80.0} in grades
+    assert request(server, 'GET', '/students/bob/grades', token=token)[0] == 403
+    assert request(server, 'GET', '/students/bob/eca', token=token)[0] == 403
+
+
+def test_admins_read_any_record(server):
+    token = login(server, 'admin', 'password')
+    assert request(server, 'GET', '/students/alice/grades', token=token)[0] == 200
+    assert request(server, 'GET', '/students/bob/eca', token=token)[0] == 200
+
+
+def test_wrong_password_and_logout(server):
+    assert request(server, 'POST', '/login', {'username': 'alice', 'password': 'nope'})[0] == 401
+    token = login(server, 'alice', 'alicepw1')
+    assert request(server, 'POST', '/logout', token=token)[0] == 200
+    assert request(server, 'GET', '/students/alice/grades', token=token)[0] == 401
+
+
+def test_expired_tokens_are_rejected(server):
+    token = login(server, 'alice', 'alicepw1')
+    username, role, _ = server.tokens[token]
+    server.tokens[token] = (username, role, 0)
+    assert request(server, 'GET', '/students/alice/grades', token=token)[0] == 401
+    assert token not in server.tokens
+
+
+def raw_request(server, data):
+    """Send raw bytes to a running server and return the status of the response"""
+    async def exchange():
+        listener = await asyncio.start_server(server.handle_connection, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(data)
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            return int(status_line.split()[1])
+    return asyncio.run(exchange())
+
+
+def test_content_length_is_checked(server):
+    assert raw_request(server, b"POST /login HTTP/1.1\r\nContent-Length: abc\r\n\r\n") == 400
+    assert raw_request(server, b"POST /login HTTP/1.1\r\nContent-Length: -5\r\n\r\n") == 400
+    assert raw_request(server, b"POST /login HTTP/1.1\r\nContent-Length: 999999999\r\n\r\n") == 413
+    body = json.dumps({'username': 'alice', 'password': 'alicepw1'}).encode()
+    assert raw_request(server, b"POST /login HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)) == 200
+
+
+def test_overall_statistics(server):
+    status, stats = request(server, 'GET', '/stats/overall')
+    assert status == 200 and stats
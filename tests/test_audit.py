@@ -0,0 +1,137 @@
+import os
+import sys
+import fcntl
+import threading
+import subprocess
+
+import admin
+import audit
+import student
+import wal
+from tables import read_table, write_table
+
+
+def _add_alice():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+
+
+def _grade_entries(username):
+    return audit.query(key=username, table='grades')
+
+
+def test_each_thread_records_its_own_actor(data_dir):
+    _add_alice()
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department='IT', level='1')
+    barrier = threading.Barrier(2)
+
+    def change(actor, username, grade):
+        with audit.acting_as(actor):
+            barrier.wait()
+            student.add_student_grade(username, 'Math', grade)
+
+    threads = [threading.Thread(target=change, args=('teacher1', 'alice', 70)),
+               threading.Thread(target=change, args=('teacher2', 'bob', 80))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert list(_grade_entries('alice')[0]['actor']) == ['teacher1']
+    assert list(_grade_entries('bob')[0]['actor']) == ['teacher2']
+    # Outside acting_as the process default is used
+    assert audit.get_actor() == audit.DEFAULT_ACTOR
+
+
+def test_entries_of_a_crash_after_the_table_write_are_recovered_once(data_dir):
+    _add_alice()
+    log = wal.get_log()
+    call_id = log.new_id()
+    log.append({'id': call_id, 'op': 'student.add_student_grade', 'args': ['alice', 'Math', 75],
+                'kwargs': {}, 'actor': 'teacher1'})
+    log.append({'start': call_id, 'files': wal._file_states()})
+    # The call staged its entry and wrote the table, then the process died
+    entry = ('{"time":1.0,"actor":"teacher1","table":"grades","key":"alice","field":"Math",'
+             '"old":null,"new":75.0}\n')
+    log.append({'audit': call_id, 'table': 'grades', 'entries': entry})
+    grades = read_table("data/grades.csv")
+    grades['Math'] = grades['Math'].astype(float)
+    grades.loc[grades['username'] == 'alice', 'Math'] = 75.0
+    write_table(grades, "data/grades.csv")
+
+    assert wal.recover() == 1
+    entries, total = _grade_entries('alice')
+    assert total == 1
+    assert entries.iloc[0]['actor'] == 'teacher1' and entries.iloc[0]['new'] == 75.0
+
+
+def test_replay_of_a_call_that_wrote_nothing_records_it(data_dir):
+    _add_alice()
+    log = wal.get_log()
+    call_id = log.new_id()
+    log.append({'id': call_id, 'op': 'student.add_student_grade', 'args': ['alice', 'Math', 75],
+                'kwargs': {}, 'actor': 'teacher1'})
+    log.append({'start': call_id, 'files': wal._file_states()})
+
+    assert wal.recover() == 1
+    entries, total = _grade_entries('alice')
+    assert total == 1 and entries.iloc[0]['actor'] == 'teacher1'
+
+
+def test_failed_write_records_nothing(data_dir, monkeypatch):
+    _add_alice()
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(student, 'write_table', fail)
+    assert not student.add_student_grade('alice', 'Math', 75)
+    assert _grade_entries('alice')[1] == 0
+
+
+def test_appends_seal_without_parsing_the_current_file(workdir, monkeypatch):
+    monkeypatch.setattr(audit, 'SEGMENT_ROWS', 3)
+
+    def no_parse(path):
+        raise AssertionError("the current file was parsed")
+
+    read_current = audit._read_current
+    monkeypatch.setattr(audit, '_read_current', no_parse)
+    for grade in range(4):
+        audit.record('grades', 'alice', [('Math', None, float(grade))])
+    monkeypatch.setattr(audit, '_read_current', read_current)
+
+    assert len(os.listdir("data/audit/segments")) == 1
+    entries, total = audit.query(key='alice')
+    assert total == 4
+    assert sorted(entries['new']) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_processes_append_and_seal_one_at_a_time(workdir):
+    audit.record('grades', 'alice', [('Math', None, 1.0)])
+    fd = os.open(os.path.join(audit.AUDIT_DIR, audit.LOCK_NAME), os.O_RDWR | os.O_CREAT)
+    # Another process holds the lock, e.g. while it seals the current file
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    writer = threading.Thread(target=audit.record, args=('grades', 'alice', [('Math', 1.0, 2.0)]))
+    writer.start()
+    writer.join(0.5)
+    assert writer.is_alive()
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+    writer.join()
+    assert audit.query(key='alice')[1] == 2
+
+
+def test_concurrent_processes_seal_distinct_segments(workdir):
+    script = (
+        "import audit\n"
+        "audit.SEGMENT_ROWS = 5\n"
+        "for grade in range(40):\n"
+        "    audit.record('grades', 'student', [('Math', None, float(grade))])\n"
+    )
+    environment = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+    processes = [subprocess.Popen([sys.executable, "-c", script], env=environment) for _ in range(3)]
+    assert [process.wait() for process in processes] == [0, 0, 0]
+
+    assert audit.query(key='student')[1] == 120
+    numbers = [segment['number'] for segment in audit._load_catalog(audit._paths(audit.AUDIT_DIR))]
+    assert len(numbers) == len(set(numbers))
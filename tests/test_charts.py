@@ -0,0 +1,14 @@
+import os
+
+from mat import StudentAnalytics
+
+
+def test_old_charts_of_the_configured_format_are_removed(workdir):
+    charts = workdir / "charts"
+    charts.mkdir()
+    (charts / "grades_old.pdf").write_bytes(b"old")
+    (charts / "notes.txt").write_text("keep")
+    analytics = StudentAnalytics(charts_dir=str(charts), chart_format='pdf')
+    path = analytics.create_grades_chart([{'subject': 'Math', 'grade': 80.0}], 'alice')
+    assert path and path.endswith(".pdf") and os.path.exists(path)
+    assert sorted(os.listdir(charts)) == ["grades_alice.pdf", "notes.txt"]
@@ -0,0 +1,37 @@
+import admin
+import auth
+import student
+from mat import StudentAnalytics
+from tables import exact_hours
+
+
+def _student_with_activities():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    assert student.add_student_eca('alice', 'Chess', 'Member', 7.3)
+    assert student.add_student_eca('alice', 'Drama', 'Lead', 6.0)
+
+
+def test_per_user_reads_return_the_hours_entered(data_dir):
+    _student_with_activities()
+    hours = {record['activity']: record['hours_per_week'] for record in student.get_student_eca('alice')}
+    assert hours == {'Chess': 7.3, 'Drama': 6.0}
+
+    session = auth.authenticate('alice', 'alicepw1')
+    assert sorted(record['hours_per_week'] for record in session.eca) == [6.0, 7.3]
+    assert session.eca_summary()['total_hours'] == 13.3
+
+
+def test_summaries_have_exact_totals(data_dir):
+    _student_with_activities()
+    analytics = StudentAnalytics()
+    summary = analytics.get_eca_summary('alice')
+    assert summary['total_hours'] == 13.3
+    assert {record['hours_per_week'] for record in summary['activities']} == {7.3, 6.0}
+    assert analytics.get_overall_statistics()['total_hours'] == 13.3
+
+
+def test_exact_hours():
+    import numpy as np
+    import pandas as pd
+    assert exact_hours(np.float32(7.3)) == 7.3
+    assert exact_hours(pd.Series([np.float32(2.1), None])).tolist()[0] == 2.1
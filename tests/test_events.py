@@ -0,0 +1,40 @@
+import json
+import os
+import events
+
+
+def _append_foreign_event(path, username):
+    """Write an event as another process would"""
+    event = events.Event(events.GRADE_CHANGED, username, {'subject': 'Math', 'grade': 1.0}, pid=os.getpid() + 1)
+    with open(path, 'a') as f:
+        f.write(json.dumps(event.to_dict()) + "\n")
+
+
+def test_watchers_in_one_process_dispatch_each_event_once(workdir):
+    path = str(workdir / "events.log")
+    open(path, 'w').close()
+    received = []
+    unsubscribe = events.subscribe(events.GRADE_CHANGED, received.append)
+    try:
+        first, second = events.EventLogWatcher(path), events.EventLogWatcher(path)
+        _append_foreign_event(path, 'student1')
+        first.poll()
+        second.poll()
+        _append_foreign_event(path, 'student2')
+        second.poll()
+        first.poll()
+        assert [event.username for event in received] == ['student1', 'student2']
+    finally:
+        unsubscribe()
+
+
+def test_own_events_and_partial_lines_are_skipped(workdir):
+    path = str(workdir / "events.log")
+    open(path, 'w').close()
+    watcher = events.EventLogWatcher(path)
+    own = events.Event(events.GRADE_CHANGED, 'me', {})
+    with open(path, 'a') as f:
+        f.write(json.dumps(own.to_dict()) + "\n")
+        f.write('{"type": "grade_changed"')
+    assert watcher.poll() == []
+    assert watcher.offset == len(json.dumps(own.to_dict())) + 1
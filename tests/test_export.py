@@ -0,0 +1,50 @@
+import json
+
+import admin
+import export
+import student
+from tables import read_table
+
+
+def _add_students():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='Computer Science', level='1')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department=' computer  science', level='2')
+    admin.add_user('carol', 'Carol C', 'carolpw1', 'student', level='1')
+    for username, grade in (('alice', 70), ('bob', 80), ('carol', 90)):
+        student.add_student_grade(username, 'Math', grade)
+
+
+def test_department_filter_groups_spellings_and_skips_missing(data_dir):
+    _add_students()
+    usernames = export._matching_usernames("data/users.csv", department='COMPUTER SCIENCE')
+    assert usernames == {'alice', 'bob'}
+    assert export._matching_usernames("data/users.csv", department='nan') == set()
+
+
+def test_exports_are_filtered_by_user(data_dir):
+    _add_students()
+    success, message = export.export_table('grades', "grades_level1.csv", level=1)
+    assert success, message
+    assert sorted(read_table("grades_level1.csv")['username']) == ['alice', 'carol']
+
+    success, message = export.export_table('users', "cs.csv", department='computer science')
+    assert success, message
+    assert sorted(read_table("cs.csv")['username']) == ['alice', 'bob']
+
+
+def test_output_is_streamed_in_chunks(data_dir):
+    _add_students()
+    chunks = list(export.iter_table_chunks('grades', subjects=['Math'], chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(chunks[0].columns) == ['username', 'Math']
+
+    success, message = export.export_table('grades', "grades.jsonl", format='jsonl', chunksize=1,
+                                           subjects=['Math'])
+    assert success, message
+    with open("grades.jsonl") as f:
+        rows = [json.loads(line) for line in f]
+    assert {row['username']: row['Math'] for row in rows} == {'alice': 70.0, 'bob': 80.0, 'carol': 90.0}
+
+
+def test_unknown_format(data_dir):
+    assert not export.export_table('grades', "out.txt", format='txt')[0]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import admin
+import grading
+import student
+from mat import StudentAnalytics
+from sparse_grades import SparseMatrix
+
+
+def test_band_edges_are_inclusive():
+    scale = grading.get_scale('letter_simple')
+    values = [100, 90, 89.99, 80, 60, 59.5, 0, np.nan]
+    assert list(scale.to_letters(values)) == ['A', 'A', 'B', 'B', 'D', 'F', 'F', None]
+    points = scale.to_points(values)
+    assert points[:7].tolist() == [4.0, 4.0, 3.0, 3.0, 1.0, 0.0, 0.0]
+    assert np.isnan(points[7])
+
+
+def test_percentage_scale_keeps_the_original_conversion():
+    scale = grading.get_scale('percentage')
+    assert scale.to_points([100, 50]).tolist() == [4.0, 2.0]
+    assert list(scale.to_letters([100])) == [None]
+
+
+def test_grades_below_the_lowest_band_have_no_points():
+    scale = grading.GradingScale('pass_only', [(50, 'P', 4.0)])
+    assert np.isnan(scale.to_points([49])[0])
+    assert scale.to_letters([49, 50]).tolist() == [None, 'P']
+
+
+def test_credit_weighted_gpa(workdir):
+    settings = {'scale': 'letter_simple', 'credits': {'Math': 3}, 'scales': {}}
+    # Math A (4.0) counts three times, Art C (2.0) once
+    assert grading.student_gpa({'Math': 95, 'Art': 75}, settings=settings) == 3.5
+    assert grading.student_gpa({}, settings=settings) is None
+
+
+def test_batch_gpa_matches_student_gpa(workdir):
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 100, size=(40, 4)).astype(np.float32)
+    values[rng.random(values.shape) < 0.4] = np.nan
+    values[3] = np.nan
+    subjects = ['Math', 'Art', 'Physics', 'English']
+    names = np.array([f"s{i}" for i in range(40)], dtype=object)
+    settings = {'scale': 'letter_4', 'credits': {'Math': 4, 'Art': 0.5}, 'scales': {}}
+
+    gpas = grading.batch_gpa(SparseMatrix.from_dense(values, names, subjects), settings=settings)
+    for i, name in enumerate(names):
+        expected = grading.student_gpa(dict(zip(subjects, values[i])), settings=settings)
+        if expected is None:
+            assert np.isnan(gpas[name])
+        else:
+            assert round(float(gpas[name]), 2) == expected
+
+
+def test_settings_and_custom_scales(data_dir):
+    assert grading.set_scale('no_such_scale')[0] is False
+    assert grading.set_credits({'Math': -1})[0] is False
+
+    settings = grading.load_settings()
+    settings['scales']['pass_fail'] = [{'min': 50, 'letter': 'P', 'points': 4},
+                                       {'min': 0, 'letter': 'F', 'points': 0}]
+    grading.save_settings(settings)
+    assert 'pass_fail' in grading.scale_names()
+    assert grading.set_scale('pass_fail')[0]
+    assert grading.set_credits({'Math': 2, 'Art': 1})[0]
+    assert grading.load_settings()['credits'] == {'Math': 2.0}
+
+
+def test_switching_scales_changes_every_gpa(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 85)
+    student.add_student_grade('alice', 'Physics', 45)
+    analytics = StudentAnalytics()
+
+    assert analytics.calculate_gpa('alice') == pytest.approx((85 + 45) / 2 / 25, abs=0.01)
+    grading.set_scale('uk_honours')
+    assert analytics.calculate_gpa('alice') == 3.0
+    assert analytics.get_all_gpas()['alice'] == pytest.approx(3.0)
@@ -0,0 +1,68 @@
+import admin
+import student
+from tables import read_table
+
+
+def _grades():
+    return read_table("data/grades.csv")
+
+
+def test_import_users_adds_valid_rows_and_reports_the_rest(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    success, message, rejected = admin.import_users([
+        {'username': 'bob', 'full_name': 'Bob B', 'password': 'bobpw123', 'role': 'student', 'level': '2'},
+        {'username': 'bob', 'full_name': 'Bob Again', 'password': 'x', 'role': 'student'},
+        {'username': 'alice', 'full_name': 'Alice Again', 'password': 'x', 'role': 'student'},
+        {'username': 'carol', 'full_name': 'Carol C', 'password': 'carolpw1', 'role': 'teacher'},
+        {'username': 'dave', 'full_name': 'Dave D', 'password': 'davepw12', 'role': 'student', 'level': '9'},
+    ])
+    assert success, message
+    assert [(error['username'], error['error']) for error in rejected] == [
+        ('bob', "Duplicate username in import"),
+        ('alice', "Username already exists"),
+        ('carol', "Role must be either 'admin' or 'student'"),
+        ('dave', "Level must be a number between 0 and 4"),
+    ]
+    users = read_table("data/users.csv").set_index('username')
+    assert users.loc['bob', 'full_name'] == 'Bob B'
+    assert 'carol' not in users.index
+    passwords = read_table("data/passwords.csv").set_index('username')
+    assert passwords.loc['bob', 'password'] == 'bobpw123'
+
+
+def test_import_users_with_nothing_valid(data_dir):
+    success, message, rejected = admin.import_users([{'username': 'x', 'full_name': '', 'password': '',
+                                                       'role': 'student'}])
+    assert not success and len(rejected) == 1
+
+
+def test_import_grades_updates_and_adds(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 50)
+    success, message, rejected = student.import_grades([
+        {'username': 'alice', 'subject': 'Math', 'grade': '60'},
+        {'username': 'alice', 'subject': 'Math', 'grade': '65'},
+        {'username': 'bob', 'subject': 'Art', 'grade': '90'},
+        {'username': 'nobody', 'subject': 'Math', 'grade': '70'},
+        {'username': 'bob', 'subject': 'Math', 'grade': '101'},
+    ])
+    assert success, message
+    assert [error['error'] for error in rejected] == ["Student not found", "Grade must be between 0 and 100"]
+    grades = _grades().set_index('username')
+    assert grades.loc['alice', 'Math'] == 65
+    assert grades.loc['bob', 'Art'] == 90
+
+
+def test_import_grades_with_a_repeated_student_in_the_table(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 50)
+    with open("data/grades.csv", 'a') as f:
+        f.write("alice,,40,,,\n")
+    success, message, _ = student.import_grades([{'username': 'alice', 'subject': 'Math', 'grade': '70'}])
+    assert success, message
+    rows = _grades()
+    alice = rows[rows['username'] == 'alice']
+    # The first row holds the student's grades; the repeated row is left for repair
+    assert list(alice['Math']) == [70, 40]
+    assert {'subject': 'Math', 'grade': 70.0} in student.get_student_grades('alice')
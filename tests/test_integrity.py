@@ -0,0 +1,152 @@
+import os
+
+import pandas as pd
+
+import audit
+import events
+import integrity
+import wal
+from tables import read_table
+
+
+def _write_tables(data):
+    data.mkdir(exist_ok=True)
+    pd.DataFrame([
+        ['admin', 'Admin', 'admin', '', '', '', '', ''],
+        ['alice', 'Alice A', 'student', '', '', '', 'IT', '2'],
+        ['alice', 'Alice again', 'student', '', '', '', 'IT', '1'],
+        ['bob', 'Bob B', 'student', '', '', '', 'IT', '9'],
+        ['ghost', 'No Password', 'student', '', '', '', 'IT', '1'],
+    ], columns=integrity.USER_COLUMNS).to_csv(data / "users.csv", index=False)
+    pd.DataFrame([
+        ['admin', 'password', 'admin'],
+        ['alice', 'alicepw1', 'student'],
+        ['bob', 'bobpw123', 'admin'],
+        ['carol', 'carolpw1', 'student'],
+    ], columns=integrity.PASSWORD_COLUMNS).to_csv(data / "passwords.csv", index=False)
+    pd.DataFrame({'username': ['alice', 'bob', 'admin', 'carol'], 'Math': ['80', 'abc', '70', '60'],
+                  'Art': ['101', '55', None, None]}).to_csv(data / "grades.csv", index=False)
+    pd.DataFrame([
+        ['alice', 'Chess', 'Member', 3, ''],
+        ['alice', 'Chess', 'Captain', 4, ''],
+        ['bob', 'Drama', 'Lead', -2, ''],
+        ['carol', 'Choir', 'Member', 1, ''],
+    ], columns=integrity.ECA_COLUMNS).to_csv(data / "eca.csv", index=False)
+
+
+def _checks(issues, table):
+    return sorted(issues.loc[issues['table'] == table, 'check'])
+
+
+def test_check_finds_each_problem_once(workdir):
+    _write_tables(workdir / "data")
+    issues = integrity.check()
+    assert _checks(issues, 'users') == ['duplicate_user', 'invalid_level', 'missing_password']
+    assert _checks(issues, 'passwords') == ['orphan', 'role_mismatch']
+    assert _checks(issues, 'grades') == ['invalid_grade', 'invalid_grade', 'not_a_student', 'orphan']
+    assert _checks(issues, 'eca') == ['duplicate_activity', 'invalid_hours', 'orphan']
+    invalid = issues[issues['check'] == 'invalid_grade'].set_index('username')['field'].to_dict()
+    assert invalid == {'alice': 'Art', 'bob': 'Math'}
+
+
+def test_repair_leaves_consistent_tables(workdir):
+    _write_tables(workdir / "data")
+    removed, grades_cleared = [], []
+    unsubscribe = [events.subscribe(events.USER_REMOVED, lambda event: removed.append(event.username)),
+                   events.subscribe(events.GRADE_CHANGED, lambda event: grades_cleared.append(
+                       (event.username, event.data['subject'])))]
+    try:
+        success, message, issues = integrity.repair()
+    finally:
+        for remove in unsubscribe:
+            remove()
+    assert success, message
+    assert sorted(removed) == ['carol', 'ghost']
+    # Numeric grades that disappeared are announced; bob's 'abc' never was a grade
+    assert sorted(grades_cleared) == [('admin', 'Math'), ('alice', 'Art')]
+
+    remaining = integrity.check()
+    assert remaining.empty or remaining['repair'].isna().all()
+
+    users = read_table("data/users.csv")
+    assert sorted(users['username']) == ['admin', 'alice', 'bob']
+    assert users.set_index('username').loc['alice', 'full_name'] == 'Alice A'
+    assert pd.isna(users.set_index('username').loc['bob', 'level'])
+    assert read_table("data/passwords.csv").set_index('username').loc['bob', 'role'] == 'student'
+
+    grades = read_table("data/grades.csv").set_index('username')
+    assert sorted(grades.index) == ['alice', 'bob']
+    assert pd.isna(grades.loc['alice', 'Art']) and pd.isna(grades.loc['bob', 'Math'])
+    assert grades.loc['alice', 'Math'] == 80
+
+    eca = read_table("data/eca.csv")
+    assert eca[['username', 'activity', 'role']].values.tolist() == [['alice', 'Chess', 'Member']]
+    assert not (workdir / "data" / ".repair").exists()
+
+
+def test_repair_of_clean_tables_changes_nothing(data_dir):
+    before = {name: (data_dir / f"{name}.csv").read_bytes() for name in integrity.TABLES}
+    success, message, issues = integrity.repair()
+    assert success and issues.empty
+    assert {name: (data_dir / f"{name}.csv").read_bytes() for name in integrity.TABLES} == before
+
+
+def test_repair_records_removed_users_and_cleared_grades(workdir):
+    _write_tables(workdir / "data")
+    success, message, issues = integrity.repair()
+    assert success, message
+
+    entries, total = audit.query(table='users', limit=100)
+    removed = entries[entries['key'] == 'ghost']
+    assert removed['new'].isna().all()
+    assert set(removed['field']) >= {'full_name', 'role', 'department'}
+    assert entries.loc[(entries['key'] == 'bob') & (entries['field'] == 'level'), 'old'].tolist() == [9]
+
+    grades, _ = audit.query(table='grades', limit=100)
+    changes = {(key, field): old for key, field, old in grades[['key', 'field', 'old']].itertuples(index=False)}
+    # Rows of users without grades rights, and cleared cells (Math holds text, so its values are strings)
+    assert changes == {('carol', 'Math'): '60', ('admin', 'Math'): '70', ('alice', 'Art'): 101,
+                       ('bob', 'Math'): 'abc'}
+
+
+def test_recovery_finishes_an_interrupted_repair(workdir, monkeypatch):
+    _write_tables(workdir / "data")
+
+    def crash(data_dir="data"):
+        if not os.path.exists(os.path.join(data_dir, ".repair", "manifest.json")):
+            return None
+        # The process dies after moving the first table into place
+        os.replace(os.path.join(data_dir, ".repair", "users.csv"), os.path.join(data_dir, "users.csv"))
+        raise OSError("killed")
+
+    finish_repair = integrity.finish_repair
+    monkeypatch.setattr(integrity, 'finish_repair', crash)
+    success, message, issues = integrity.repair()
+    assert not success
+    assert sorted(read_table("data/users.csv")['username']) == ['admin', 'alice', 'bob']
+    assert 'carol' in set(read_table("data/grades.csv")['username'])
+    monkeypatch.setattr(integrity, 'finish_repair', finish_repair)
+
+    wal.recover()
+    assert not (workdir / "data" / ".repair").exists()
+    assert sorted(read_table("data/grades.csv")['username']) == ['alice', 'bob']
+    remaining = integrity.check()
+    assert remaining.empty or remaining['repair'].isna().all()
+    # The entries of the users table were recorded once, with the others
+    assert audit.query(key='ghost', table='users')[1] == len(audit.query(key='ghost', table='users')[0])
+    assert audit.query(key='carol', table='grades')[1] == 1
+
+
+def test_recovery_leaves_tables_changed_after_the_repair(workdir, monkeypatch):
+    _write_tables(workdir / "data")
+    monkeypatch.setattr(integrity, 'finish_repair', lambda data_dir="data": None)
+    assert integrity.repair()[0]
+    monkeypatch.undo()
+    os.chdir(workdir)
+    # A change made before recovery ran must not be overwritten with the repair's copy
+    pd.DataFrame({'username': ['alice'], 'Math': [90]}).to_csv("data/grades.csv", index=False)
+
+    wal.recover()
+    assert read_table("data/grades.csv")['username'].tolist() == ['alice']
+    assert sorted(read_table("data/users.csv")['username']) == ['admin', 'alice', 'bob']
+    assert audit.query(table='grades')[1] == 0
@@ -0,0 +1,29 @@
+import admin
+import student
+from ranking import get_ranking
+from tables import read_table, write_table
+
+
+def _add_students():
+    for username, grade in (('alice', 70), ('bob', 80)):
+        admin.add_user(username, username.title(), f"{username}pw12", 'student', department='IT', level='1')
+        student.add_student_grade(username, 'Math', grade)
+
+
+def test_own_writes_keep_the_indexes_current(data_dir):
+    _add_students()
+    ranking = get_ranking()
+    student.add_student_grade('alice', 'Math', 90)
+    assert ranking.is_current()
+    assert get_ranking().rank('alice', 'Math')['rank'] == 1
+
+
+def test_changes_without_events_rebuild_the_indexes(data_dir):
+    _add_students()
+    assert get_ranking().rank('alice', 'Math')['rank'] == 2
+    # As a snapshot restore or another process would change the table
+    grades = read_table("data/grades.csv")
+    grades.loc[grades['username'] == 'alice', 'Math'] = 95.0
+    write_table(grades, "data/grades.csv")
+    assert get_ranking().rank('alice', 'Math')['rank'] == 1
+    assert get_ranking().top(1, 'Math') == [('alice', 95.0)]
@@ -0,0 +1,10 @@
+import admin
+import reports
+
+
+def test_departments_match_as_grouped_elsewhere(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='Computer Science', level='1')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department=' computer  science', level='1')
+    admin.add_user('carol', 'Carol C', 'carolpw1', 'student', level='1')
+    assert sorted(reports.load_cohort('COMPUTER SCIENCE')['usernames']) == ['alice', 'bob']
+    assert reports.load_cohort('nan')['usernames'] == []
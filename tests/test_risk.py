@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import admin
+import risk
+import student
+from sparse_grades import SparseMatrix
+
+
+def test_grade_features_match_the_dense_table():
+    rng = np.random.default_rng(0)
+    values = rng.uniform(0, 100, size=(200, 6)).round(1).astype(np.float32)
+    values[rng.random(values.shape) < 0.6] = np.nan
+    values[5] = np.nan
+    names = [f"s{i}" for i in range(200)]
+    matrix = SparseMatrix.from_dense(values, np.array(names, dtype=object), list('ABCDEF'))
+
+    features = risk._grade_features(matrix)
+    dense = pd.DataFrame(values.astype(float).round(4), index=names)
+    assert np.allclose(features['mean_grade'], dense.mean(axis=1), equal_nan=True)
+    assert np.allclose(features['min_grade'], dense.min(axis=1), equal_nan=True)
+    assert (features['grades_count'].to_numpy() == dense.notna().sum(axis=1).to_numpy()).all()
+    assert (features['failing_subjects'].to_numpy() == (dense < risk.PASS_MARK).sum(axis=1).to_numpy()).all()
+    assert np.isnan(features.loc['s5', 'mean_grade']) and features.loc['s5', 'grades_count'] == 0
+
+
+def test_build_features_from_the_tables(data_dir):
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='2')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 30)
+    student.add_student_grade('alice', 'Art', 72.3)
+    student.add_student_eca('alice', 'Chess', 'Member', 7.3)
+    student.add_student_eca('alice', 'Drama', 'Lead', 6.0)
+
+    features = risk.build_features()
+    alice = features.loc['alice']
+    assert alice['eca_hours'] == 13.3
+    assert alice['max_eca_hours'] == 7.3
+    assert alice['min_grade'] == 30.0
+    assert alice['mean_grade'] == (30 + 72.3) / 2
+    assert alice['failing_subjects'] == 1
+    assert features.loc['bob', 'grades_count'] == 0
+
+    ranked = risk.score_features(features)
+    assert list(ranked['username'][:2]) == ['alice', 'bob']
@@ -0,0 +1,54 @@
+import admin
+import student
+from rollups import RollupCube, get_cube
+from tables import read_table, write_table
+
+
+def _cells(cube):
+    return cube.grade_cells, cube.eca_cells, cube.student_counts
+
+
+def _add_students():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 70)
+
+
+def test_repeated_activities_agree_with_incremental_updates(data_dir):
+    _add_students()
+    with open("data/eca.csv", 'a') as f:
+        f.write("alice,Drama,member,3,\nalice,Drama,member,5,\n")
+    cube = RollupCube()
+    cube.build()
+    assert cube.eca_cells[('it', 1.0)][:2] == [1, 5.0]
+    cube.subscribe()
+    try:
+        student.add_student_eca('alice', 'Chess', 'member', 2)
+        fresh = RollupCube()
+        fresh.build()
+        assert cube.eca_cells == fresh.eca_cells
+    finally:
+        cube.close()
+
+
+def test_own_writes_keep_the_cube_current(data_dir):
+    _add_students()
+    cube = get_cube()
+    student.add_student_grade('bob', 'Math', 90)
+    assert cube.is_current()
+    fresh = RollupCube()
+    fresh.build()
+    assert _cells(get_cube()) == _cells(fresh)
+
+
+def test_changes_without_events_rebuild_the_cube(data_dir):
+    _add_students()
+    assert get_cube().grade_rollup(['department'])['grade_count'].tolist() == [1]
+    grades = read_table("data/grades.csv")
+    grades.loc[grades['username'] == 'bob', 'Math'] = 60.0
+    if 'bob' not in grades['username'].values:
+        grades.loc[len(grades), ['username', 'Math']] = ['bob', 60.0]
+    write_table(grades, "data/grades.csv")
+    rollup = get_cube().grade_rollup(['department'])
+    assert rollup['grade_count'].tolist() == [2]
+    assert rollup['mean_grade'].tolist() == [65.0]
@@ -0,0 +1,141 @@
+import os
+import threading
+
+import pandas as pd
+
+import admin
+import shards
+import student
+import wal
+from mat import StudentAnalytics
+from tables import read_table, write_table
+
+
+def _add_student(username, department):
+    admin.add_user(username, username.title(), f"{username}pw1", 'student', department=department, level='1')
+
+
+def _grades(username):
+    return {grade['subject']: grade['grade'] for grade in student.get_student_grades(username)}
+
+
+def _shard_rows(shard, table, username):
+    path = shards.get_store().shard_path(shard, table)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['username'])
+    rows = read_table(path)
+    return rows[rows['username'] == username]
+
+
+def test_department_spellings_share_a_shard(data_dir):
+    _add_student('alice', 'Computer Science')
+    _add_student('bob', ' computer  science ')
+    assert shards.get_store().build('department')[0]
+    store = shards.get_store()
+    assert [shard for shard in store.shards() if shard != shards.UNASSIGNED] == ['computer-science']
+    assert store.manifest()['shards']['computer-science'] == 'Computer Science'
+    assert store.shard_of('alice') == store.shard_of('bob') == 'computer-science'
+
+
+def test_writes_are_routed_to_the_shards(data_dir):
+    _add_student('alice', 'IT')
+    _add_student('bob', 'Physics')
+    assert shards.get_store().build('department')[0]
+    store = shards.get_store()
+
+    student.add_student_grade('alice', 'Math', 81)
+    assert store.current_manifest() is not None
+    assert store.table_path('alice', 'grades') == store.shard_path('it', 'grades')
+    assert float(_shard_rows('it', 'grades', 'alice')['Math'].iloc[0]) == 81
+    assert _shard_rows('physics', 'grades', 'alice').empty
+
+    # A new department spelled differently from an existing one joins its shard
+    admin.update_student_profile('alice', {'department': ' physics'})
+    assert store.shard_of('alice') == 'physics'
+    assert float(_shard_rows('physics', 'grades', 'alice')['Math'].iloc[0]) == 81
+    assert _shard_rows('it', 'grades', 'alice').empty
+    assert _grades('alice') == {'Math': 81.0}
+
+
+def test_reads_take_no_lock_and_stale_shards_are_rebuilt_in_the_background(data_dir):
+    _add_student('alice', 'IT')
+    assert shards.get_store().build('department')[0]
+    store = shards.get_store()
+    # A change the shards did not follow, as a snapshot restore makes
+    grades = read_table("data/grades.csv")
+    grades.loc[len(grades)] = {'username': 'alice', 'Math': '64'}
+    write_table(grades, "data/grades.csv")
+
+    release = threading.Event()
+    held = threading.Event()
+
+    def hold_apply_lock():
+        with wal.get_apply_lock():
+            held.set()
+            release.wait(10)
+
+    holder = threading.Thread(target=hold_apply_lock)
+    holder.start()
+    held.wait(10)
+    results = []
+    reader = threading.Thread(target=lambda: results.append(_grades('alice')))
+    reader.start()
+    reader.join(5)
+    try:
+        assert not reader.is_alive()
+        # Served from the whole table while the shards are stale
+        assert results == [{'Math': 64.0}]
+        assert store.current_manifest() is None
+    finally:
+        release.set()
+        holder.join()
+
+    store.wait(10)
+    assert store.current_manifest() is not None
+    assert float(_shard_rows('it', 'grades', 'alice')['Math'].iloc[0]) == 64
+
+
+def test_group_statistics_merge_department_spellings(data_dir):
+    _add_student('alice', 'Computer Science')
+    _add_student('bob', 'computer science ')
+    student.add_student_grade('alice', 'Math', 70)
+    student.add_student_grade('bob', 'Math', 90)
+    analytics = StudentAnalytics()
+
+    departments = analytics.get_group_statistics()
+    departments = departments[departments['department'].notna()]
+    assert list(departments['department']) == ['Computer Science']
+    assert int(departments['students'].iloc[0]) == 2
+    assert float(departments['mean_grade'].iloc[0]) == 80.0
+
+    levels = analytics.get_group_statistics(department='COMPUTER SCIENCE')
+    assert list(levels['level']) == [1.0]
+    assert int(levels['grade_count'].iloc[0]) == 2
+
+
+def _count_grade_rows(shard_dir):
+    path = os.path.join(shard_dir, "grades.csv")
+    return len(read_table(path)) if os.path.exists(path) else 0
+
+
+def test_map_shards_reuses_one_worker_pool_while_threads_run(data_dir):
+    _add_student('alice', 'IT')
+    _add_student('bob', 'Art')
+    student.add_student_grade('alice', 'Math', 70)
+    student.add_student_grade('bob', 'Math', 80)
+    assert shards.get_store().build('department')[0]
+    # A thread like the GUI's or the rebuild thread is running
+    stop = threading.Event()
+    busy = threading.Thread(target=stop.wait)
+    busy.start()
+    try:
+        counts = shards.map_shards(_count_grade_rows, workers=2)
+        pool = shards._pool[0]
+        shards._results.clear()
+        assert shards.map_shards(_count_grade_rows, workers=2) == counts
+    finally:
+        stop.set()
+        busy.join()
+    assert counts['it'] == counts['art'] == 1
+    assert shards._pool[0] is pool
+    assert pool._ctx.get_start_method() != 'fork'
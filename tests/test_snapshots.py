@@ -0,0 +1,104 @@
+import os
+import zlib
+import fcntl
+
+import admin
+import snapshots
+import student
+import wal
+from tables import read_table
+
+
+def _contents():
+    return {name: open(path, 'rb').read() for name, path in snapshots.TABLES.items() if os.path.exists(path)}
+
+
+def _add_alice():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+    student.add_student_grade('alice', 'Math', 70)
+    student.add_student_eca('alice', 'Chess', 'Member', 3)
+
+
+def test_restore_round_trips_every_table(data_dir):
+    _add_alice()
+    success, message, first = snapshots.take_snapshot()
+    assert success, message
+    before = _contents()
+
+    student.add_student_grade('alice', 'Math', 95)
+    admin.add_user('bob', 'Bob B', 'bobpw123', 'student')
+    admin.remove_user('alice')
+    assert _contents() != before
+
+    success, message = snapshots.restore(first['id'])
+    assert success, message
+    assert _contents() == before
+
+
+def test_unchanged_tables_are_not_stored_again(data_dir):
+    _add_alice()
+    snapshots.take_snapshot()
+    success, message, manifest = snapshots.take_snapshot()
+    assert success and manifest['new_blocks'] == 0 and manifest['bytes_read'] == 0
+
+    student.add_student_grade('alice', 'Math', 80)
+    success, message, manifest = snapshots.take_snapshot()
+    assert manifest['new_blocks'] >= 1
+    assert manifest['bytes_read'] == os.path.getsize("data/grades.csv")
+
+
+def test_restore_to_a_point_in_time(data_dir):
+    _add_alice()
+    first = snapshots.take_snapshot()[2]
+    student.add_student_grade('alice', 'Math', 55)
+    second = snapshots.take_snapshot()[2]
+
+    assert snapshots.find_snapshot(first['time'])['id'] == first['id']
+    assert snapshots.find_snapshot(second['time'] + 1)['id'] == second['id']
+    assert snapshots.find_snapshot(first['time'] - 1) is None
+    assert snapshots.restore(first['time'])[0]
+    assert read_table("data/grades.csv").set_index('username').loc['alice', 'Math'] == 70
+
+
+def test_interrupted_change_does_not_block_restore_or_come_back(data_dir):
+    _add_alice()
+    snapshot = snapshots.take_snapshot()[2]
+    # A change left by a crashed process
+    log = wal.get_log()
+    call_id = log.new_id()
+    log.append({'id': call_id, 'op': 'student.add_student_grade', 'args': ['alice', 'Math', 5], 'kwargs': {}})
+
+    success, message = snapshots.restore(snapshot['id'])
+    assert success, message
+    assert not wal._pending(log.records())
+    assert wal.recover() == 0
+    assert read_table("data/grades.csv").set_index('username').loc['alice', 'Math'] == 70
+
+
+def test_snapshot_waits_for_calls_in_progress(data_dir):
+    fd = os.open(wal.LOCK_FILE, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        with wal.exclusive(blocking=False) as locked:
+            assert not locked
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    with wal.exclusive(blocking=False) as locked:
+        assert locked
+        # Reentrant within the thread
+        with wal.exclusive() as again:
+            assert again
+
+
+def test_damaged_block_is_detected(data_dir):
+    _add_alice()
+    manifest = snapshots.take_snapshot()[2]
+    digest = manifest['tables']['grades']['blocks'][0][0]
+    path = snapshots._object_path(snapshots.SNAPSHOT_DIR, digest)
+    with open(path, 'wb') as f:
+        f.write(zlib.compress(b"tampered"))
+    before = _contents()
+    success, message = snapshots.restore(manifest['id'])
+    assert not success and 'damaged' in message
+    assert _contents() == before
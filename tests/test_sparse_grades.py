@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+import sparse_grades
+from mat import grade_aggregates
+from sparse_grades import SparseMatrix, read_grades, row_pairs
+
+
+def _dense(seed=0, rows=50, columns=5):
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 101, size=(rows, columns)).astype(np.float32)
+    values[rng.random(values.shape) < 0.5] = np.nan
+    return values
+
+
+def _write_grades(path, values, names=None):
+    names = names or [f"s{i}" for i in range(len(values))]
+    df = pd.DataFrame(values, columns=[f"subject{j}" for j in range(values.shape[1])])
+    df.insert(0, 'username', names)
+    df.to_csv(path, index=False)
+    return df
+
+
+def test_matrix_matches_the_dense_array():
+    values = _dense()
+    names = np.array([f"s{i}" for i in range(len(values))], dtype=object)
+    matrix = SparseMatrix.from_dense(values, names, list('ABCDE'))
+
+    assert matrix.nnz == np.count_nonzero(~np.isnan(values))
+    assert np.array_equal(matrix.to_dense(), values.astype(float), equal_nan=True)
+    assert np.array_equal(matrix.column_counts(), (~np.isnan(values)).sum(axis=0))
+    assert np.allclose(matrix.column_sums(), np.nansum(values, axis=0))
+    assert np.array_equal(matrix.column('C'), values[:, 2][~np.isnan(values[:, 2])])
+    row = matrix.row('s7')
+    expected = pd.Series(values[7], index=list('ABCDE')).dropna()
+    assert row.index.tolist() == expected.index.tolist() and np.array_equal(row.to_numpy(), expected.to_numpy())
+    assert matrix.row('nobody').empty
+
+
+def test_stack_and_coordinates_agree_with_from_dense():
+    values = _dense(1)
+    names = np.array([f"s{i}" for i in range(len(values))], dtype=object)
+    whole = SparseMatrix.from_dense(values, names, list('ABCDE'))
+    stacked = SparseMatrix.stack([SparseMatrix.from_dense(values[:20], names[:20], list('ABCDE')),
+                                  SparseMatrix.from_dense(values[20:], names[20:], list('ABCDE'))])
+    assert np.array_equal(stacked.to_dense(), whole.to_dense(), equal_nan=True)
+
+    rows, columns = np.nonzero(~np.isnan(values))
+    order = np.random.default_rng(2).permutation(len(rows))
+    shuffled = SparseMatrix.from_coordinates(rows[order], columns[order], values[rows, columns][order],
+                                             names, list('ABCDE'))
+    assert np.array_equal(shuffled.to_dense(), whole.to_dense(), equal_nan=True)
+
+
+def test_row_pairs_give_the_dense_product():
+    values = _dense(3)
+    names = np.arange(len(values))
+    matrix = SparseMatrix.from_dense(values, names, list('ABCDE'))
+    product = np.zeros((5, 5))
+    for left, right in row_pairs(matrix, matrix, block_entries=7):
+        np.add.at(product, (matrix.indices[left], matrix.indices[right]),
+                  matrix.data[left].astype(float) * matrix.data[right])
+    dense = np.nan_to_num(values.astype(float))
+    assert np.allclose(product, dense.T @ dense)
+
+
+def test_first_rows_keeps_the_first_of_repeated_names():
+    values = np.array([[1, np.nan], [2, 3], [4, 5]], dtype=np.float32)
+    matrix = SparseMatrix.from_dense(values, np.array(['a', 'b', 'a'], dtype=object), ['x', 'y'])
+    first = matrix.first_rows()
+    assert list(first.row_names) == ['a', 'b']
+    assert np.array_equal(first.to_dense(), values[:2].astype(float), equal_nan=True)
+    assert matrix.row('a').to_dict() == {'x': 1.0}
+
+
+def test_read_grades_in_chunks_matches_the_file(workdir):
+    values = _dense(4, rows=23)
+    _write_grades(workdir / "grades.csv", values)
+    matrix = read_grades(str(workdir / "grades.csv"), chunksize=5)
+    assert matrix.shape == values.shape
+    assert matrix.column_names == [f"subject{j}" for j in range(5)]
+    assert np.array_equal(matrix.to_dense(), values.astype(float), equal_nan=True)
+
+
+def test_grade_aggregates_count_every_grade(workdir):
+    values = _dense(5, rows=31)
+    (workdir / "shard").mkdir()
+    _write_grades(workdir / "shard" / "grades.csv", values)
+    aggregates = grade_aggregates(str(workdir / "shard"), chunksize=4)
+    expected = pd.Series(values[~np.isnan(values)].astype(float)).value_counts()
+    assert aggregates['rows'] == 31
+    assert aggregates['counts'].sort_index().to_dict() == expected.sort_index().to_dict()
+    # Aggregates read the file in chunks and do not cache a matrix
+    assert not sparse_grades._cache
+
+
+def test_cache_is_bounded(workdir, monkeypatch):
+    for name in ("a.csv", "b.csv"):
+        _write_grades(workdir / name, _dense(6, rows=40))
+    first = read_grades(str(workdir / "a.csv"))
+    assert read_grades(str(workdir / "a.csv")) is first
+    size = sparse_grades._cache[str(workdir / "a.csv")][2]
+
+    # Room for one matrix: reading the second evicts the first
+    monkeypatch.setattr(sparse_grades, 'CACHE_BYTES', size + 1)
+    read_grades(str(workdir / "b.csv"))
+    assert list(sparse_grades._cache) == [str(workdir / "b.csv")]
+
+    # A matrix larger than the limit is not kept
+    monkeypatch.setattr(sparse_grades, 'CACHE_BYTES', 10)
+    sparse_grades._cache.clear()
+    assert read_grades(str(workdir / "a.csv")) is not read_grades(str(workdir / "a.csv"))
+    assert not sparse_grades._cache
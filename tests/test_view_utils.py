@@ -0,0 +1,85 @@
+import math
+import pandas as pd
+from view_utils import TreeviewSync, display_value
+
+
+class FakeTree:
+    """Records the Treeview calls made by TreeviewSync"""
+
+    def __init__(self):
+        self.rows = {}
+        self.order = []
+        self.calls = []
+        self._next = 0
+
+    def insert(self, parent, index, values):
+        self._next += 1
+        item = f"I{self._next}"
+        self.rows[item] = values
+        self.order.insert(len(self.order) if index == 'end' else index, item)
+        self.calls.append(('insert', values))
+        return item
+
+    def move(self, item, parent, index):
+        self.order.remove(item)
+        self.order.insert(index, item)
+        self.calls.append(('move', item))
+
+    def shown(self):
+        return [self.rows[item] for item in self.order]
+
+    def item(self, item, values):
+        self.rows[item] = values
+        self.calls.append(('item', values))
+
+    def delete(self, item):
+        del self.rows[item]
+        self.order.remove(item)
+        self.calls.append(('delete', item))
+
+
+def test_missing_values_do_not_count_as_changes():
+    tree = FakeTree()
+    sync = TreeviewSync(tree)
+    rows = [('s1', ('s1', float('nan'), None)), ('s2', ('s2', pd.NA, 70.0))]
+    assert sync.sync(rows) == 2
+    assert sync.sync([('s1', ('s1', math.nan, None)), ('s2', ('s2', None, 70.0))]) == 0
+    assert tree.rows['I1'] == ('s1', '', '')
+
+
+def test_changed_added_and_removed_rows():
+    tree = FakeTree()
+    sync = TreeviewSync(tree)
+    sync.sync([('a', (1,)), ('b', (2,))])
+    assert sync.sync([('a', (1,)), ('b', (3,)), ('c', (4,))]) == 2
+    assert sync.sync([('c', (4,))]) == 2
+    assert list(tree.rows.values()) == [(4,)]
+
+
+def test_rows_follow_the_given_order():
+    tree = FakeTree()
+    sync = TreeviewSync(tree)
+    sync.sync([('a', (1,)), ('c', (3,))])
+    # A new row is inserted in its sorted position, without moving the others
+    assert sync.sync([('a', (1,)), ('b', (2,)), ('c', (3,))]) == 1
+    assert tree.shown() == [(1,), (2,), (3,)]
+    assert not [call for call in tree.calls if call[0] == 'move']
+    # Sorting the other way moves the existing rows
+    sync.sync([('c', (3,)), ('b', (2,)), ('a', (1,)), ('d', (0,))])
+    assert tree.shown() == [(3,), (2,), (1,), (0,)]
+
+
+def test_duplicate_keys_are_shown_and_reported(capsys):
+    tree = FakeTree()
+    sync = TreeviewSync(tree)
+    assert sync.sync([('a', (1,)), ('a', (2,)), ('b', (3,))]) == 3
+    assert sync.duplicates == ['a']
+    assert sorted(tree.rows.values()) == [(1,), (2,), (3,)]
+    assert "appear more than once" in capsys.readouterr().out
+
+
+def test_display_value():
+    assert display_value(float('nan')) == ''
+    assert display_value(pd.NA) == ''
+    assert display_value(0) == 0
+    assert display_value('x') == 'x'
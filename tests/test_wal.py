@@ -0,0 +1,138 @@
+import os
+import fcntl
+
+import admin
+import student
+import wal
+from tables import read_table
+
+
+def _grade(username, subject):
+    grades = read_table("data/grades.csv").set_index('username')
+    return grades.loc[username, subject]
+
+
+def _crashed_call(op, *args, started=True):
+    """Log a call as a process that crashed while applying it would have left it"""
+    log = wal.get_log()
+    call_id = log.new_id()
+    log.append({'id': call_id, 'op': op, 'args': list(args), 'kwargs': {}, 'actor': 'crashed'})
+    if started:
+        log.append({'start': call_id, 'files': wal._file_states()})
+    return call_id
+
+
+def _pending_ids():
+    return [record['id'] for record in wal._pending(wal.get_log().records())]
+
+
+def _add_alice():
+    admin.add_user('alice', 'Alice A', 'alicepw1', 'student', department='IT', level='1')
+
+
+def test_recover_replays_an_interrupted_call(data_dir):
+    _add_alice()
+    _crashed_call('student.add_student_grade', 'alice', 'Math', 75)
+    assert wal.recover() == 1
+    assert _grade('alice', 'Math') == 75
+    assert not _pending_ids() and wal.get_log().size() == 0
+
+
+def test_recover_skips_calls_superseded_by_later_changes(data_dir):
+    _add_alice()
+    _crashed_call('student.add_student_grade', 'alice', 'Math', 10)
+    _crashed_call('student.add_student_grade', 'alice', 'Physics', 70)
+    # Made after the crash by another process, and completed
+    assert student.add_student_grade('alice', 'Math', 52)
+
+    assert wal.recover() == 1
+    assert _grade('alice', 'Math') == 52
+    assert _grade('alice', 'Physics') == 70
+
+
+def test_whole_user_changes_supersede_earlier_calls(data_dir):
+    _add_alice()
+    _crashed_call('student.add_student_eca', 'alice', 'Chess', 'Member', 3)
+    # A grade change is another table and does not supersede it; replacing all activities does
+    assert student.add_student_grade('alice', 'Math', 60)
+    assert admin.update_student_eca('alice', {'Drama': {'role': 'Lead', 'hours_per_week': 2}})[0]
+    assert wal.recover() == 0
+    eca = read_table("data/eca.csv")
+    assert eca.loc[eca['username'] == 'alice', 'activity'].tolist() == ['Drama']
+
+
+def test_crashed_call_does_not_block_the_checkpoint(data_dir):
+    _add_alice()
+    _crashed_call('student.add_student_grade', 'alice', 'Math', 88)
+    assert wal.checkpoint()
+    assert _grade('alice', 'Math') == 88
+    assert wal.get_log().size() == 0
+
+
+def test_calls_in_progress_in_another_process_are_left_alone(data_dir):
+    _add_alice()
+    # Another process holds the shared lock while its call is in progress
+    fd = os.open(wal.LOCK_FILE, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        call_id = _crashed_call('student.add_student_grade', 'alice', 'Math', 40)
+        assert not wal.checkpoint()
+        assert _pending_ids() == [call_id]
+        assert student.add_student_grade('alice', 'Physics', 90)
+        assert _pending_ids() == [call_id]
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    # Once that process is gone the call is recovered
+    assert wal.recover() == 1
+    assert _grade('alice', 'Math') == 40
+
+
+def test_recover_cuts_off_a_partial_append(data_dir):
+    _crashed_call('admin.import_users', [
+        {'username': 'bob', 'full_name': 'Bob B', 'password': 'bobpw123', 'role': 'student',
+         'email': '', 'phone': '', 'address': '', 'department': 'IT', 'level': '1'}])
+    with open("data/users.csv", 'a') as f:
+        f.write("bob,Bob B,stu")
+    assert wal.recover() == 1
+    users = read_table("data/users.csv")
+    assert users['username'].tolist().count('bob') == 1
+    assert read_table("data/passwords.csv")['username'].tolist().count('bob') == 1
+
+
+def test_a_call_that_cannot_be_logged_fails_like_the_function(data_dir, monkeypatch, capsys):
+    _add_alice()
+    capsys.readouterr()
+
+    def full(record, durable=True):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(wal.get_log(), 'append', full)
+    success, message = admin.remove_user('alice')
+    assert not success and message == "Error writing the write-ahead log: disk full"
+    success, message, errors = admin.remove_users(['alice'])
+    assert not success and errors == []
+    assert capsys.readouterr().out == ""
+    # Functions returning a bare flag keep reporting their errors on the console
+    assert student.add_student_grade('alice', 'Math', 75) is False
+    assert "disk full" in capsys.readouterr().out
+    monkeypatch.undo()
+    os.chdir(data_dir.parent)
+    assert 'alice' in set(read_table("data/users.csv")['username'])
+
+
+def test_functions_without_a_failure_result_raise(data_dir, monkeypatch):
+    @wal.logged
+    def change(username):
+        return True
+
+    def full(record, durable=True):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(wal.get_log(), 'append', full)
+    try:
+        change('alice')
+    except OSError as e:
+        assert str(e) == "disk full"
+    else:
+        raise AssertionError("the call was not failed")
@@ -1,6 +1,9 @@
+import sys
 import tkinter as tk
 from tkinter import ttk, messagebox
-from auth import authenticate
+from auth import authenticate, initialize_data_files
+from profiling import profiled
+import profiling
 from admin_view import AdminView
 from student_view import StudentView
 
@@ -47,6 +50,7 @@ class UserView:
         # Configure grid weights
         login_frame.columnconfigure(1, weight=1)
         
+    @profiled
     def login(self):
         username = self.username_var.get()
         password = self.password_var.get()
@@ -65,9 +69,9 @@ class UserView:
             
             # Open appropriate view based on role
             if user['role'] == 'admin':
-                AdminView(self.root)
+                AdminView(self.root, username=username)
             elif user['role'] == 'student':
-                StudentView(username, self.root)
+                StudentView(username, self.root, session=user)
             else:
                 messagebox.showerror("Error", "Invalid user role")
         else:
@@ -82,5 +86,10 @@ class UserView:
                 
 
 if __name__ == "__main__":
+    # --profile: profile dashboard actions (see profiling.py)
+    if '--profile' in sys.argv[1:]:
+        profiling.enable()
+    # Create missing tables and finish changes interrupted by a crash before any new change
+    initialize_data_files()
     UserView()
     
@@ -0,0 +1,81 @@
+import math
+
+
+def display_value(value):
+    """A cell value as shown in a Treeview: missing values (None, NaN, NA) become ''"""
+    if value is None:
+        return ''
+    try:
+        if value != value or (isinstance(value, float) and math.isnan(value)):
+            return ''
+    except (TypeError, ValueError):
+        # pd.NA cannot be compared
+        return ''
+    return value
+
+
+class TreeviewSync:
+    """
+    Keeps a ttk.Treeview in step with keyed rows without rebuilding it.
+    Each refresh is diffed against the previous snapshot so only the rows that
+    were added, changed or removed cost a Tk call. Rows are kept in the order
+    given; existing rows are only moved when that order changes.
+    """
+
+    def __init__(self, tree):
+        """
+        Args:
+            tree: The Treeview to manage
+        """
+        self.tree = tree
+        self.item_ids = {}    # key -> Treeview item id
+        self.snapshot = {}    # key -> values tuple last written to the tree (in tree order)
+        self.duplicates = []  # keys given more than once in the last sync
+
+    def sync(self, rows):
+        """
+        Apply a new set of rows to the tree. Missing values are shown as ''.
+        Rows repeating a key are all shown (keyed as (key, n) for the n-th
+        repeat) and the repeated keys are listed in self.duplicates.
+        Args:
+            rows: Iterable of (key, values) pairs in display order
+        Returns:
+            Number of rows inserted, updated or deleted
+        """
+        new_snapshot = {}
+        duplicates = {}
+        for key, values in rows:
+            values = tuple(display_value(value) for value in values)
+            if key in new_snapshot:
+                duplicates[key] = duplicates.get(key, 0) + 1
+                key = (key, duplicates[key])
+            new_snapshot[key] = values
+        self.duplicates = list(duplicates)
+        if duplicates:
+            print(f"Warning: {len(duplicates)} keys appear more than once: "
+                  f"{', '.join(str(key) for key in self.duplicates[:5])}")
+
+        touched = 0
+        # Remove rows that no longer exist
+        for key in [key for key in self.snapshot if key not in new_snapshot]:
+            self.tree.delete(self.item_ids.pop(key))
+            touched += 1
+
+        # The remaining rows only need moving if their relative order changed
+        kept = [key for key in self.snapshot if key in new_snapshot]
+        reorder = kept != [key for key in new_snapshot if key in self.snapshot]
+
+        # Insert new rows at their position and update changed ones
+        for index, (key, values) in enumerate(new_snapshot.items()):
+            if key not in self.item_ids:
+                self.item_ids[key] = self.tree.insert('', index, values=values)
+                touched += 1
+                continue
+            if reorder:
+                self.tree.move(self.item_ids[key], '', index)
+            if self.snapshot[key] != values:
+                self.tree.item(self.item_ids[key], values=values)
+                touched += 1
+
+        self.snapshot = new_snapshot
+        return touched
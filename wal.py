@@ -0,0 +1,623 @@
+"""
+Write-ahead log for the data directory.
+
+Functions that change the tables are decorated with @logged. A call is
+first appended to data/wal.log as a JSON record (function name and
+arguments) and fsynced, then applied to the CSV files, then followed by a
+completion record. Table rewrites go through tables.write_table, which
+replaces the file atomically, so a crash leaves either the old or the new
+table; rows appended in place by an interrupted call are cut off again
+using the file sizes noted when it started. recover() (called by
+auth.initialize_data_files when the GUI, admin_cli or api_server starts)
+re-applies every call without a completion record, except calls superseded
+by a later completed call on the same table and key (username, and subject
+or activity): replaying those would overwrite newer data. The logged
+operations set values rather than add to them, so applying one twice gives
+the same tables.
+
+Audit entries (see audit.py) of a call are logged here before it writes its
+tables and appended to the audit log when it finishes, for each table the
+call actually changed. Recovery appends the logged entries of the tables an
+interrupted call had already written, and the replay's entries for the rest.
+Recovery also finishes an interrupted integrity.repair(), which replaces
+several tables outside the log.
+
+Several processes may share the data directory. A process holds a shared
+lock on data/wal.lock while any of its calls is between its log record and
+its completion record; recover() and checkpoint() take the lock exclusively
+(see exclusive()), so every call without a completion record that they see
+belongs to a process that crashed.
+
+fsync is batched with group commit: threads logging while another thread
+is in fsync wait for the next fsync, which covers all of them. Inside
+batch(), records of one thread are written to the OS before each call is
+applied and fsynced once when the batch ends, so bulk edits cost a single
+fsync (a power loss can then lose the end of the batch; a crash of the
+process cannot).
+
+A checkpoint fsyncs the table files and empties the log once it is larger
+than CHECKPOINT_BYTES. It is skipped while a call of any process is in
+progress; calls left behind by crashed processes are recovered first.
+
+    import wal
+
+    @wal.logged
+    def add_student_grade(username, subject, grade): ...
+
+    with wal.batch():
+        for subject, grade in grades.items():
+            add_student_grade(username, subject, grade)
+"""
+import os
+import json
+import time
+import inspect
+import threading
+import contextlib
+from functools import wraps
+import pandas as pd
+import audit
+from tables import json_safe
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks (Windows): only one process may use the data directory at a time
+    fcntl = None
+
+WAL_FILE = "data/wal.log"
+LOCK_FILE = "data/wal.lock"
+TABLE_FILES = ("data/users.csv", "data/passwords.csv", "data/grades.csv", "data/eca.csv")
+TABLE_NAMES = tuple(os.path.splitext(os.path.basename(path))[0] for path in TABLE_FILES)
+# The log is checkpointed (emptied) once it grows past this size
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# Logged functions by name, for replay
+_operations = {}
+# Tables changed by each logged function, to find calls superseded by later ones
+_operation_tables = {}
+# Arguments naming the rows a call changes, within a user's rows
+DETAIL_ARGUMENTS = ('subject', 'activity')
+# Serialises applying logged calls within the process (the tables are rewritten whole)
+_apply_lock = threading.RLock()
+# Per-thread depth of logged calls in progress and batch() nesting
+_state = threading.local()
+_log = None
+_log_lock = threading.Lock()
+# Functions called after each logged call is applied (see after_apply)
+_after_apply = []
+# Logged calls of this process in progress, which hold the shared file lock
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_lock_fd = None
+
+
+class WriteAheadLog:
+    """Append-only JSON lines file with group-commit fsync"""
+
+    def __init__(self, path=WAL_FILE):
+        self.path = path
+        self._fd = None
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        # Records written and records known to be on disk, counted per process
+        self._written = 0
+        self._durable = 0
+        self._next_id = 0
+
+    def _open(self):
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def new_id(self):
+        with self._lock:
+            self._next_id += 1
+            # Process ids keep records of several processes sharing the log apart
+            return f"{os.getpid()}-{int(time.time() * 1000)}-{self._next_id}"
+
+    def append(self, record, durable=True):
+        """
+        Append a record.
+        Args:
+            durable: Wait until the record is fsynced
+        """
+        line = (json.dumps(json_safe(record), default=str) + "\n").encode()
+        with self._lock:
+            os.write(self._open(), line)
+            self._written += 1
+            if durable:
+                self._wait_durable(self._written)
+
+    def sync(self):
+        """fsync every record written so far"""
+        with self._lock:
+            if self._fd is not None:
+                self._wait_durable(self._written)
+
+    def _wait_durable(self, sequence):
+        """Group commit: one thread fsyncs for every record written before it started (caller holds _lock)"""
+        while self._durable < sequence:
+            if self._syncing:
+                self._synced.wait()
+                continue
+            self._syncing = True
+            target = self._written
+            fd = self._fd
+            self._lock.release()
+            try:
+                os.fsync(fd)
+            finally:
+                self._lock.acquire()
+                self._syncing = False
+                self._synced.notify_all()
+            self._durable = max(self._durable, target)
+
+    def records(self):
+        """Read all complete records in the log"""
+        if not os.path.exists(self.path):
+            return []
+        found = []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                # A record cut short by a crash was never acknowledged
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    found.append(json.loads(line))
+                except ValueError:
+                    break
+        return found
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def truncate(self):
+        """Empty the log"""
+        with self._lock:
+            with open(self.path, 'r+b') as f:
+                f.truncate(0)
+                os.fsync(f.fileno())
+            self._durable = self._written
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+def get_log():
+    """Get the write-ahead log of the data directory"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = WriteAheadLog()
+        return _log
+
+
+def get_apply_lock():
+    """Lock held while a logged call is applied; hold it to read the tables between changes"""
+    return _apply_lock
+
+
+def _lock_file():
+    """Descriptor of the lock file, opened once per process (caller holds _in_flight_lock)"""
+    global _lock_fd
+    if _lock_fd is None:
+        directory = os.path.dirname(LOCK_FILE)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        _lock_fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    return _lock_fd
+
+
+@contextlib.contextmanager
+def _in_flight_call():
+    """Hold the shared file lock while a call of this process is in progress"""
+    global _in_flight
+    with _in_flight_lock:
+        if _in_flight == 0 and fcntl is not None:
+            fcntl.flock(_lock_file(), fcntl.LOCK_SH)
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+            if _in_flight == 0 and fcntl is not None:
+                fcntl.flock(_lock_file(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def _exclusive_file_lock(blocking):
+    """Hold the file lock exclusively; yields False if it is busy and blocking is False"""
+    if fcntl is None:
+        yield True
+        return
+    # A separate descriptor, so the lock conflicts with this process's shared lock too
+    directory = os.path.dirname(LOCK_FILE)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def exclusive(blocking=True):
+    """
+    Keep every process from applying logged calls inside the block: the file
+    lock is held exclusively (after the calls in progress have finished) and
+    so is this process's apply lock. Reentrant within a thread.
+    Args:
+        blocking: Wait for calls in progress; otherwise yield False at once if there are any
+    Yields:
+        True if no call can be applied until the block ends
+    """
+    if getattr(_state, 'exclusive', 0):
+        _state.exclusive += 1
+        try:
+            yield True
+        finally:
+            _state.exclusive -= 1
+        return
+    # The file lock is taken first: calls of this process waiting for the
+    # apply lock hold the shared lock and must be able to finish
+    with _exclusive_file_lock(blocking) as locked:
+        if not locked:
+            yield False
+            return
+        with _apply_lock:
+            _state.exclusive = 1
+            try:
+                yield True
+            finally:
+                _state.exclusive = 0
+
+
+def after_apply(callback):
+    """
+    Register a function to call (without arguments) after each logged call,
+    and each replayed one, has been applied. It runs inside the apply lock,
+    so derived data it updates changes together with the tables.
+    """
+    _after_apply.append(callback)
+
+
+def _run_after_apply():
+    for callback in list(_after_apply):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error updating after a logged call: {e}")
+
+
+def _file_states():
+    """Identity and size of each table file, used to undo appends of an interrupted call"""
+    states = {}
+    for path in TABLE_FILES:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            states[path] = [stat.st_ino, stat.st_size]
+    return states
+
+
+def _written_tables(start):
+    """Names of the tables whose files changed since a call started, given its file states"""
+    current = _file_states()
+    return {name for name, path in zip(TABLE_NAMES, TABLE_FILES) if current.get(path) != start.get(path)}
+
+
+def _write_audit(staged, written):
+    """Write a call's staged audit entries of the tables it did write"""
+    audit.append_entries("".join(text for table, text in staged if table in written))
+
+
+def _pending(records):
+    """Call records without a completion record, in log order"""
+    done = {record['done'] for record in records if 'done' in record}
+    return [record for record in records if 'op' in record and record['id'] not in done]
+
+
+def _call_keys(record):
+    """
+    Rows a logged call changes, as (table, username, subject or activity or
+    None for all of the user's rows).
+    Returns:
+        Set of keys, or None if they cannot be told
+    """
+    tables = _operation_tables.get(record['op'])
+    function = _operations.get(record['op'])
+    if not tables or function is None:
+        return None
+    try:
+        arguments = inspect.signature(function).bind(*record.get('args', []),
+                                                     **record.get('kwargs', {})).arguments
+    except TypeError:
+        return None
+    if 'username' in arguments:
+        rows = [{**arguments, 'username': arguments['username']}]
+    elif 'usernames' in arguments:
+        rows = [{'username': username} for username in arguments['usernames']]
+    elif isinstance(arguments.get('file_or_records'), list):
+        rows = arguments['file_or_records']
+    else:
+        return None
+    keys = set()
+    for row in rows:
+        detail = next((row[name] for name in DETAIL_ARGUMENTS if row.get(name) not in (None, '')), None)
+        keys.update((table, str(row.get('username')), None if detail is None else str(detail))
+                    for table in tables)
+    return keys
+
+
+def _overlaps(keys, other_keys):
+    """Whether two calls change some of the same rows"""
+    for table, username, detail in keys:
+        for other_table, other_username, other_detail in other_keys:
+            if (table == other_table and username == other_username
+                    and (detail is None or other_detail is None or detail == other_detail)):
+                return True
+    return False
+
+
+def _superseded(records, pending):
+    """
+    Ids of pending calls that a later completed call changed some of the same
+    rows of. Replaying them would put back older values over newer ones.
+    """
+    done = {record['done'] for record in records if 'done' in record}
+    pending_ids = {record['id'] for record in pending}
+    superseded = set()
+    later_keys = []
+    # Walk the log backwards, collecting the keys of the completed calls seen so far
+    for record in reversed(records):
+        if 'op' not in record:
+            continue
+        keys = _call_keys(record)
+        if record['id'] in pending_ids:
+            if keys is not None and any(_overlaps(keys, other) for other in later_keys):
+                superseded.add(record['id'])
+        elif record['id'] in done and keys is not None:
+            later_keys.append(keys)
+    return superseded
+
+
+def _materialise(value):
+    """Turn bulk input into a JSON-friendly list so it can be logged and still passed on"""
+    if isinstance(value, pd.DataFrame):
+        return value.to_dict('records')
+    if isinstance(value, (set, frozenset, tuple)) or inspect.isgenerator(value):
+        return list(value)
+    return value
+
+
+def logged(function=None, files=(), tables=(), failure=None):
+    """
+    Decorator writing each call of a function that changes the tables to the
+    write-ahead log before running it.
+    Args:
+        function: The function to wrap (when used as @logged)
+        files: Parameters that may be a path to a CSV file; the rows are logged
+            instead of the path so the call can be replayed after the file is gone
+        tables: Names of the tables the function changes; recovery skips an
+            interrupted call when a later call changed the same rows of them
+        failure: Function turning an error message into the function's failure
+            result (e.g. (False, message)), returned when the call cannot be
+            logged; without it the error is raised
+    """
+    def decorate(function):
+        name = f"{function.__module__}.{function.__qualname__}"
+        signature = inspect.signature(function)
+        _operations[name] = function
+        _operation_tables[name] = tuple(tables)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            # Calls made by a logged call are replayed as part of it
+            if getattr(_state, 'depth', 0):
+                return function(*args, **kwargs)
+            with _in_flight_call():
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    for parameter, value in bound.arguments.items():
+                        if parameter in files and isinstance(value, (str, os.PathLike)):
+                            value = pd.read_csv(value, dtype=str, keep_default_na=False)
+                        bound.arguments[parameter] = _materialise(value)
+                    log = get_log()
+                    call_id = log.new_id()
+                    # Threads log outside _apply_lock so that their fsyncs can be grouped
+                    log.append({'id': call_id, 'op': name, 'args': bound.args, 'kwargs': bound.kwargs,
+                                'actor': audit.get_actor(), 'time': time.time()},
+                               durable=not getattr(_state, 'batch', 0))
+                except Exception as e:
+                    # Nothing was applied; fail the way the function itself does
+                    if failure is None:
+                        raise
+                    return failure(f"Error writing the write-ahead log: {e}")
+
+                with _apply_lock:
+                    _state.depth = 1
+                    staged = []
+
+                    def stage(table, text):
+                        # Logged before the table is written, so a crash cannot lose the entries
+                        log.append({'audit': call_id, 'table': table, 'entries': text}, durable=False)
+                        staged.append((table, text))
+                    start = _file_states()
+                    try:
+                        log.append({'start': call_id, 'files': start}, durable=False)
+                        with audit.staging(stage):
+                            result = function(*bound.args, **bound.kwargs)
+                    finally:
+                        _state.depth = 0
+                        _write_audit(staged, _written_tables(start))
+                        _run_after_apply()
+                        # Completion records ride along with the next fsync
+                        log.append({'done': call_id}, durable=False)
+            # Outside the shared lock, which the checkpoint needs to be free
+            _maybe_checkpoint(log)
+            return result
+        return wrapper
+
+    if function is not None:
+        return decorate(function)
+    return decorate
+
+
+@contextlib.contextmanager
+def batch():
+    """Log the calls made inside the block with a single fsync at the end"""
+    _state.batch = getattr(_state, 'batch', 0) + 1
+    try:
+        yield
+    finally:
+        _state.batch -= 1
+        if not _state.batch:
+            get_log().sync()
+
+
+def _maybe_checkpoint(log):
+    if log.size() > CHECKPOINT_BYTES and not getattr(_state, 'batch', 0):
+        checkpoint(log)
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def checkpoint(log=None):
+    """
+    Make the tables durable and empty the log. Skipped while a call of any
+    process is in progress; calls left by crashed processes are recovered
+    first (see recover).
+    Returns:
+        True if the log was emptied
+    """
+    log = log or get_log()
+    with exclusive(blocking=False) as locked:
+        if not locked:
+            return False
+        _recover_pending(log)
+        return _checkpoint(log)
+
+
+def _checkpoint(log):
+    """Fsync the tables and empty the log (caller holds exclusive())"""
+    log.sync()
+    for path in TABLE_FILES:
+        if os.path.exists(path):
+            _fsync_path(path)
+    directory = os.path.dirname(log.path)
+    if directory and hasattr(os, 'O_DIRECTORY'):
+        # Make the atomic renames of the table files durable too
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    if os.path.exists(log.path):
+        log.truncate()
+    return True
+
+
+def _undo_appends(start):
+    """Cut off rows appended in place by an interrupted call, given its start record"""
+    for path, (inode, size) in start['files'].items():
+        if os.path.exists(path):
+            stat = os.stat(path)
+            # A table rewritten by write_table is a new file and complete
+            if stat.st_ino == inode and stat.st_size > size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+
+def _recover_pending(log):
+    """
+    Re-apply the calls without a completion record (caller holds exclusive(),
+    so their processes have crashed).
+    Returns:
+        Number of calls re-applied
+    """
+    # Register the logged operations
+    import admin  # noqa: F401
+    import student  # noqa: F401
+    import integrity
+
+    # A repair runs under exclusive(), so it is older than every pending call
+    integrity.finish_repair(os.path.dirname(TABLE_FILES[0]))
+    records = log.records()
+    pending = _pending(records)
+    if not pending:
+        return 0
+    superseded = _superseded(records, pending)
+    # Only the last call to start can have left a partial append: calls that
+    # started after an interrupted one kept the rows it had appended
+    starts = [record for record in records if 'start' in record]
+    if starts and starts[-1]['start'] in {record['id'] for record in pending}:
+        _undo_appends(starts[-1])
+    replayed = 0
+    staged = {}
+    for record in records:
+        if 'audit' in record:
+            staged.setdefault(record['audit'], []).append((record['table'], record['entries']))
+    starts = {record['start']: record for record in starts}
+    for record in pending:
+        function = _operations.get(record['op'])
+        if record['id'] in superseded:
+            print(f"Skipping interrupted {record['op']}: later changes replaced it")
+        elif function is None:
+            print(f"Cannot replay unknown operation {record['op']}")
+        else:
+            # Tables written before the crash keep the entries logged then; the
+            # replay finds nothing left to change in them
+            written = _written_tables(starts[record['id']]['files']) if record['id'] in starts else set()
+            replay_staged = []
+            _state.depth = 1
+            try:
+                with audit.acting_as(record.get('actor')), \
+                        audit.staging(lambda table, text: replay_staged.append((table, text))):
+                    function(*record.get('args', []), **record.get('kwargs', {}))
+                replayed += 1
+            except Exception as e:
+                print(f"Error replaying {record['op']}: {e}")
+            finally:
+                _state.depth = 0
+            _write_audit(staged.get(record['id'], []), written)
+            _write_audit(replay_staged, set(TABLE_NAMES) - written)
+        log.append({'done': record['id']}, durable=False)
+    if replayed:
+        _run_after_apply()
+    log.sync()
+    return replayed
+
+
+def recover(log=None):
+    """
+    Re-apply the logged calls that did not complete, then checkpoint. Waits
+    until no process has a call in progress. Call it at startup, before any
+    change is made.
+    Returns:
+        Number of calls re-applied
+    """
+    log = log or get_log()
+    with exclusive():
+        replayed = _recover_pending(log)
+        _checkpoint(log)
+    return replayed